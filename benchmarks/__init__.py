@@ -0,0 +1,12 @@
+import os
+
+import django
+
+
+def setup(settings_module="tests.settings"):
+    """
+    Configure Django for running benchmarks outside of the test suite.
+
+    """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    django.setup()
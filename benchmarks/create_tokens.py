@@ -0,0 +1,71 @@
+"""
+Compare creating tokens one at a time and in bulk.
+
+Run from the root of the repository:
+
+.. code-block:: console
+
+    $ PYTHONPATH=src python -m benchmarks.create_tokens
+
+"""
+
+import argparse
+import datetime
+import time
+
+from . import setup
+
+
+def get_users(count):
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+
+    User = get_user_model()
+    # Hashing passwords is slow. Since tokens only depend on the hash, share it.
+    password = make_password("letmein")
+    last_login = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    return [
+        User(pk=pk, username=f"user{pk}", password=password, last_login=last_login)
+        for pk in range(1, count + 1)
+    ]
+
+
+def measure(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    setup()
+
+    from sesame.tokens import create_token, create_tokens
+
+    users = get_users(args.users)
+
+    def loop():
+        return [create_token(user) for user in users]
+
+    def bulk():
+        return create_tokens(users)
+
+    assert loop() == bulk()
+
+    loop_time = measure(loop, args.repeat)
+    bulk_time = measure(bulk, args.repeat)
+
+    print(f"create_token():  {args.users / loop_time:>12,.0f} tokens/s")
+    print(f"create_tokens(): {args.users / bulk_time:>12,.0f} tokens/s")
+    print(f"speedup:         {loop_time / bulk_time:>12.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Measure the cost of importing django-sesame and of warming it up.
+
+Run from the root of the repository:
+
+.. code-block:: console
+
+    $ PYTHONPATH=src python -m benchmarks.import_time
+
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = [
+    "sesame.settings",
+    "sesame.tokens",
+    "sesame.backends",
+    "sesame.middleware",
+]
+
+# Import Django and set it up first so that only django-sesame is measured.
+IMPORT_SCRIPT = """
+import django
+django.setup()
+import {module}
+"""
+
+WARM_UP_SCRIPT = """
+import time
+import django
+django.setup()
+import sesame.utils
+start = time.perf_counter()
+sesame.utils.warm_up()
+print(int((time.perf_counter() - start) * 1_000_000))
+"""
+
+
+def run(script, importtime=False):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE="tests.settings")
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", script]
+    return subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+
+
+def measure_import(module):
+    """
+    Return the cumulative import time of ``module`` in microseconds.
+
+    """
+    result = run(IMPORT_SCRIPT.format(module=module), importtime=True)
+    # Lines look like: "import time:   self [us] | cumulative | imported package"
+    for line in result.stderr.splitlines():
+        _, cumulative, name = line.split("|")
+        if name.strip() == module:
+            return int(cumulative)
+    # The module was already imported while setting up Django.
+    return 0
+
+
+def measure_warm_up():
+    """
+    Return the duration of :func:`sesame.utils.warm_up` in microseconds.
+
+    """
+    return int(run(WARM_UP_SCRIPT).stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for module in MODULES:
+        duration = statistics.median(measure_import(module) for _ in range(args.repeat))
+        print(f"import {module + ':':<20} {duration:>8,.0f} µs")
+
+    duration = statistics.median(measure_warm_up() for _ in range(args.repeat))
+    print(f"{'warm_up():':<27} {duration:>8,.0f} µs")
+
+
+if __name__ == "__main__":
+    main()
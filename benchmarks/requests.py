@@ -0,0 +1,203 @@
+"""
+Measure authenticating requests end-to-end with concurrent clients.
+
+Run from the root of the repository:
+
+.. code-block:: console
+
+    $ PYTHONPATH=src python -m benchmarks.requests
+
+Requests go through Django's test client to the middleware, the decorator, or
+the login view, with users stored in a SQLite database. Each request carries a
+valid token for a random user and starts without a session, like a click on a
+link in an email.
+
+For each scenario, report latency percentiles, database queries per request,
+and session writes per request.
+
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import random
+import statistics
+import threading
+import time
+
+from . import setup
+
+SCENARIOS = {
+    "middleware": {
+        "path": "/",
+        "middleware": ["sesame.middleware.AuthenticationMiddleware"],
+    },
+    "decorator": {
+        "path": "/authenticate/",
+        "middleware": [],
+    },
+    "login_view": {
+        "path": "/login/",
+        "middleware": [],
+    },
+}
+
+
+def create_users(count):
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+    from django.core.management import call_command
+    from django.db import connection
+
+    name = connection.settings_dict["NAME"]
+    connection.close()
+    if os.path.exists(name):
+        os.remove(name)
+    call_command("migrate", run_syncdb=True, verbosity=0)
+
+    User = get_user_model()
+    # Hashing passwords is slow. Since tokens only depend on the hash, share it.
+    password = make_password("letmein")
+    User.objects.bulk_create(
+        User(username=f"user{pk}", password=password) for pk in range(1, count + 1)
+    )
+    return list(User.objects.all())
+
+
+class SessionWritesCounter(threading.local):
+    """
+    Count how many times the current thread saves a session.
+
+    """
+
+    count = 0
+
+    def install(self):
+        from django.contrib.sessions.backends.cache import SessionStore
+
+        save = SessionStore.save
+        counter = self
+
+        def counting_save(self, *args, **kwargs):
+            counter.count += 1
+            return save(self, *args, **kwargs)
+
+        SessionStore.save = counting_save
+
+
+def run_client(path, parameters, barrier, session_writes):
+    """
+    Send requests with a test client and return their durations and costs.
+
+    """
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    client = Client()
+    results = []
+    try:
+        # Open the database connection and load middleware before measuring.
+        client.get(path)
+        barrier.wait()
+        for params in parameters:
+            client.cookies.clear()
+            session_writes.count = 0
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = client.get(path, params)
+                duration = time.perf_counter() - start
+            assert response.status_code in (200, 302), response.status_code
+            results.append((duration, len(context), session_writes.count))
+    finally:
+        connection.close()
+    return results
+
+
+def run_scenario(scenario, parameters, session_writes, requests, threads):
+    from django.conf import settings
+    from django.test import override_settings
+
+    chunks = [
+        [random.choice(parameters) for _ in range(requests // threads)]
+        for _ in range(threads)
+    ]
+    barrier = threading.Barrier(threads)
+    middleware = settings.MIDDLEWARE + SCENARIOS[scenario]["middleware"]
+    with override_settings(MIDDLEWARE=middleware):
+        with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+            start = time.perf_counter()
+            futures = [
+                executor.submit(
+                    run_client,
+                    SCENARIOS[scenario]["path"],
+                    chunk,
+                    barrier,
+                    session_writes,
+                )
+                for chunk in chunks
+            ]
+            results = [result for future in futures for result in future.result()]
+            elapsed = time.perf_counter() - start
+
+    durations = [duration for duration, _, _ in results]
+    p50, p95, p99 = (
+        statistics.quantiles(durations, n=100)[index] for index in (49, 94, 98)
+    )
+    return {
+        "requests": len(results),
+        "requests_per_sec": len(results) / elapsed,
+        "p50_ms": p50 * 1e3,
+        "p95_ms": p95 * 1e3,
+        "p99_ms": p99 * 1e3,
+        "queries_per_request": statistics.mean(q for _, q, _ in results),
+        "session_writes_per_request": statistics.mean(s for _, _, s in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--requests", type=int, default=2_000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append")
+    parser.add_argument("--output", help="write JSON results to OUTPUT")
+    args = parser.parse_args()
+
+    setup("benchmarks.settings")
+
+    from sesame.utils import get_parameters, warm_up
+
+    warm_up()
+    users = create_users(args.users)
+    parameters = [get_parameters(user) for user in users]
+    session_writes = SessionWritesCounter()
+    session_writes.install()
+
+    report = {
+        "users": args.users,
+        "threads": args.threads,
+        "results": {},
+    }
+    for scenario in args.scenario or SCENARIOS:
+        result = run_scenario(
+            scenario, parameters, session_writes, args.requests, args.threads
+        )
+        report["results"][scenario] = result
+        print(
+            f"{scenario + ':':<12} {result['requests_per_sec']:>8,.0f} req/s  "
+            f"p50 {result['p50_ms']:>6.2f} ms  "
+            f"p95 {result['p95_ms']:>6.2f} ms  "
+            f"p99 {result['p99_ms']:>6.2f} ms  "
+            f"{result['queries_per_request']:.2f} queries/req  "
+            f"{result['session_writes_per_request']:.2f} session writes/req"
+        )
+
+    if args.output is not None:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
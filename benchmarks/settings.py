@@ -0,0 +1,16 @@
+import os
+import tempfile
+
+from tests.settings import *  # noqa: F403
+
+# Threads need a database shared between connections. An in-memory SQLite
+# database is private to each connection.
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.path.join(tempfile.gettempdir(), "sesame-benchmarks.sqlite3"),
+    }
+}
+
+# Django's test runner adds this automatically.
+ALLOWED_HOSTS = ["testserver"]
@@ -0,0 +1,65 @@
+"""
+Compare creating a keyed hash object for each signature and copying one.
+
+Run from the root of the repository:
+
+.. code-block:: console
+
+    $ PYTHONPATH=src python -m benchmarks.sign
+
+"""
+
+import argparse
+import hashlib
+import timeit
+
+from . import setup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=100_000)
+    args = parser.parse_args()
+
+    setup()
+
+    from django.contrib.auth import get_user_model
+
+    from sesame import settings
+    from sesame.tokens_v2 import create_token, get_hashers, parse_token, sign
+
+    key = settings.SIGNING_KEY
+    size = settings.SIGNATURE_SIZE
+    (hasher,) = get_hashers()
+    data = 32 * b"\x00"
+
+    def new():
+        return hashlib.blake2b(
+            data,
+            digest_size=size,
+            key=key,
+            person=b"sesame.tokens_v2",
+        ).digest()
+
+    def copy():
+        return sign(data, hasher)
+
+    assert new() == copy()
+
+    User = get_user_model()
+    user = User(pk=1, username="john", password="md5$salt$" + 32 * "0")
+    token = create_token(user)
+
+    benchmarks = [
+        ("new keyed hash", new),
+        ("copy keyed hash", copy),
+        ("create_token()", lambda: create_token(user)),
+        ("parse_token()", lambda: parse_token(token, lambda pk: user)),
+    ]
+    for name, func in benchmarks:
+        duration = min(timeit.repeat(func, number=args.number, repeat=5))
+        print(f"{name + ':':<16} {duration / args.number * 1e9:>8.0f} ns/op")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Measure creating and parsing tokens across configurations.
+
+Run from the root of the repository:
+
+.. code-block:: console
+
+    $ PYTHONPATH=src python -m benchmarks.tokens --output before.json
+    $ # make changes
+    $ PYTHONPATH=src python -m benchmarks.tokens --output after.json
+    $ PYTHONPATH=src python -m benchmarks.tokens --compare before.json after.json
+
+Users are built in memory and ``get_user`` returns them without querying the
+database. Results reflect CPU cost only.
+
+When there are fallback keys, tokens are parsed after being created with the
+oldest key, which is the worst case for verification.
+
+"""
+
+import argparse
+import datetime
+import importlib
+import itertools
+import json
+import platform
+import sys
+import timeit
+import uuid
+
+from . import setup
+
+TOKENS = ["sesame.tokens_v1", "sesame.tokens_v2", "sesame.tokens_v3"]
+
+MAX_AGES = [None, 300]
+
+FALLBACKS = [0, 1, 2, 3]
+
+SIGNATURE_SIZES = [10, 16, 32]
+
+PKS = {
+    "ShortPacker": 1,
+    "UnsignedShortPacker": 1,
+    "LongPacker": 1,
+    "UnsignedLongPacker": 1,
+    "LongLongPacker": 1,
+    "UnsignedLongLongPacker": 1,
+    "UUIDPacker": uuid.UUID("00000000-0000-4000-8000-000000000001"),
+    "BytesPacker": b"john",
+    "StrPacker": "john",
+}
+
+
+def get_configs():
+    from sesame.packers import PACKERS
+
+    packers = dict.fromkeys(Packer.__name__ for Packer in PACKERS.values())
+    for tokens, packer, max_age, fallbacks in itertools.product(
+        TOKENS, packers, MAX_AGES, FALLBACKS
+    ):
+        # Tokens v1 don't support SESAME_SIGNATURE_SIZE.
+        if tokens == "sesame.tokens_v1":
+            signature_sizes = [None]
+        else:
+            signature_sizes = SIGNATURE_SIZES
+        for signature_size in signature_sizes:
+            yield {
+                "tokens": tokens,
+                "packer": packer,
+                "max_age": max_age,
+                "fallbacks": fallbacks,
+                "signature_size": signature_size,
+            }
+
+
+def get_name(config):
+    name = (
+        f"{config['tokens'].removeprefix('sesame.')} {config['packer']} "
+        f"max_age={config['max_age']} fallbacks={config['fallbacks']}"
+    )
+    if config["signature_size"] is not None:
+        name += f" signature_size={config['signature_size']}"
+    return name
+
+
+def get_settings(config):
+    fallbacks = [f"fallback-{index}" for index in range(config["fallbacks"])]
+    settings = {
+        "SECRET_KEY": "benchmark",
+        "SECRET_KEY_FALLBACKS": fallbacks,
+        "SESAME_TOKENS": [config["tokens"]],
+        "SESAME_PACKER": f"sesame.packers.{config['packer']}",
+        "SESAME_MAX_AGE": config["max_age"],
+    }
+    if config["signature_size"] is not None:
+        settings["SESAME_SIGNATURE_SIZE"] = config["signature_size"]
+    return settings
+
+
+def get_user(config):
+    from django.contrib.auth import get_user_model
+
+    User = get_user_model()
+    return User(
+        pk=PKS[config["packer"]],
+        username="john",
+        password="md5$salt$" + 32 * "0",
+        last_login=datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc),
+    )
+
+
+def measure(func, number, repeat):
+    """
+    Return the best time per call of ``func`` in seconds.
+
+    """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def run(config, number, repeat):
+    from django.test import override_settings
+
+    tokens = importlib.import_module(config["tokens"])
+    user = get_user(config)
+    settings = get_settings(config)
+
+    # Create the token to parse with the oldest key.
+    oldest_key = (settings["SECRET_KEY_FALLBACKS"] or [settings["SECRET_KEY"]])[-1]
+    with override_settings(
+        **{**settings, "SECRET_KEY": oldest_key, "SECRET_KEY_FALLBACKS": []}
+    ):
+        token = tokens.create_token(user)
+
+    results = {}
+    with override_settings(**settings):
+        assert tokens.parse_token(token, lambda pk: user) == user
+
+        create_time = measure(lambda: tokens.create_token(user), number, repeat)
+        parse_time = measure(
+            lambda: tokens.parse_token(token, lambda pk: user), number, repeat
+        )
+
+    for operation, duration in [
+        ("create_token", create_time),
+        ("parse_token", parse_time),
+    ]:
+        results[operation] = {
+            "ops_per_sec": 1 / duration,
+            "ns_per_op": duration * 1e9,
+        }
+    return results
+
+
+def run_all(args):
+    setup()
+
+    import django
+
+    results = []
+    for config in get_configs():
+        name = get_name(config)
+        if args.filter is not None and args.filter not in name:
+            continue
+        for operation, result in run(config, args.number, args.repeat).items():
+            results.append(
+                {
+                    "name": f"{name} {operation}",
+                    "config": config,
+                    "operation": operation,
+                    **result,
+                }
+            )
+            print(
+                f"{name + ' ' + operation:<80} {result['ns_per_op']:>10,.0f} ns/op",
+                file=sys.stderr,
+            )
+
+    report = {
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "number": args.number,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+def compare(before_path, after_path):
+    with open(before_path) as before_file:
+        before = {
+            result["name"]: result for result in json.load(before_file)["results"]
+        }
+    with open(after_path) as after_file:
+        after = {result["name"]: result for result in json.load(after_file)["results"]}
+
+    for name, after_result in after.items():
+        before_result = before.get(name)
+        if before_result is None:
+            continue
+        before_ns, after_ns = before_result["ns_per_op"], after_result["ns_per_op"]
+        change = (after_ns - before_ns) / before_ns
+        print(
+            f"{name:<80} {before_ns:>10,.0f} ns/op -> {after_ns:>10,.0f} ns/op "
+            f"{change:>+8.1%}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=1_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--filter", help="only run configurations matching FILTER")
+    parser.add_argument("--output", help="write JSON results to OUTPUT")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BEFORE", "AFTER"),
+        help="compare two JSON results instead of running benchmarks",
+    )
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare(*args.compare)
+    else:
+        run_all(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class SesameConfig(AppConfig):
+    name = "sesame"
+    verbose_name = "django-sesame"
+
+    def ready(self):
+        # Connect signal receivers that keep CachedModelBackend up to date.
+        from . import backends  # noqa: F401
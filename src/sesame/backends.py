@@ -1,10 +1,18 @@
+import hashlib
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth import backends as auth_backends
 from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_in
+from django.core.cache import caches
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
 
 from . import settings
-from .tokens import parse_token
+from .tokens import aparse_token, get_revocation_fields, parse_token
 
-__all__ = ["ModelBackend", "SesameBackendMixin"]
+__all__ = ["CachedModelBackend", "ModelBackend", "SesameBackendMixin"]
 
 
 class SesameBackendMixin:
@@ -12,6 +20,9 @@ class SesameBackendMixin:
     Mix this class in an authentication backend providing ``get_user(user_id)``
     to create an authentication backend usable with django-sesame.
 
+    If the backend also provides ``aget_user(user_id)``, asynchronous
+    authentication doesn't run ``get_user()`` in a thread.
+
     """
 
     def authenticate(self, request, sesame, scope="", max_age=None):
@@ -23,13 +34,120 @@ class SesameBackendMixin:
         If ``max_age`` is set, override the :data:`SESAME_MAX_AGE` setting.
 
         ``request`` is an :class:`~django.http.HttpRequest` or :obj:`None`.
+        The outcome is remembered for the duration of ``request``.
 
         """
         # This check shouldn't be necessary, but it can avoid problems like
         # issue #37 and Django's built-in backends include similar checks.
         if sesame is None:
             return None
-        return parse_token(sesame, self.get_user, scope, max_age)
+        memo = get_memo(request)
+        memo_key = type(self), sesame, scope, max_age
+        try:
+            return memo[memo_key]
+        except KeyError:
+            pass
+        user = parse_token(sesame, self.get_token_user, scope, max_age)
+        memo[memo_key] = user
+        return user
+
+    async def aauthenticate(self, request, sesame, scope="", max_age=None):
+        """
+        Asynchronous version of :meth:`authenticate`.
+
+        """
+        if sesame is None:
+            return None
+        memo = get_memo(request)
+        memo_key = type(self), sesame, scope, max_age
+        try:
+            return memo[memo_key]
+        except KeyError:
+            pass
+        user = await aparse_token(sesame, self.aget_token_user, scope, max_age)
+        memo[memo_key] = user
+        return user
+
+    def get_token_user(self, user_id):
+        """
+        Fetch the user of a token by primary key.
+
+        The default implementation calls ``get_user()``.
+
+        """
+        return self.get_user(user_id)
+
+    async def aget_token_user(self, user_id):
+        """
+        Asynchronous version of :meth:`get_token_user`.
+
+        The default implementation calls ``aget_user()`` if the backend
+        provides it. Else, it runs ``get_user()`` in a thread.
+
+        """
+        try:
+            aget_user = self.aget_user
+        except AttributeError:  # Django < 5.2 doesn't define a default
+            aget_user = sync_to_async(self.get_user)
+        return await aget_user(user_id)
+
+    def get_users(self, user_ids):
+        """
+        Fetch several users by primary key.
+
+        Return a :class:`dict` mapping primary keys to users. Users that
+        aren't found are omitted.
+
+        The default implementation calls :meth:`get_token_user` for each user.
+        Override it to fetch all users at once.
+
+        """
+        users = {}
+        for user_id in user_ids:
+            user = self.get_token_user(user_id)
+            if user is not None:
+                users[user_id] = user
+        return users
+
+
+# A request may be authenticated several times, for example by the middleware
+# and by a view decorated with authenticate. The outcome is remembered on the
+# request, keyed by backend, token, scope, and max age, so that the token is
+# validated and the user is fetched only once.
+
+
+def get_memo(request):
+    """
+    Return the outcomes of authenticating tokens for ``request``.
+
+    When ``request`` is :obj:`None`, return a :class:`dict` that isn't stored.
+
+    """
+    if request is None:
+        return {}
+    try:
+        return request._sesame_memo
+    except AttributeError:
+        memo = request._sesame_memo = {}
+        return memo
+
+
+def forget_users(request):
+    """
+    Forget the outcomes of authenticating tokens for ``request``.
+
+    Call this function after updating the last login date of a user when
+    single-use tokens are enabled, since it invalidates the user's token.
+
+    """
+    if request is not None and settings.ONE_TIME:
+        request.__dict__.pop("_sesame_memo", None)
+
+
+@receiver(user_logged_in, dispatch_uid="sesame.backends.forget_users_after_login")
+def forget_users_after_login(sender, request, user, **kwargs):
+    # django.contrib.auth.login() updates the last login date.
+    forget_users(request)
 
 
 class ModelBackend(SesameBackendMixin, auth_backends.ModelBackend):
@@ -60,13 +178,320 @@ class ModelBackend(SesameBackendMixin, auth_backends.ModelBackend):
 
         Return :obj:`None` if no active user is found.
 
+        Django also calls this method to load the user of a session. It loads
+        all fields.
+
+        """
+        return self.query_user(user_id)
+
+    async def aget_user(self, user_id):
+        """
+        Asynchronous version of :meth:`get_user`.
+
+        If a subclass overrides :meth:`get_user`, run it in a thread.
+
+        """
+        if type(self).get_user is not ModelBackend.get_user:
+            return await sync_to_async(self.get_user)(user_id)
+        return await self.aquery_user(user_id)
+
+    def get_token_user(self, user_id):
+        """
+        Fetch the user of a token from the database by primary key.
+
+        When the :data:`SESAME_USER_FIELDS` setting is a list, load only the
+        fields returned by :meth:`get_user_fields`.
+
+        If a subclass overrides :meth:`get_user`, call it instead.
+
+        """
+        if type(self).get_user is not ModelBackend.get_user:
+            return self.get_user(user_id)
+        return self.query_user(user_id, deferred=True)
+
+    async def aget_token_user(self, user_id):
+        """
+        Asynchronous version of :meth:`get_token_user`.
+
+        """
+        if type(self).get_user is not ModelBackend.get_user:
+            return await sync_to_async(self.get_user)(user_id)
+        return await self.aquery_user(user_id, deferred=True)
+
+    def get_users(self, user_ids):
+        """
+        Fetch the users of several tokens from the database by primary key in
+        one query.
+
+        Return a :class:`dict` mapping primary keys to active users.
+
+        When the :data:`SESAME_USER_FIELDS` setting is a list, load only the
+        fields returned by :meth:`get_user_fields`.
+
+        If a subclass overrides :meth:`get_user`, call it for each user.
+
+        """
+        if type(self).get_user is not ModelBackend.get_user:
+            return super().get_users(user_ids)
+        return self.query_users(user_ids, deferred=True)
+
+    def get_queryset(self, deferred=False):
+        """
+        Return a queryset of users.
+
+        If ``deferred`` is :obj:`True` and the :data:`SESAME_USER_FIELDS`
+        setting is a list, defer fields not returned by :meth:`get_user_fields`.
+
+        """
+        users = get_user_model()._default_manager.all()
+        if deferred and settings.USER_FIELDS is not None:
+            users = users.only(*self.get_user_fields())
+        return users
+
+    def query_user(self, user_id, deferred=False):
+        """
+        Fetch user from the database by primary key.
+
+        Return :obj:`None` if no active user is found.
+
+        """
+        User = get_user_model()
+        users = self.get_queryset(deferred)
+        try:
+            user = users.get(**{settings.PRIMARY_KEY_FIELD: user_id})
+        except User.DoesNotExist:
+            return None
+        if self.user_can_authenticate(user):
+            return user
+        else:
+            return None
+
+    async def aquery_user(self, user_id, deferred=False):
+        """
+        Fetch user from the database by primary key asynchronously.
+
+        Return :obj:`None` if no active user is found.
+
         """
         User = get_user_model()
+        users = self.get_queryset(deferred)
         try:
-            user = User._default_manager.get(**{settings.PRIMARY_KEY_FIELD: user_id})
+            user = await users.aget(**{settings.PRIMARY_KEY_FIELD: user_id})
         except User.DoesNotExist:
             return None
         if self.user_can_authenticate(user):
             return user
         else:
             return None
+
+    def query_users(self, user_ids, deferred=False):
+        """
+        Fetch several users from the database by primary key in one query.
+
+        Return a :class:`dict` mapping primary keys to active users.
+
+        """
+        users = self.get_queryset(deferred).filter(
+            **{settings.PRIMARY_KEY_FIELD + "__in": user_ids}
+        )
+        return {
+            getattr(user, settings.PRIMARY_KEY_FIELD): user
+            for user in users
+            if self.user_can_authenticate(user)
+        }
+
+    def get_user_fields(self):
+        """
+        Return the names of user fields loaded by :meth:`get_token_user`.
+
+        This includes fields required for validating tokens and for logging
+        users in, followed by fields listed in :data:`SESAME_USER_FIELDS`.
+
+        """
+        User = get_user_model()
+        fields = [User._meta.pk.name, User.USERNAME_FIELD, "password"]
+        if settings.PRIMARY_KEY_FIELD != "pk":
+            fields.append(settings.PRIMARY_KEY_FIELD)
+        try:
+            User._meta.get_field("is_active")
+        except FieldDoesNotExist:
+            pass
+        else:
+            fields.append("is_active")
+        fields.extend(get_revocation_fields())
+        fields.extend(settings.USER_FIELDS)
+        return fields
+
+
+def get_user_cache_key(user_id):
+    """
+    Return the cache key of a user in :class:`CachedModelBackend`.
+
+    """
+    User = get_user_model()
+    digest = hashlib.blake2b(
+        "|".join(
+            [User._meta.label, settings.PRIMARY_KEY_FIELD, repr(user_id)]
+        ).encode(),
+        digest_size=16,
+        person=b"sesame.backends",
+    ).hexdigest()
+    return f"sesame.user.{digest}"
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    Authentication backend that caches users.
+
+    It inherits :class:`ModelBackend`. It stores users in the cache configured
+    by :data:`SESAME_CACHE` for :data:`SESAME_USER_CACHE_TIMEOUT` seconds.
+
+    Saving or deleting a user removes it from the cache. This requires adding
+    ``"sesame"`` to the :setting:`INSTALLED_APPS` setting.
+
+    Replace ``"sesame.backends.ModelBackend"`` with
+    ``"sesame.backends.CachedModelBackend"`` in the
+    :setting:`AUTHENTICATION_BACKENDS` setting to enable it.
+
+    """
+
+    def get_user(self, user_id):
+        """
+        Fetch user from the cache or from the database by primary key.
+
+        Return :obj:`None` if no active user is found.
+
+        """
+        cache = caches[settings.CACHE]
+        cache_key = get_user_cache_key(user_id)
+        user = cache.get(cache_key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(cache_key, user, settings.USER_CACHE_TIMEOUT)
+        return user
+
+    # Cached users are shared with sessions. Load all fields for tokens too.
+
+    def get_token_user(self, user_id):
+        """
+        Fetch the user of a token like :meth:`get_user`.
+
+        """
+        return self.get_user(user_id)
+
+    async def aget_token_user(self, user_id):
+        """
+        Asynchronous version of :meth:`get_token_user`.
+
+        """
+        return await self.aget_user(user_id)
+
+    def get_users(self, user_ids):
+        """
+        Fetch several users from the cache or from the database by primary key.
+
+        Return a :class:`dict` mapping primary keys to active users.
+
+        If a subclass overrides :meth:`get_user`, call it for each user.
+
+        """
+        if type(self).get_user is not CachedModelBackend.get_user:
+            return SesameBackendMixin.get_users(self, user_ids)
+        cache = caches[settings.CACHE]
+        cache_keys = {get_user_cache_key(user_id): user_id for user_id in user_ids}
+        users = {
+            cache_keys[cache_key]: user
+            for cache_key, user in cache.get_many(cache_keys).items()
+        }
+        missing_user_ids = [user_id for user_id in user_ids if user_id not in users]
+        if missing_user_ids:
+            missing_users = self.query_users(missing_user_ids)
+            cache.set_many(
+                {
+                    get_user_cache_key(user_id): user
+                    for user_id, user in missing_users.items()
+                },
+                settings.USER_CACHE_TIMEOUT,
+            )
+            users.update(missing_users)
+        return users
+
+    async def aget_user(self, user_id):
+        """
+        Asynchronous version of :meth:`get_user`.
+
+        If a subclass overrides :meth:`get_user`, run it in a thread.
+
+        """
+        if type(self).get_user is not CachedModelBackend.get_user:
+            return await sync_to_async(self.get_user)(user_id)
+        cache = caches[settings.CACHE]
+        cache_key = get_user_cache_key(user_id)
+        user = await cache.aget(cache_key)
+        if user is None:
+            user = await self.aquery_user(user_id)
+            if user is not None:
+                await cache.aset(cache_key, user, settings.USER_CACHE_TIMEOUT)
+        return user
+
+
+# Updates that don't send signals, like QuerySet.update(), don't invalidate the
+# cache. Django updates the last login date with save(), which is compatible.
+
+
+def is_cache_enabled():
+    """
+    Tell whether a :class:`CachedModelBackend` is configured.
+
+    """
+    # Import here to avoid a circular import: sesame.utils imports this module.
+    from .utils import get_backends
+
+    return any(isinstance(backend, CachedModelBackend) for backend, _ in get_backends())
+
+
+@receiver(pre_save, dispatch_uid="sesame.backends.uncache_user_before_save")
+def uncache_user_before_save(sender, instance, raw, update_fields, **kwargs):
+    # The field used as a primary key may change when it isn't the actual
+    # primary key. Then, the cache key is derived from the previous value.
+    if (
+        raw
+        or sender is not get_user_model()
+        or not is_cache_enabled()
+        or settings.PRIMARY_KEY_FIELD == "pk"
+        or instance.pk is None
+        or (
+            update_fields is not None
+            and settings.PRIMARY_KEY_FIELD not in update_fields
+        )
+    ):
+        return
+    user_ids = sender._default_manager.filter(pk=instance.pk).values_list(
+        settings.PRIMARY_KEY_FIELD, flat=True
+    )
+    for user_id in user_ids:
+        caches[settings.CACHE].delete(get_user_cache_key(user_id))
+
+
+@receiver(post_save, dispatch_uid="sesame.backends.uncache_user_after_save")
+@receiver(post_delete, dispatch_uid="sesame.backends.uncache_user_after_delete")
+def uncache_user(sender, instance, **kwargs):
+    if sender is not get_user_model() or not is_cache_enabled():
+        return
+    uncache_users([instance])
+
+
+def uncache_users(users):
+    """
+    Remove users from the cache of :class:`CachedModelBackend`.
+
+    Call this function after updating users without sending signals.
+
+    """
+    caches[settings.CACHE].delete_many(
+        [
+            get_user_cache_key(getattr(user, settings.PRIMARY_KEY_FIELD))
+            for user in users
+        ]
+    )
@@ -0,0 +1,94 @@
+import collections
+import math
+import threading
+import time
+
+__all__ = ["LRUCache"]
+
+
+class LRUCache:
+    """
+    In-memory cache with a size limit and an expiry time.
+
+    When the cache is full, the least recently used entry is evicted.
+
+    ``ttl`` is the maximum lifetime of entries in seconds or :obj:`None` to
+    keep entries until they're evicted.
+
+    This cache is thread-safe. It isn't shared between processes.
+
+    """
+
+    def __init__(self, size, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Return the value for ``key`` or :obj:`None` if there's no valid entry.
+
+        """
+        with self.lock:
+            try:
+                value, expires_at = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Store ``value`` for ``key``.
+
+        If ``ttl`` is set, the entry expires after ``ttl`` seconds or after the
+        default ``ttl`` of the cache, whichever comes first.
+
+        """
+        ttls = [ttl for ttl in [ttl, self.ttl] if ttl is not None]
+        ttl = min(ttls) if ttls else math.inf
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value, time.monotonic() + ttl
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Remove the entry for ``key``, if there's one.
+
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        """
+        Remove all entries.
+
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def info(self):
+        """
+        Return statistics about the cache as a :class:`dict`.
+
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.entries),
+                "max_size": self.size,
+            }
@@ -1,10 +1,17 @@
 import functools
 
+from asgiref.sync import iscoroutinefunction, sync_to_async
 from django.contrib.auth import login
 from django.contrib.auth.models import AnonymousUser
 from django.core.exceptions import ImproperlyConfigured, PermissionDenied
 
-from .utils import get_user
+from . import throttling
+from .utils import aget_user, aneeds_login, get_user, needs_login
+
+try:
+    from django.contrib.auth import alogin
+except ImportError:  # Django < 5.0
+    alogin = sync_to_async(login)
 
 __all__ = ["authenticate"]
 
@@ -60,6 +67,12 @@ def authenticate(
     Set ``override`` to :obj:`False` to skip authentication if a user is already
     logged in.
 
+    When :ref:`throttling <Throttling>` is enabled, :obj:`authenticate` returns
+    an HTTP 429 Too Many Requests response to clients that sent too many
+    invalid tokens.
+
+    :obj:`authenticate` supports both synchronous and asynchronous views.
+
     """
     if view is None:
         return functools.partial(
@@ -81,6 +94,11 @@ def authenticate(
             raise ImproperlyConfigured(
                 "authenticate(permanent=True) requires django.contrib.sessions"
             )
+        # If the client sent too many invalid tokens, reject the request
+        # without validating the token.
+        if throttling.is_throttled(request):
+            return throttling.get_throttled_response()
+
         # If the user will be logged in, don't update the last login, because
         # login(request, user) will do it. Else, keep the default behavior of
         # updating last login only for one-time tokens.
@@ -91,14 +109,72 @@ def authenticate(
             max_age=max_age,
         )
 
+        if user is None:
+            throttling.record_invalid_token(request)
+
         request.user = user if user is not None else AnonymousUser()
 
         if required and user is None:
             raise PermissionDenied
 
-        if permanent and user is not None:
+        if permanent and user is not None and needs_login(request, user):
             login(request, user)  # updates the last login date
 
         return view(request, *args, **kwargs)
 
-    return wrapper
+    @functools.wraps(view)
+    async def async_wrapper(request, *args, **kwargs):
+        # See wrapper() for comments.
+        if hasattr(request, "user") and not override:
+            user = await get_request_user(request)
+            if user.is_authenticated:
+                # Resolve request.user so that the view doesn't block on it.
+                request.user = user
+                return await view(request, *args, **kwargs)
+
+        if permanent and not hasattr(request, "session"):
+            raise ImproperlyConfigured(
+                "authenticate(permanent=True) requires django.contrib.sessions"
+            )
+        if await throttling.ais_throttled(request):
+            return throttling.get_throttled_response()
+
+        user = await aget_user(
+            request,
+            update_last_login=False if permanent else None,
+            scope=scope.format(*args, **kwargs),
+            max_age=max_age,
+        )
+
+        if user is None:
+            await throttling.arecord_invalid_token(request)
+
+        request.user = user if user is not None else AnonymousUser()
+
+        if required and user is None:
+            raise PermissionDenied
+
+        if permanent and user is not None and await aneeds_login(request, user):
+            await alogin(request, user)
+
+        return await view(request, *args, **kwargs)
+
+    if iscoroutinefunction(view):
+        return async_wrapper
+    else:
+        return wrapper
+
+
+async def get_request_user(request):
+    """
+    Return the user set by Django's authentication middleware asynchronously.
+
+    """
+    try:
+        auser = request.auser
+    except AttributeError:  # Django < 5.0
+        # Evaluating request.user in a thread caches the user.
+        await sync_to_async(lambda: request.user.is_authenticated)()
+        return request.user
+    else:
+        return await auser()
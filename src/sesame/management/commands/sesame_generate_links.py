@@ -0,0 +1,164 @@
+import collections
+import csv
+import functools
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+
+from ... import settings
+from ...tokens import create_tokens, get_revocation_fields
+
+
+def generate_tokens(query, scope):
+    """
+    Create tokens for users selected by ``query``.
+
+    This function runs in worker processes. It receives a query rather than a
+    queryset because pickling a queryset evaluates it.
+
+    """
+    users = get_user_model()._default_manager.all()
+    users.query = query
+    users = list(users)
+    return list(zip([user.pk for user in users], create_tokens(users, scope)))
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate authentication tokens for all users and write them to a file. "
+        "Override get_queryset() in a subclass to select users."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            default="-",
+            help="Path to the output file. Default: standard output.",
+        )
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            default="csv",
+            help="Format of the output file. Default: csv.",
+        )
+        parser.add_argument(
+            "--scope",
+            default="",
+            help="Scope of tokens. Default: no scope.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of worker processes. Default: number of CPUs.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Number of users processed at once by a worker. Default: 2000.",
+        )
+
+    def get_queryset(self):
+        """
+        Return a queryset of users for which tokens must be generated.
+
+        """
+        return get_user_model()._default_manager.all()
+
+    def get_queries(self, chunk_size):
+        """
+        Split users in ranges of primary keys containing ``chunk_size`` users.
+
+        Return a list of queries, one for each range.
+
+        """
+        queryset = self.get_queryset()
+        fields = [queryset.model._meta.pk.name, *get_revocation_fields()]
+        if settings.PRIMARY_KEY_FIELD != "pk":
+            fields.append(settings.PRIMARY_KEY_FIELD)
+        pks = queryset.order_by("pk").values_list("pk", flat=True)
+        pks = pks.iterator(chunk_size=chunk_size)
+        queries = []
+        while chunk := list(itertools.islice(pks, chunk_size)):
+            queries.append(
+                queryset.filter(pk__gte=chunk[0], pk__lte=chunk[-1])
+                .order_by("pk")
+                .only(*fields)
+                .query
+            )
+        return queries
+
+    def iter_results(self, queries, scope, workers):
+        """
+        Generate tokens for each query, in order.
+
+        Keep only a few queries in flight to bound memory usage.
+
+        """
+        if workers == 1:
+            for query in queries:
+                yield generate_tokens(query, scope)
+            return
+
+        # Worker processes must open their own database connections.
+        connections.close_all()
+        with ProcessPoolExecutor(workers, initializer=django.setup) as executor:
+            pending = collections.deque()
+            for query in queries:
+                pending.append(executor.submit(generate_tokens, query, scope))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def handle(self, *args, **options):
+        self.verbosity = options["verbosity"]
+        queries = self.get_queries(options["chunk_size"])
+        results = self.iter_results(queries, options["scope"], options["workers"])
+
+        if options["output"] == "-":
+            output = self.stdout
+        else:
+            output = open(options["output"], "w", newline="")
+
+        try:
+            if options["format"] == "csv":
+                writer = csv.writer(output, lineterminator="\n")
+                writer.writerow(["pk", "token"])
+                write = writer.writerows
+            else:
+                write = functools.partial(self.write_jsonl, output)
+
+            count = 0
+            start = last_report = time.monotonic()
+            for rows in results:
+                write(rows)
+                count += len(rows)
+                now = time.monotonic()
+                if now - last_report >= 1:
+                    self.report(count, now - start)
+                    last_report = now
+            self.report(count, time.monotonic() - start)
+        finally:
+            if output is not self.stdout:
+                output.close()
+
+    @staticmethod
+    def write_jsonl(output, rows):
+        for pk, token in rows:
+            data = {"pk": pk, "token": token}
+            output.write(json.dumps(data, cls=DjangoJSONEncoder) + "\n")
+
+    def report(self, count, elapsed):
+        if self.verbosity >= 1:
+            rate = count / elapsed if elapsed else 0
+            self.stderr.write(f"{count} tokens generated ({rate:.0f} tokens/s)")
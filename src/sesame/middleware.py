@@ -1,15 +1,106 @@
-from urllib.parse import urlencode
+import functools
+from urllib.parse import quote_plus, urlencode
 
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.contrib.auth import login
 from django.contrib.auth.models import AnonymousUser
 from django.shortcuts import redirect
 
-from . import settings
-from .utils import get_user
+from . import settings, throttling
+from .tokens import create_token, is_legacy_token
+from .utils import aget_user, aneeds_login, get_user, needs_login
+
+try:
+    from django.contrib.auth import alogin
+except ImportError:  # Django < 5.0
+    alogin = sync_to_async(login)
 
 __all__ = ["AuthenticationMiddleware"]
 
 
+@functools.lru_cache(maxsize=None)
+def get_request_matcher():
+    """
+    Return a function that tells whether a request may contain a token.
+
+    It looks for the name of the token in the raw query string, without
+    parsing it, and checks :data:`SESAME_MIDDLEWARE_INCLUDE_PATHS` and
+    :data:`SESAME_MIDDLEWARE_EXCLUDE_PATHS`.
+
+    The result is cached until settings change.
+
+    """
+    token_name = quote_plus(settings.TOKEN_NAME)
+    if settings.MIDDLEWARE_INCLUDE_PATHS is None:
+        include_paths = ("",)  # every path starts with an empty string
+    else:
+        include_paths = tuple(settings.MIDDLEWARE_INCLUDE_PATHS)
+    exclude_paths = tuple(settings.MIDDLEWARE_EXCLUDE_PATHS)
+
+    def may_contain_token(request):
+        return (
+            token_name in request.META.get("QUERY_STRING", "")
+            and request.path.startswith(include_paths)
+            and not request.path.startswith(exclude_paths)
+        )
+
+    return may_contain_token
+
+
+# ua_parser runs hundreds of regular expressions on user agents, which takes
+# milliseconds. Most user agents can be classified with a few substring tests
+# instead. Results are cached, since logins come from a small set of distinct
+# user agents.
+
+USER_AGENTS_CACHE_SIZE = 1000
+
+# ua_parser may detect Safari or iOS in user agents containing these strings.
+APPLE_MARKERS = [
+    "Safari",
+    "iPhone",
+    "iPad",
+    "iPod",
+    "iOS",
+    "like Mac OS X",
+    "CFNetwork",
+    "Darwin",
+    "AppleTV",
+    "Apple TV",
+]
+
+# Chromium-based browsers include "Safari" in their user agent. They're only
+# Safari-like on iOS, where they contain one of the other markers.
+CHROMIUM_MARKER = "Chrome/"
+IOS_MARKERS = [marker for marker in APPLE_MARKERS if marker != "Safari"]
+
+
+@functools.lru_cache(maxsize=USER_AGENTS_CACHE_SIZE)
+def is_safari_user_agent(user_agent):
+    """
+    Tell whether ``user_agent`` is Safari or a browser running on iOS.
+
+    Return :obj:`None` if that requires ua_parser and it isn't installed.
+
+    """
+    if not any(marker in user_agent for marker in APPLE_MARKERS):
+        return False
+    if CHROMIUM_MARKER in user_agent and not any(
+        marker in user_agent for marker in IOS_MARKERS
+    ):
+        return False
+
+    try:
+        from ua_parser import user_agent_parser
+    except ImportError:  # pragma: no cover
+        return None
+    else:
+        parsed_ua = user_agent_parser.Parse(user_agent)
+        return (
+            parsed_ua["user_agent"]["family"] == "Safari"
+            or parsed_ua["os"]["family"] == "iOS"
+        )
+
+
 class AuthenticationMiddleware:
     """
     Look for a signed token in the URL of any request and log a user in.
@@ -39,16 +130,42 @@ class AuthenticationMiddleware:
             ...,
         ]
 
+    Requests are skipped without parsing the query string unless it contains
+    the name of the token. Restrict the middleware to some URLs with
+    :data:`SESAME_MIDDLEWARE_INCLUDE_PATHS` and
+    :data:`SESAME_MIDDLEWARE_EXCLUDE_PATHS`.
+
+    When :data:`SESAME_UPGRADE_TOKENS` is enabled and the token remains in the
+    URL after authenticating a user, :class:`AuthenticationMiddleware` replaces
+    tokens in legacy formats with new tokens with an HTTP redirect.
+
+    :class:`AuthenticationMiddleware` supports both synchronous and
+    asynchronous requests.
+
     """
 
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
         # When process_request() returns a response, return that response.
         # Otherwise continue with the next middleware or the view.
         return self.process_request(request) or self.get_response(request)
 
+    async def __acall__(self, request):
+        response = await self.aprocess_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
+
     def process_request(self, request):
         """
         Log user the in if ``request`` contains a valid token.
@@ -57,7 +174,22 @@ class AuthenticationMiddleware:
         after a successful login (except on Safari to avoid triggering ITP,
         and only when sessions are enabled).
 
+        Return an HTTP 429 Too Many Requests response when
+        :ref:`throttling <Throttling>` rejects the request.
+
         """
+        # Most requests don't contain a token. Skip them as cheaply as possible.
+        if not get_request_matcher()(request):
+            # If django.contrib.auth isn't enabled, set request.user.
+            if not hasattr(request, "user"):
+                request.user = AnonymousUser()
+            return None
+
+        # If the client sent too many invalid tokens, reject the request
+        # without validating the token.
+        if throttling.is_throttled(request):
+            return throttling.get_throttled_response()
+
         # If django.contrib.sessions is enabled, don't update the last login,
         # because login(request, user) will do it.
         # If django.contrib.sessions is disabled, keep the default behavior of
@@ -67,10 +199,14 @@ class AuthenticationMiddleware:
             update_last_login=False if hasattr(request, "session") else None,
         )
 
+        if user is None:
+            throttling.record_invalid_token(request)
+
         # If django.contrib.sessions is enabled and the token is valid,
         # persist the login in session.
         if hasattr(request, "session") and user is not None:
-            login(request, user)
+            if needs_login(request, user):
+                login(request, user)
             # Once we persist the login in the session, if the authentication
             # middleware is enabled, it will set request.user in future
             # requests. We can get rid of the token in the URL by redirecting
@@ -85,32 +221,85 @@ class AuthenticationMiddleware:
             ):
                 return self.get_redirect(request)
 
+        # If the token remains in the URL and it's in a legacy format, replace
+        # it with a new token, so that bookmarked URLs are upgraded over time.
+        if user is not None and self.should_upgrade_token(request):
+            return self.get_redirect(request, create_token(user))
+
         # If django.contrib.auth isn't enabled, set request.user.
         if not hasattr(request, "user"):
             request.user = user if user is not None else AnonymousUser()
 
+    async def aprocess_request(self, request):
+        """
+        Asynchronous version of :meth:`process_request`.
+
+        """
+        # See process_request() for comments.
+        if not get_request_matcher()(request):
+            if not hasattr(request, "user"):
+                request.user = AnonymousUser()
+            return None
+
+        if await throttling.ais_throttled(request):
+            return throttling.get_throttled_response()
+
+        user = await aget_user(
+            request,
+            update_last_login=False if hasattr(request, "session") else None,
+        )
+
+        if user is None:
+            await throttling.arecord_invalid_token(request)
+
+        if hasattr(request, "session") and user is not None:
+            if await aneeds_login(request, user):
+                await alogin(request, user)
+            if (
+                hasattr(request, "user")
+                and request.method == "GET"
+                and not self.is_safari(request)
+            ):
+                return self.get_redirect(request)
+
+        if user is not None and self.should_upgrade_token(request):
+            return self.get_redirect(request, create_token(user))
+
+        if not hasattr(request, "user"):
+            request.user = user if user is not None else AnonymousUser()
+
+    def should_upgrade_token(self, request):
+        """
+        Tell whether to redirect to the same URL with a new token.
+
+        """
+        return (
+            settings.UPGRADE_TOKENS
+            and request.method == "GET"
+            and not self.is_safari(request)
+            and is_legacy_token(request.GET[settings.TOKEN_NAME])
+        )
+
     @staticmethod
     def is_safari(request):
-        try:
-            from ua_parser import user_agent_parser
-        except ImportError:  # pragma: no cover
-            return None
-        else:
-            user_agent = request.META.get("HTTP_USER_AGENT", "")
-            parsed_ua = user_agent_parser.Parse(user_agent)
-            return (
-                parsed_ua["user_agent"]["family"] == "Safari"
-                or parsed_ua["os"]["family"] == "iOS"
-            )
+        # Only Chromium-based browsers send client hints.
+        if "HTTP_SEC_CH_UA" in request.META:
+            return False
+        return is_safari_user_agent(request.META.get("HTTP_USER_AGENT", ""))
 
     @staticmethod
-    def get_redirect(request):
+    def get_redirect(request, token=None):
         """
         Create an HTTP redirect response that removes the token from the URL.
 
+        If ``token`` is set, replace the token instead of removing it.
+
         """
         params = request.GET.copy()
-        params.pop(settings.TOKEN_NAME)
+        if token is None:
+            params.pop(settings.TOKEN_NAME)
+        else:
+            params[settings.TOKEN_NAME] = token
         url = request.path
         if params:
             url += "?" + urlencode(params)
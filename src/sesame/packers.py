@@ -28,6 +28,11 @@ class BasePacker:
 
     """
 
+    #: Size of packed primary keys in bytes, if it's fixed; else :obj:`None`.
+    #: Setting it allows rejecting tokens that don't have the expected length
+    #: without decoding them.
+    size = None
+
     def pack_pk(self, user_pk):
         """
         Create a short representation of the primary key of a user.
@@ -98,6 +103,8 @@ class UnsignedLongLongPacker(StructPacker):
 
 
 class UUIDPacker(BasePacker):
+    size = 16
+
     @staticmethod
     def pack_pk(user_pk):
         return user_pk.bytes
@@ -192,4 +199,13 @@ def get_packer():
     return Packer()
 
 
-packer = get_packer()
+# The packer depends on the user model. It's resolved on first use rather than
+# when this module is imported, which may happen before apps are loaded.
+
+
+def __getattr__(name):
+    if name != "packer":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    global packer
+    packer = get_packer()
+    return packer
@@ -1,3 +1,4 @@
+import base64
 import datetime
 import hashlib
 import importlib
@@ -17,13 +18,30 @@ DEFAULTS = {
     "ONE_TIME": False,
     "INVALIDATE_ON_PASSWORD_CHANGE": True,
     "INVALIDATE_ON_EMAIL_CHANGE": False,
+    "SKIP_REDUNDANT_LOGIN": False,
     # Custom primary keys
     "PACKER": None,
     "PRIMARY_KEY_FIELD": "pk",
+    # Loading users
+    "USER_FIELDS": None,
+    "CACHE": "default",
+    "USER_CACHE_TIMEOUT": 300,
     # Tokens
     "TOKENS": ["sesame.tokens_v2", "sesame.tokens_v1"],
+    "UPGRADE_TOKENS": False,
+    "TOKEN_CACHE_SIZE": 0,
+    "TOKEN_CACHE_TTL": 300,
+    "NEGATIVE_CACHE_SIZE": 0,
+    "NEGATIVE_CACHE_TTL": 60,
+    # Middleware
+    "MIDDLEWARE_INCLUDE_PATHS": None,
+    "MIDDLEWARE_EXCLUDE_PATHS": [],
+    # Throttling
+    "THROTTLE_LIMIT": None,
+    "THROTTLE_PERIOD": 60,
     # Tokens v2
     "KEY": "",
+    "KEY_ID": False,
     # We want a short signature in order to keep tokens short. A 10-bytes
     # signature has about 1.2e24 possible values, which is sufficient here.
     "SIGNATURE_SIZE": 10,
@@ -64,6 +82,24 @@ def derive_key(secret_key, key):
     ).digest()
 
 
+def derive_key_id(key):
+    """
+    Make a 2-characters identifier for a key returned by :func:`derive_key`.
+
+    Identifiers aren't unique. They're only meant to avoid trying every key.
+
+    """
+    digest = hashlib.blake2b(key, digest_size=2, person=b"sesame.key_id").digest()
+    return base64.urlsafe_b64encode(digest)[:2].decode()
+
+
+# Values derived from settings are computed on first use rather than when this
+# module is imported. This avoids deriving keys, importing token modules, and
+# loading the user model while Django starts. See __getattr__ below.
+
+DERIVED_SETTINGS = ["SIGNING_KEY", "VERIFICATION_KEYS", "KEY_IDS", "TOKENS"]
+
+
 # load() also works for reloading settings, which is useful for testing.
 
 
@@ -72,24 +108,55 @@ def load():
     for name, default in DEFAULTS.items():
         setattr(module, name, getattr(settings, "SESAME_" + name, default))
 
-    global KEY, MAX_AGE, SIGNING_KEY, TOKENS, VERIFICATION_KEYS
+    global MAX_AGE
 
     # Support defining MAX_AGE as a timedelta rather than a number of seconds.
     if isinstance(MAX_AGE, datetime.timedelta):
         MAX_AGE = MAX_AGE.total_seconds()
 
-    # Import token creation and parsing modules.
-    TOKENS = [importlib.import_module(tokens) for tokens in TOKENS]
+    # Forget derived values. They'll be computed again when they're needed.
+    for name in DERIVED_SETTINGS:
+        vars(module).pop(name, None)
+
+
+load()
+
+
+def derive():
+    global KEY, KEY_IDS, SIGNING_KEY, TOKENS, VERIFICATION_KEYS
+
+    # Check settings before publishing derived values. If the check fails,
+    # they remain undefined and the next access runs the check again.
+    global checked
+    if not checked:
+        check()
+        checked = True
 
     # Derive signing and verification keys.
-    SIGNING_KEY = derive_key(settings.SECRET_KEY, KEY)
-    VERIFICATION_KEYS = [SIGNING_KEY] + [
+    signing_key = derive_key(settings.SECRET_KEY, KEY)
+    verification_keys = [signing_key] + [
         derive_key(secret_key, KEY)
         for secret_key in getattr(settings, "SECRET_KEY_FALLBACKS", [])
     ]
+    key_ids = [derive_key_id(key) for key in verification_keys]
 
+    # Import token creation and parsing modules.
+    tokens_modules = [
+        importlib.import_module(tokens)
+        for tokens in getattr(settings, "SESAME_TOKENS", DEFAULTS["TOKENS"])
+    ]
 
-load()
+    SIGNING_KEY = signing_key
+    VERIFICATION_KEYS = verification_keys
+    KEY_IDS = key_ids
+    TOKENS = tokens_modules
+
+
+def __getattr__(name):
+    if name not in DERIVED_SETTINGS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    derive()
+    return globals()[name]
 
 
 # Django's checks framework was designed to run such checks. Unfortunately,
@@ -100,6 +167,8 @@ load()
 # adding another step to the installation instructions. Raising an exception
 # is good enough.
 
+checked = False
+
 
 def check():
     global MAX_AGE, INVALIDATE_ON_PASSWORD_CHANGE
@@ -121,21 +190,63 @@ def check():
             )
 
 
-check()
-
-
 @receiver(setting_changed)
 def reload(*, setting, **kwargs):
     if setting.startswith("SECRET_KEY") or setting.startswith("SESAME_"):
         load()
 
+        from . import tokens_v2, tokens_v3
+
+        tokens_v2.get_hashers.cache_clear()
+        tokens_v3.get_hashers.cache_clear()
+
+    if setting in [
+        "AUTH_USER_MODEL",
+        "SESAME_INVALIDATE_ON_PASSWORD_CHANGE",
+        "SESAME_INVALIDATE_ON_EMAIL_CHANGE",
+        "SESAME_ONE_TIME",
+    ]:
+        from . import tokens_v2
+
+        tokens_v2.get_revocation_key_extractor.cache_clear()
+
     if setting in ["AUTH_USER_MODEL", "SESAME_PACKER", "SESAME_PRIMARY_KEY_FIELD"]:
         from . import packers
 
         packers.packer = packers.get_packer()
 
-    if setting in ["SESAME_SALT", "SESAME_MAX_AGE"]:
+    if (
+        setting == "AUTH_USER_MODEL"
+        or setting.startswith("SECRET_KEY")
+        or setting.startswith("SESAME_")
+    ):
+        from . import tokens
+
+        tokens.cache = tokens.get_cache()
+        tokens.negative_cache = tokens.get_negative_cache()
+        tokens.get_tokens_module_getter.cache_clear()
+
+    if setting in ["SESAME_SALT", "SESAME_MAX_AGE"] or setting.startswith("SECRET_KEY"):
         from . import tokens_v1
 
-        tokens_v1.signer = tokens_v1.get_signer()
+        tokens_v1.get_signer.cache_clear()
         tokens_v1.token_re = tokens_v1.get_token_re()
+
+    if setting in ["SESAME_SALT", "SESAME_ITERATIONS", "SESAME_DIGEST"]:
+        from . import tokens_v1
+
+        tokens_v1.revocation_keys = tokens_v1.get_revocation_keys()
+
+    if setting in [
+        "SESAME_TOKEN_NAME",
+        "SESAME_MIDDLEWARE_INCLUDE_PATHS",
+        "SESAME_MIDDLEWARE_EXCLUDE_PATHS",
+    ]:
+        from . import middleware
+
+        middleware.get_request_matcher.cache_clear()
+
+    if setting == "AUTHENTICATION_BACKENDS":
+        from . import utils
+
+        utils.get_backends.cache_clear()
@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+__all__ = ["legacy_token_used"]
+
+# Sent when a user is authenticated with a token in a format that django-sesame
+# still accepts but doesn't generate anymore, that is, any format other than
+# the first one in SESAME_TOKENS. The sender is the module that validated the
+# token. Receivers get the user as the ``user`` argument.
+legacy_token_used = Signal()
@@ -0,0 +1,127 @@
+import hashlib
+import time
+from http import HTTPStatus
+
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from . import settings
+
+__all__ = [
+    "is_throttled",
+    "ais_throttled",
+    "record_invalid_token",
+    "arecord_invalid_token",
+    "get_throttled_response",
+]
+
+# Throttling counts invalid tokens per client in fixed time windows. Each
+# client has a single integer counter in the cache for the current window.
+# Checking it costs one cache read; counting an invalid token costs one or two
+# cache writes. Counters expire with their window.
+
+
+def get_client(request):
+    """
+    Return an identifier of the client that sent ``request``.
+
+    """
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def get_throttle_cache_key(request):
+    """
+    Return the cache key of the counter of invalid tokens for ``request``.
+
+    """
+    window = int(time.time() // settings.THROTTLE_PERIOD)
+    digest = hashlib.blake2b(
+        f"{get_client(request)}|{window}".encode(),
+        digest_size=16,
+        person=b"sesame.throttle",
+    ).hexdigest()
+    return f"sesame.throttle.{digest}"
+
+
+def is_enabled(request):
+    return settings.THROTTLE_LIMIT is not None and settings.TOKEN_NAME in request.GET
+
+
+def is_throttled(request):
+    """
+    Tell whether ``request`` contains a token and its client sent too many
+    invalid tokens recently.
+
+    """
+    if not is_enabled(request):
+        return False
+    cache = caches[settings.CACHE]
+    count = cache.get(get_throttle_cache_key(request), 0)
+    return count >= settings.THROTTLE_LIMIT
+
+
+async def ais_throttled(request):
+    """
+    Asynchronous version of :func:`is_throttled`.
+
+    """
+    if not is_enabled(request):
+        return False
+    cache = caches[settings.CACHE]
+    count = await cache.aget(get_throttle_cache_key(request), 0)
+    return count >= settings.THROTTLE_LIMIT
+
+
+def is_recorded(request):
+    """
+    Tell whether an invalid token was counted for ``request`` already, then
+    remember that it's counted.
+
+    The middleware and the :obj:`~sesame.decorators.authenticate` decorator may
+    both reject the token of a request. It's counted only once.
+
+    """
+    if getattr(request, "_sesame_invalid_token_recorded", False):
+        return True
+    request._sesame_invalid_token_recorded = True
+    return False
+
+
+def record_invalid_token(request):
+    """
+    Count an invalid token sent by the client of ``request``.
+
+    """
+    if not is_enabled(request) or is_recorded(request):
+        return
+    cache = caches[settings.CACHE]
+    cache_key = get_throttle_cache_key(request)
+    if not cache.add(cache_key, 1, settings.THROTTLE_PERIOD):
+        try:
+            cache.incr(cache_key)
+        except ValueError:  # the counter expired in the meantime
+            cache.set(cache_key, 1, settings.THROTTLE_PERIOD)
+
+
+async def arecord_invalid_token(request):
+    """
+    Asynchronous version of :func:`record_invalid_token`.
+
+    """
+    if not is_enabled(request) or is_recorded(request):
+        return
+    cache = caches[settings.CACHE]
+    cache_key = get_throttle_cache_key(request)
+    if not await cache.aadd(cache_key, 1, settings.THROTTLE_PERIOD):
+        try:
+            await cache.aincr(cache_key)
+        except ValueError:  # the counter expired in the meantime
+            await cache.aset(cache_key, 1, settings.THROTTLE_PERIOD)
+
+
+def get_throttled_response():
+    """
+    Create an HTTP 429 Too Many Requests response.
+
+    """
+    return HttpResponse(status=HTTPStatus.TOO_MANY_REQUESTS)
@@ -1,10 +1,28 @@
+import functools
+import hashlib
+import hmac
 import logging
+import string
 
-from . import settings
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from . import settings, tokens_v2
+from .caches import LRUCache
+from .signals import legacy_token_used
 
 logger = logging.getLogger("sesame")
 
-__all__ = ["create_token", "parse_token"]
+__all__ = [
+    "create_token",
+    "create_tokens",
+    "parse_token",
+    "aparse_token",
+    "parse_tokens",
+    "get_revocation_fields",
+]
 
 
 def create_token(user, scope=""):
@@ -16,16 +34,448 @@ def create_token(user, scope=""):
     return tokens.create_token(user, scope)
 
 
-def parse_token(token, get_user, scope="", max_age=None):
+def create_tokens(users, scope=""):
     """
-    Obtain a user from a signed token and an optional scope.
+    Create signed tokens for several users and an optional scope.
+
+    Return a list of tokens in the same order as ``users``.
 
     """
-    for tokens in settings.TOKENS:
+    tokens = settings.TOKENS[0]
+    # Modules other than the built-in modules may not support create_tokens().
+    if not hasattr(tokens, "create_tokens"):
+        return [tokens.create_token(user, scope) for user in users]
+    return tokens.create_tokens(users, scope)
+
+
+def get_cache():
+    if settings.TOKEN_CACHE_SIZE:
+        return LRUCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+    else:
+        return None
+
+
+cache = get_cache()
+
+
+def get_negative_cache():
+    if settings.NEGATIVE_CACHE_SIZE:
+        return LRUCache(settings.NEGATIVE_CACHE_SIZE, settings.NEGATIVE_CACHE_TTL)
+    else:
+        return None
+
+
+negative_cache = get_negative_cache()
+
+
+# Tokens contain only Base64 characters and separators: a colon in v1 tokens,
+# a dot in v3 tokens, and a tilde in v2 tokens with a key identifier.
+TOKEN_CHARS = string.ascii_letters + string.digits + "-_" + ":.~"
+
+# Modules that support get_token_sizes().
+BUILTIN_TOKENS = ["sesame.tokens_v1", "sesame.tokens_v2", "sesame.tokens_v3"]
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokens_module_getter():
+    """
+    Create a function that returns the module supporting the format of a token.
+
+    This function is specialized for the current settings. It inspects the
+    token in a single pass and rejects tokens whose size isn't possible with
+    the current settings before decoding them.
+
+    """
+    # Fall back to calling detect_token() when SESAME_TOKENS contains modules
+    # other than the built-in modules.
+    if not all(tokens.__name__ in BUILTIN_TOKENS for tokens in settings.TOKENS):
+        return detect_tokens_module
+
+    v1, v2, v3 = [
+        next(
+            (tokens for tokens in settings.TOKENS if tokens.__name__ == name),
+            None,
+        )
+        for name in BUILTIN_TOKENS
+    ]
+    token_sizes = {tokens: tokens.get_token_sizes() for tokens in settings.TOKENS}
+
+    def get_tokens_module(token):
         # We can detect the version of a token simply by inspecting it:
-        # v1 tokens contain a colon; v2 tokens don't.
+        # v1 tokens contain a colon; v3 tokens contain a dot; v2 tokens don't.
+        if ":" in token:
+            tokens = v1
+        elif "." in token:
+            tokens = v3
+        else:
+            tokens = v2
+        if (
+            tokens is None
+            or len(token) not in token_sizes[tokens]
+            # Check that all characters are allowed without a regex.
+            or token.strip(TOKEN_CHARS)
+        ):
+            logger.debug("Bad token: doesn't match a supported format")
+            return None
+        return tokens
+
+    return get_tokens_module
+
+
+def get_tokens_module(token):
+    """
+    Return the module that supports the format of a token or :obj:`None`.
+
+    """
+    return get_tokens_module_getter()(token)
+
+
+def detect_tokens_module(token):
+    """
+    Return the module that supports the format of a token or :obj:`None`.
+
+    """
+    for tokens in settings.TOKENS:
         if tokens.detect_token(token):
-            return tokens.parse_token(token, get_user, scope, max_age)
+            return tokens
+    logger.debug("Bad token: doesn't match a supported format")
+    return None
+
+
+# When the negative cache is enabled, primary keys of unknown or inactive users
+# are remembered in order to avoid querying the database again.
+
+
+def is_unknown_user(user_pk):
+    if negative_cache is None:
+        return False
+    return negative_cache.get(user_pk) is not None
+
+
+def remember_unknown_user(user_pk):
+    # Entries are only stored after fetching users. Rejecting a user found in
+    # the negative cache doesn't extend the lifetime of the entry.
+    if negative_cache is not None:
+        negative_cache.set(user_pk, True)
+
+
+def fetch_user(user_pk, get_user):
+    if is_unknown_user(user_pk):
+        return None
+    user = get_user(user_pk)
+    if user is None:
+        remember_unknown_user(user_pk)
+    return user
+
+
+async def afetch_user(user_pk, aget_user):
+    if is_unknown_user(user_pk):
+        return None
+    user = await aget_user(user_pk)
+    if user is None:
+        remember_unknown_user(user_pk)
+    return user
+
+
+def unknown_user(user_pk):
+    logger.debug(
+        "Unknown or inactive user: %s = %r",
+        settings.PRIMARY_KEY_FIELD,
+        user_pk,
+    )
+
+
+@receiver(post_save, dispatch_uid="sesame.tokens.forget_unknown_user")
+def forget_unknown_user(sender, instance, **kwargs):
+    # Saving a user may create or reactivate it.
+    if negative_cache is None or sender is not get_user_model():
+        return
+    negative_cache.delete(getattr(instance, settings.PRIMARY_KEY_FIELD))
+
+
+# When the cache is enabled, a token that was verified recently is only checked
+# against the current revocation key of the user. This saves the cost of
+# verifying the signature, which is significant for v1 tokens.
+
+
+def get_cache_entry(cache_key):
+    if cache is None:
+        return None
+    return cache.get(cache_key)
+
+
+def get_revocation_digest(user):
+    # Store a digest of the revocation key rather than the revocation key,
+    # which is derived from the password hash, in process memory.
+    return hashlib.blake2b(
+        tokens_v2.extract_revocation_key(user),
+        person=b"sesame.tokens",
+    ).digest()
+
+
+def check_cache_entry(tokens, cache_key, user_pk, revocation_digest, user):
+    """
+    Validate a cached token for a user.
+
+    """
+    if user is None:
+        unknown_user(user_pk)
+        cache.delete(cache_key)
+        return None
+    if not hmac.compare_digest(
+        revocation_digest,
+        get_revocation_digest(user),
+    ):
+        logger.debug("Invalid token for user %s: revoked", user)
+        cache.delete(cache_key)
+        return None
+    logger.debug("Valid token for user %s: cached", user)
+    notify_legacy_token(tokens, user)
+    return user
+
+
+def is_expired(expires_in):
+    if expires_in is not None and expires_in <= 0:
+        logger.debug("Expired token: expired %d seconds ago", -expires_in)
+        return True
+    return False
+
+
+def check_token(tokens, cache_key, user_pk, expires_in, payload, user):
+    """
+    Validate a decoded token for a user.
+
+    """
+    if user is None:
+        unknown_user(user_pk)
+        return None
+    if not tokens.verify_token(user, payload):
+        return None
+    return remember_token(tokens, cache_key, user_pk, expires_in, user)
+
+
+async def acheck_token(tokens, cache_key, user_pk, expires_in, payload, user):
+    """
+    Asynchronous version of :func:`check_token`.
+
+    """
+    if user is None:
+        unknown_user(user_pk)
+        return None
+    # Verifying tokens v1 is slow. They support doing it in a thread pool.
+    averify_token = getattr(tokens, "averify_token", None)
+    if averify_token is None:
+        verified = tokens.verify_token(user, payload)
     else:
-        logger.debug("Bad token: doesn't match a supported format")
+        verified = await averify_token(user, payload)
+    if not verified:
+        return None
+    return remember_token(tokens, cache_key, user_pk, expires_in, user)
+
+
+def remember_token(tokens, cache_key, user_pk, expires_in, user):
+    if cache is not None:
+        # Entries don't outlive tokens.
+        revocation_digest = get_revocation_digest(user)
+        cache.set(cache_key, (user_pk, revocation_digest), ttl=expires_in)
+    notify_legacy_token(tokens, user)
+    return user
+
+
+def is_legacy_token(token):
+    """
+    Tell whether a token is in a format other than the one used for new tokens.
+
+    """
+    tokens = get_tokens_module(token)
+    return tokens is not None and tokens is not settings.TOKENS[0]
+
+
+def notify_legacy_token(tokens, user):
+    if tokens is not settings.TOKENS[0]:
+        legacy_token_used.send(sender=tokens, user=user)
+
+
+def parse_token(token, get_user, scope="", max_age=None):
+    """
+    Obtain a user from a signed token and an optional scope.
+
+    """
+    tokens = get_tokens_module(token)
+    if tokens is None:
         return None
+
+    # Modules other than the built-in modules may not support decode_token()
+    # and verify_token(). Then, tokens aren't cached.
+    if not hasattr(tokens, "decode_token"):
+        user = tokens.parse_token(token, get_user, scope, max_age)
+        if user is not None:
+            notify_legacy_token(tokens, user)
+        return user
+
+    cache_key = token, scope, max_age
+    entry = get_cache_entry(cache_key)
+    if entry is not None:
+        user_pk, revocation_digest = entry
+        user = fetch_user(user_pk, get_user)
+        return check_cache_entry(tokens, cache_key, user_pk, revocation_digest, user)
+
+    decoded = tokens.decode_token(token, scope, max_age)
+    if decoded is None:
+        return None
+    user_pk, expires_in, payload = decoded
+    if is_expired(expires_in):
+        return None
+    user = fetch_user(user_pk, get_user)
+    return check_token(tokens, cache_key, user_pk, expires_in, payload, user)
+
+
+async def aparse_token(token, aget_user, scope="", max_age=None):
+    """
+    Obtain a user from a signed token and an optional scope.
+
+    Like :func:`parse_token` but fetch the user with ``await aget_user()``.
+
+    """
+    tokens = get_tokens_module(token)
+    if tokens is None:
+        return None
+
+    # Modules other than the built-in modules only support a synchronous API.
+    if not hasattr(tokens, "decode_token"):
+        user = await sync_to_async(tokens.parse_token)(
+            token, async_to_sync(aget_user), scope, max_age
+        )
+        if user is not None:
+            notify_legacy_token(tokens, user)
+        return user
+
+    cache_key = token, scope, max_age
+    entry = get_cache_entry(cache_key)
+    if entry is not None:
+        user_pk, revocation_digest = entry
+        user = await afetch_user(user_pk, aget_user)
+        return check_cache_entry(tokens, cache_key, user_pk, revocation_digest, user)
+
+    decoded = tokens.decode_token(token, scope, max_age)
+    if decoded is None:
+        return None
+    user_pk, expires_in, payload = decoded
+    if is_expired(expires_in):
+        return None
+    user = await afetch_user(user_pk, aget_user)
+    return await acheck_token(tokens, cache_key, user_pk, expires_in, payload, user)
+
+
+# Reasons why parse_tokens() rejects tokens.
+
+BAD_TOKEN = "bad token"
+EXPIRED_TOKEN = "expired token"
+UNKNOWN_USER = "unknown or inactive user"
+INVALID_TOKEN = "invalid token"
+
+
+def parse_tokens(tokens, get_users, scope="", max_age=None):
+    """
+    Obtain users from several signed tokens and an optional scope.
+
+    ``get_users`` receives a list of primary keys and returns a :class:`dict`
+    mapping primary keys to users. It's called at most once.
+
+    Return a list of ``(user, reason)`` pairs in the same order as ``tokens``.
+    If a token is valid, ``reason`` is :obj:`None`. Else, ``user`` is
+    :obj:`None` and ``reason`` is :data:`BAD_TOKEN`, :data:`EXPIRED_TOKEN`,
+    :data:`UNKNOWN_USER`, or :data:`INVALID_TOKEN`.
+
+    This doesn't use the cache of validated tokens.
+
+    """
+    results = []
+
+    # Decode all tokens before fetching users in order to fetch them at once.
+    pending = []
+    for token in tokens:
+        module = get_tokens_module(token)
+        if module is None:
+            results.append((None, BAD_TOKEN))
+            continue
+        # Modules other than the built-in modules may not support decode_token()
+        # and verify_token(). Then, find which user the token refers to, and
+        # parse it again after fetching users. Expired tokens are bad tokens.
+        if not hasattr(module, "decode_token"):
+            user_pk = get_requested_user_pk(module, token, scope, max_age)
+            if user_pk is None:
+                results.append((None, BAD_TOKEN))
+                continue
+            pending.append((len(results), module, user_pk, token))
+            results.append(None)  # placeholder
+            continue
+        decoded = module.decode_token(token, scope, max_age)
+        if decoded is None:
+            results.append((None, BAD_TOKEN))
+            continue
+        user_pk, expires_in, payload = decoded
+        if is_expired(expires_in):
+            results.append((None, EXPIRED_TOKEN))
+            continue
+        pending.append((len(results), module, user_pk, payload))
+        results.append(None)  # placeholder
+
+    user_pks = {user_pk for _, _, user_pk, _ in pending if not is_unknown_user(user_pk)}
+    users = get_users(list(user_pks)) if user_pks else {}
+    for user_pk in user_pks - users.keys():
+        remember_unknown_user(user_pk)
+
+    for index, module, user_pk, payload in pending:
+        user = users.get(user_pk)
+        if user is None:
+            unknown_user(user_pk)
+            results[index] = None, UNKNOWN_USER
+            continue
+        if hasattr(module, "decode_token"):
+            verified = module.verify_token(user, payload)
+        else:
+            # payload is the token. Parse it again now that users are fetched.
+            verified = module.parse_token(payload, users.get, scope, max_age)
+        if not verified:
+            results[index] = None, INVALID_TOKEN
+        else:
+            notify_legacy_token(module, user)
+            results[index] = user, None
+
+    return results
+
+
+def get_requested_user_pk(tokens, token, scope, max_age):
+    """
+    Return the primary key of the user that a token refers to or :obj:`None`.
+
+    This works with any module supporting parse_token(). It doesn't verify the
+    signature of the token.
+
+    """
+    user_pks = []
+
+    def get_user(user_pk):
+        user_pks.append(user_pk)
+        return None
+
+    tokens.parse_token(token, get_user, scope, max_age)
+    return user_pks[0] if user_pks else None
+
+
+def get_revocation_fields():
+    """
+    Return the names of user fields from which revocation keys are derived.
+
+    Changing the value of any of these fields revokes tokens.
+
+    """
+    fields = []
+    if settings.INVALIDATE_ON_PASSWORD_CHANGE:
+        fields.append("password")
+    if settings.INVALIDATE_ON_EMAIL_CHANGE:
+        fields.append(get_user_model().get_email_field_name())
+    if settings.ONE_TIME:
+        fields.append("last_login")
+    return fields
@@ -1,28 +1,35 @@
+import functools
+import hashlib
+import hmac
 import logging
 import re
+import sys
+import time
 
+from asgiref.sync import sync_to_async
 from django.core import signing
 from django.utils import crypto
+from django.utils.encoding import force_bytes
 
-from . import packers, settings
+from . import packers, settings, tokens_v2
+from .caches import LRUCache
 
-__all__ = ["create_token", "detect_token", "parse_token"]
+__all__ = [
+    "create_token",
+    "create_tokens",
+    "detect_token",
+    "decode_token",
+    "verify_token",
+    "averify_token",
+    "parse_token",
+]
 
 logger = logging.getLogger("sesame")
 
 
-def get_revocation_key(user):
+def get_revocation_data(user):
     """
-    When the value returned by this method changes, this revokes tokens.
-
-    It is derived from the hashed password so that changing the password
-    revokes tokens.
-
-    It may be derived from the email so that changing the email revokes tokens
-    too.
-
-    For one-time tokens, it also contains the last login datetime so that
-    logging in revokes existing tokens.
+    Return the fields of a user from which the revocation key is derived.
 
     """
     data = ""
@@ -32,6 +39,17 @@ def get_revocation_key(user):
         data += getattr(user, user.get_email_field_name())
     if settings.ONE_TIME:
         data += str(user.last_login)
+    return data
+
+
+def derive_revocation_key(data):
+    """
+    Derive a revocation key from the value returned by
+    :func:`get_revocation_data`.
+
+    This is slow on purpose.
+
+    """
     # The password is expected to be a secure hash but we hash it again
     # for additional safety. We default to MD5 to minimize the length of
     # the token. (Remember, if an attacker obtains the URL, he can already
@@ -44,15 +62,112 @@ def get_revocation_key(user):
     )
 
 
+# Deriving a revocation key takes several milliseconds. Since revocation keys
+# change rarely, they're memoized. Memo keys are hashes of the inputs so that
+# hashed passwords aren't kept in memory.
+
+REVOCATION_KEYS_SIZE = 1000
+
+
+def get_revocation_keys():
+    return LRUCache(REVOCATION_KEYS_SIZE)
+
+
+revocation_keys = get_revocation_keys()
+
+
+def get_memo_key(data):
+    return hashlib.blake2b(data.encode(), person=b"sesame.tokens_v1").digest()
+
+
+def get_revocation_key(user):
+    """
+    When the value returned by this method changes, this revokes tokens.
+
+    It is derived from the hashed password so that changing the password
+    revokes tokens.
+
+    It may be derived from the email so that changing the email revokes tokens
+    too.
+
+    For one-time tokens, it also contains the last login datetime so that
+    logging in revokes existing tokens.
+
+    """
+    data = get_revocation_data(user)
+    memo_key = get_memo_key(data)
+    revocation_key = revocation_keys.get(memo_key)
+    if revocation_key is None:
+        revocation_key = derive_revocation_key(data)
+        revocation_keys.set(memo_key, revocation_key)
+    return revocation_key
+
+
+async def aget_revocation_key(user):
+    """
+    Asynchronous version of :func:`get_revocation_key`.
+
+    When the revocation key isn't memoized, it's derived in a thread pool in
+    order to avoid blocking the event loop.
+
+    """
+    data = get_revocation_data(user)
+    memo_key = get_memo_key(data)
+    revocation_key = revocation_keys.get(memo_key)
+    if revocation_key is None:
+        revocation_key = await sync_to_async(
+            derive_revocation_key,
+            thread_sensitive=False,
+        )(data)
+        revocation_keys.set(memo_key, revocation_key)
+    return revocation_key
+
+
+class HMACKeysMixin:
+    """
+    Derive HMAC keys once instead of for every signature.
+
+    :class:`~django.core.signing.Signer` derives a key from the secret key and
+    the salt every time it computes a signature.
+
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        digestmod = getattr(hashlib, self.algorithm)
+        key_salt = force_bytes(self.salt + "signer")
+        self.hmacs = {
+            key: hmac.new(
+                digestmod(key_salt + force_bytes(key)).digest(),
+                digestmod=digestmod,
+            )
+            for key in [self.key, *self.fallback_keys]
+        }
+
+    def signature(self, value, key=None):
+        try:
+            hasher = self.hmacs[key or self.key].copy()
+        except KeyError:  # pragma: no cover
+            return super().signature(value, key)
+        hasher.update(force_bytes(value))
+        return signing.b64_encode(hasher.digest()).decode()
+
+
+class Signer(HMACKeysMixin, signing.Signer):
+    pass
+
+
+class TimestampSigner(HMACKeysMixin, signing.TimestampSigner):
+    pass
+
+
+@functools.lru_cache(maxsize=None)
 def get_signer():
     if settings.MAX_AGE is None:
-        Signer = signing.Signer
+        signer_class = Signer
     else:
-        Signer = signing.TimestampSigner
-    return Signer(salt=settings.SALT, algorithm="sha1")
-
-
-signer = get_signer()
+        signer_class = TimestampSigner
+    return signer_class(salt=settings.SALT, algorithm="sha1")
 
 
 def sign(data):
@@ -61,18 +176,17 @@ def sign(data):
 
     """
     data = signing.b64_encode(data).decode()
-    return signer.sign(data)
+    return get_signer().sign(data)
 
 
 def unsign(token):
     """
     Extract the data from a signed ``token``.
 
+    This doesn't check whether the token is expired.
+
     """
-    if settings.MAX_AGE is None:
-        data = signer.unsign(token)
-    else:
-        data = signer.unsign(token, max_age=settings.MAX_AGE)
+    data = get_signer().unsign(token)
     return signing.b64_decode(data.encode())
 
 
@@ -88,9 +202,24 @@ def create_token(user, scope=""):
     return sign(primary_key + key)
 
 
-def parse_token(token, get_user, scope="", max_age=None):
+def create_tokens(users, scope=""):
     """
-    Obtain a user from a v1 signed token.
+    Create v1 signed tokens for several users.
+
+    """
+    return [create_token(user, scope) for user in users]
+
+
+def decode_token(token, scope="", max_age=None):
+    """
+    Extract the primary key of a user from a v1 signed token.
+
+    Return ``(user_pk, expires_in, payload)`` where ``expires_in`` is the number
+    of seconds before the token expires or :obj:`None` if it doesn't expire and
+    ``payload`` must be passed to :func:`verify_token`. ``expires_in`` is zero
+    or negative if the token is expired.
+
+    Return :obj:`None` if the token is malformed.
 
     """
     if scope != "":
@@ -100,9 +229,6 @@ def parse_token(token, get_user, scope="", max_age=None):
 
     try:
         data = unsign(token)
-    except signing.SignatureExpired:
-        logger.debug("Expired token: %s", token)
-        return None
     except signing.BadSignature:
         logger.debug("Bad token: %s", token)
         return None
@@ -122,18 +248,84 @@ def parse_token(token, get_user, scope="", max_age=None):
         )
         return None
 
+    if settings.MAX_AGE is None:
+        expires_in = None
+    else:
+        # unsign() already checked that the timestamp is valid.
+        timestamp = signing.b62_decode(token.split(":")[1])
+        expires_in = settings.MAX_AGE - (time.time() - timestamp)
+
+    return user_pk, expires_in, (token, key)
+
+
+def verify_token(user, payload):
+    """
+    Check the revocation key of a v1 signed token for a user.
+
+    ``payload`` is returned by :func:`decode_token`.
+
+    """
+    return check_revocation_key(user, payload, get_revocation_key(user))
+
+
+async def averify_token(user, payload):
+    """
+    Asynchronous version of :func:`verify_token`.
+
+    """
+    return check_revocation_key(user, payload, await aget_revocation_key(user))
+
+
+def check_revocation_key(user, payload, revocation_key):
+    token, key = payload
+    if not crypto.constant_time_compare(key, revocation_key):
+        logger.debug("Invalid token: %s", token)
+        return False
+    logger.debug("Valid token for user %s: %s", user, token)
+    return True
+
+
+def parse_token(token, get_user, scope="", max_age=None):
+    """
+    Obtain a user from a v1 signed token.
+
+    """
+    decoded = decode_token(token, scope, max_age)
+    if decoded is None:
+        return None
+    user_pk, expires_in, payload = decoded
+
+    if expires_in is not None and expires_in <= 0:
+        logger.debug("Expired token: %s", token)
+        return None
+
     user = get_user(user_pk)
     if user is None:
         logger.debug("Unknown or inactive user: %s", user_pk)
         return None
-    if not crypto.constant_time_compare(key, get_revocation_key(user)):
-        logger.debug("Invalid token: %s", token)
+
+    if not verify_token(user, payload):
         return None
-    logger.debug("Valid token for user %s: %s", user, token)
 
     return user
 
 
+def get_token_sizes():
+    """
+    Return the possible sizes of v1 signed tokens with the current settings.
+
+    The result supports membership tests with ``in``.
+
+    """
+    # The signature is a Base64-encoded SHA-1 HMAC. Timestamps use 6 Base62
+    # characters; see get_token_re() below.
+    suffix_size = 1 + 27 if settings.MAX_AGE is None else 1 + 6 + 1 + 27
+    key_size = settings.DIGEST().digest_size
+    if packers.packer.size is None:
+        return range(tokens_v2.get_base64_size(key_size) + suffix_size, sys.maxsize)
+    return {tokens_v2.get_base64_size(packers.packer.size + key_size) + suffix_size}
+
+
 def get_token_re():
     if settings.MAX_AGE is None:
         # Size of primary key and revocation key depends on SESAME_PACKER and
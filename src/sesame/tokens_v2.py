@@ -1,15 +1,27 @@
 import base64
 import datetime
+import functools
 import hashlib
 import hmac
 import logging
+import operator
 import re
 import struct
+import sys
 import time
 
+from django.contrib.auth import get_user_model
+
 from . import packers, settings
 
-__all__ = ["create_token", "detect_token", "parse_token"]
+__all__ = [
+    "create_token",
+    "create_tokens",
+    "detect_token",
+    "decode_token",
+    "verify_token",
+    "parse_token",
+]
 
 logger = logging.getLogger("sesame")
 
@@ -43,6 +55,29 @@ def unpack_timestamp(data):
     return int(time.time()) - TIMESTAMP_OFFSET - timestamp, data
 
 
+def get_expires_in(age, max_age=None):
+    """
+    Calculate how many seconds remain before a token expires.
+
+    ``age`` is returned by :func:`unpack_timestamp`. ``max_age`` overrides
+    SESAME_MAX_AGE.
+
+    Return :obj:`None` if the token doesn't expire.
+
+    """
+    if max_age is None:
+        max_age = settings.MAX_AGE
+    elif settings.MAX_AGE is None:
+        logger.warning(
+            "Ignoring max_age argument; it isn't supported when SESAME_MAX_AGE = None"
+        )
+    elif isinstance(max_age, datetime.timedelta):
+        max_age = max_age.total_seconds()
+    if age is None:
+        return None
+    return max_age - age
+
+
 HASH_SIZES = {
     "pbkdf2_sha256": 44,
     "pbkdf2_sha1": 28,
@@ -55,22 +90,11 @@ HASH_SIZES = {
 }
 
 
-def get_revocation_key(user):
+def get_password_hash(user):
     """
-    When the value returned by this method changes, this revokes tokens.
-
-    It is derived from the hashed password so that changing the password
-    revokes tokens.
-
-    It may be derived from the email so that changing the email revokes tokens
-    too.
-
-    For one-time tokens, it also contains the last login datetime so that
-    logging in revokes existing tokens.
+    Return the hashed password of a user, excluding the salt when possible.
 
     """
-    data = ""
-
     # Tokens generated by django-sesame are more likely to leak than hashed
     # passwords. To minimize the information tokens might be revealing, we'd
     # like to use only hashes, excluding salts, as suggested in issue #40.
@@ -94,35 +118,150 @@ def get_revocation_key(user):
     # so I'm not comfortable reusing it. Also, for clarity, I don't want to
     # chain more cryptographic operations than needed.
 
-    if settings.INVALIDATE_ON_PASSWORD_CHANGE and user.password is not None:
-        algorithm = user.password.partition("$")[0]
-        try:
-            hash_size = HASH_SIZES[algorithm]
-        except KeyError:
-            data += user.password
-        else:
-            data += user.password[-hash_size:]
+    password = user.password
+    if password is None:
+        return ""
+    hash_size = HASH_SIZES.get(password.partition("$")[0])
+    if hash_size is None:
+        return password
+    return password[-hash_size:]
+
 
+def get_last_login(user):
+    """
+    Return the last login date of a user in ISO 8601 format.
+
+    """
+    last_login = user.last_login
+    if last_login is None:
+        return ""
+    return last_login.isoformat()
+
+
+@functools.lru_cache(maxsize=None)
+def get_revocation_key_extractor():
+    """
+    Create a function that returns the revocation key of a user.
+
+    This function is specialized for the current settings. It reads only the
+    relevant fields of the user and the name of the email field is resolved
+    just once.
+
+    """
+    getters = []
+    if settings.INVALIDATE_ON_PASSWORD_CHANGE:
+        getters.append(get_password_hash)
     if settings.INVALIDATE_ON_EMAIL_CHANGE:
-        data += getattr(user, user.get_email_field_name())
+        email_field_name = get_user_model().get_email_field_name()
+        getters.append(operator.attrgetter(email_field_name))
+    if settings.ONE_TIME:
+        getters.append(get_last_login)
+
+    if not getters:
 
-    if settings.ONE_TIME and user.last_login is not None:
-        data += user.last_login.isoformat()
+        def extract_revocation_key(user):
+            return b""
 
-    return data.encode()
+    elif len(getters) == 1:
+        (getter,) = getters
 
+        def extract_revocation_key(user):
+            return getter(user).encode()
 
-def sign(data, key, size):
+    else:
+
+        def extract_revocation_key(user):
+            return "".join([getter(user) for getter in getters]).encode()
+
+    return extract_revocation_key
+
+
+def extract_revocation_key(user):
+    """
+    Return the revocation key of a user as :class:`bytes`.
+
+    """
+    return get_revocation_key_extractor()(user)
+
+
+def get_revocation_key(user):
+    """
+    When the value returned by this method changes, this revokes tokens.
+
+    It is derived from the hashed password so that changing the password
+    revokes tokens.
+
+    It may be derived from the email so that changing the email revokes tokens
+    too.
+
+    For one-time tokens, it also contains the last login datetime so that
+    logging in revokes existing tokens.
+
+    """
+    return extract_revocation_key(user)
+
+
+@functools.lru_cache(maxsize=None)
+def get_hashers():
+    """
+    Create keyed hash objects for each verification key.
+
+    The first one corresponds to the signing key.
+
+    The result is cached until settings change.
+
+    """
+    return [
+        hashlib.blake2b(
+            digest_size=settings.SIGNATURE_SIZE,
+            key=key,
+            person=b"sesame.tokens_v2",
+        )
+        for key in settings.VERIFICATION_KEYS
+    ]
+
+
+def sign(data, hasher):
     """
     Create a MAC with keyed hashing.
 
+    ``hasher`` is a keyed hash object returned by :func:`get_hashers`. Copying
+    it is faster than creating a new keyed hash object.
+
     """
-    return hashlib.blake2b(
-        data,
-        digest_size=size,
-        key=key,
-        person=b"sesame.tokens_v2",
-    ).digest()
+    hasher = hasher.copy()
+    hasher.update(data)
+    return hasher.digest()
+
+
+# When SESAME_KEY_ID is enabled, tokens start with an identifier of the signing
+# key followed by a tilde. This tells which keys may have created the signature
+# when SECRET_KEY_FALLBACKS is set. Tokens without this prefix are checked with
+# all keys.
+
+KEY_ID_SEPARATOR = "~"
+
+
+def get_key_id_prefix():
+    if not settings.KEY_ID:
+        return ""
+    return settings.KEY_IDS[0] + KEY_ID_SEPARATOR
+
+
+def get_candidate_hashers(key_id):
+    """
+    Return the keyed hash objects that may have created a signature.
+
+    ``key_id`` is :obj:`None` when the token doesn't include a key identifier.
+
+    """
+    if key_id is None:
+        return get_hashers()
+    return [
+        hasher
+        for hasher, hasher_key_id in zip(get_hashers(), settings.KEY_IDS)
+        if hasher_key_id == key_id
+    ]
 
 
 def create_token(user, scope=""):
@@ -132,26 +271,64 @@ def create_token(user, scope=""):
     """
     primary_key = packers.packer.pack_pk(getattr(user, settings.PRIMARY_KEY_FIELD))
     timestamp = pack_timestamp()
-    revocation_key = get_revocation_key(user)
+    revocation_key = extract_revocation_key(user)
 
     signature = sign(
         primary_key + timestamp + revocation_key + scope.encode(),
-        settings.SIGNING_KEY,
-        settings.SIGNATURE_SIZE,
+        get_hashers()[0],
     )
 
     # If the revocation key changes, the signature becomes invalid, so we
     # don't need to include a hash of the revocation key in the token.
     data = primary_key + timestamp + signature
     token = base64.urlsafe_b64encode(data).rstrip(b"=")
-    return token.decode()
+    return get_key_id_prefix() + token.decode()
 
 
-def parse_token(token, get_user, scope="", max_age=None):
+def create_tokens(users, scope=""):
     """
-    Obtain a user from a v2 signed token.
+    Create v2 signed tokens for several users.
+
+    This is faster than calling :func:`create_token` for each user because
+    settings are resolved only once.
+
+    """
+    pack_pk = packers.packer.pack_pk
+    primary_key_field = settings.PRIMARY_KEY_FIELD
+    timestamp = pack_timestamp()
+    scope = scope.encode()
+    hasher = get_hashers()[0]
+    extract_revocation_key = get_revocation_key_extractor()
+    key_id_prefix = get_key_id_prefix()
+
+    tokens = []
+    for user in users:
+        primary_key = pack_pk(getattr(user, primary_key_field))
+        revocation_key = extract_revocation_key(user)
+        signature = sign(primary_key + timestamp + revocation_key + scope, hasher)
+        data = primary_key + timestamp + signature
+        token = base64.urlsafe_b64encode(data).rstrip(b"=")
+        tokens.append(key_id_prefix + token.decode())
+    return tokens
+
+
+def decode_token(token, scope="", max_age=None):
+    """
+    Extract the primary key of a user from a v2 signed token.
+
+    Return ``(user_pk, expires_in, payload)`` where ``expires_in`` is the number
+    of seconds before the token expires or :obj:`None` if it doesn't expire and
+    ``payload`` must be passed to :func:`verify_token`. ``expires_in`` is zero
+    or negative if the token is expired.
+
+    Return :obj:`None` if the token is malformed.
+
+    This doesn't check the signature because it depends on the user.
 
     """
+    key_id, separator, token = token.rpartition(KEY_ID_SEPARATOR)
+    if not separator:
+        key_id = None
     token = token.encode()
 
     # Below, error messages should give a hint to developers debugging apps
@@ -182,6 +359,60 @@ def parse_token(token, get_user, scope="", max_age=None):
         logger.debug("Bad token: cannot extract signature")
         return None
 
+    candidate_hashers = get_candidate_hashers(key_id)
+    if not candidate_hashers:
+        logger.debug("Bad token: unknown key identifier")
+        return None
+
+    # Calculate when the token expires. Callers check this first because it's
+    # fast.
+
+    expires_in = get_expires_in(age, max_age)
+
+    primary_key_and_timestamp = data[: -settings.SIGNATURE_SIZE]
+    payload = primary_key_and_timestamp, signature, scope, candidate_hashers
+    return user_pk, expires_in, payload
+
+
+def verify_token(user, payload):
+    """
+    Check the signature of a v2 signed token for a user.
+
+    ``payload`` is returned by :func:`decode_token`.
+
+    """
+    primary_key_and_timestamp, signature, scope, candidate_hashers = payload
+    revocation_key = extract_revocation_key(user)
+    log_scope = "in default scope" if scope == "" else f"in scope {scope}"
+    for hasher in candidate_hashers:
+        expected_signature = sign(
+            primary_key_and_timestamp + revocation_key + scope.encode(),
+            hasher,
+        )
+        if hmac.compare_digest(signature, expected_signature):
+            logger.debug("Valid token for user %s %s", user, log_scope)
+            return True
+
+    logger.debug("Invalid token for user %s %s", user, log_scope)
+    return False
+
+
+def parse_token(token, get_user, scope="", max_age=None):
+    """
+    Obtain a user from a v2 signed token.
+
+    """
+    decoded = decode_token(token, scope, max_age)
+    if decoded is None:
+        return None
+    user_pk, expires_in, payload = decoded
+
+    # Check if token is expired.
+
+    if expires_in is not None and expires_in <= 0:
+        logger.debug("Expired token: expired %d seconds ago", -expires_in)
+        return None
+
     # Since we don't include the revocation key in the token, we need to fetch
     # the user in the database before we can verify the signature. Usually,
     # it's best to verify the signature before doing anything with a message.
@@ -191,20 +422,6 @@ def parse_token(token, get_user, scope="", max_age=None):
     # Determining whether there's a user with a given primary key via a timing
     # attack is acceptable within django-sesame's threat model.
 
-    # Check if token is expired. Perform this check first, because it's fast.
-
-    if max_age is None:
-        max_age = settings.MAX_AGE
-    elif settings.MAX_AGE is None:
-        logger.warning(
-            "Ignoring max_age argument; it isn't supported when SESAME_MAX_AGE = None"
-        )
-    elif isinstance(max_age, datetime.timedelta):
-        max_age = max_age.total_seconds()
-    if age is not None and age >= max_age:
-        logger.debug("Expired token: age = %d seconds", age)
-        return None
-
     # Check if user exists and can log in.
 
     user = get_user(user_pk)
@@ -218,22 +435,38 @@ def parse_token(token, get_user, scope="", max_age=None):
 
     # Check if signature is valid
 
-    primary_key_and_timestamp = data[: -settings.SIGNATURE_SIZE]
-    revocation_key = get_revocation_key(user)
-    for verification_key in settings.VERIFICATION_KEYS:
-        expected_signature = sign(
-            primary_key_and_timestamp + revocation_key + scope.encode(),
-            verification_key,
-            settings.SIGNATURE_SIZE,
-        )
-        if hmac.compare_digest(signature, expected_signature):
-            log_scope = "in default scope" if scope == "" else f"in scope {scope}"
-            logger.debug("Valid token for user %s %s", user, log_scope)
-            return user
+    if not verify_token(user, payload):
+        return None
 
-    log_scope = "in default scope" if scope == "" else f"in scope {scope}"
-    logger.debug("Invalid token for user %s %s", user, log_scope)
-    return None
+    return user
+
+
+def get_base64_size(size):
+    """
+    Return the number of characters for encoding ``size`` bytes in Base64.
+
+    This doesn't include padding.
+
+    """
+    return (size * 4 + 2) // 3
+
+
+def get_token_sizes():
+    """
+    Return the possible sizes of v2 signed tokens with the current settings.
+
+    The result supports membership tests with ``in``.
+
+    """
+    timestamp_size = 0 if settings.MAX_AGE is None else 4
+    if packers.packer.size is None:
+        size = get_base64_size(timestamp_size + settings.SIGNATURE_SIZE)
+        return range(size, sys.maxsize)
+    size = get_base64_size(
+        packers.packer.size + timestamp_size + settings.SIGNATURE_SIZE
+    )
+    # Tokens may start with a key identifier and a tilde.
+    return {size, size + 3}
 
 
 # Tokens are arbitrary Base64-encoded bytestrings. Their size depends on
@@ -241,7 +474,8 @@ def parse_token(token, get_user, scope="", max_age=None):
 # - without SESAME_MAX_AGE: 4 + 10 = 14 bytes = 19 Base64 characters.
 # - with SESAME_MAX_AGE: 4 + 4 + 10 = 18 bytes = 24 Base64 characters.
 # Minimum "sensible" size is 1 + 0 + 2 = 3 bytes = 4 Base64 characters.
-token_re = re.compile(r"[A-Za-z0-9-_]{4,}")
+# When SESAME_KEY_ID is enabled, tokens start with 2 characters and a tilde.
+token_re = re.compile(r"(?:[A-Za-z0-9-_]{2}~)?[A-Za-z0-9-_]{4,}")
 
 
 def detect_token(token):
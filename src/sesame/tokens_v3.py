@@ -0,0 +1,247 @@
+import base64
+import functools
+import hashlib
+import hmac
+import logging
+import re
+import sys
+
+from . import packers, settings, tokens_v2
+
+__all__ = [
+    "create_token",
+    "create_tokens",
+    "detect_token",
+    "decode_token",
+    "verify_token",
+    "parse_token",
+]
+
+logger = logging.getLogger("sesame")
+
+# Tokens v3 contain two signatures:
+# - A short pre-signature covers the primary key, the optional timestamp, and
+#   the scope. It's checked before fetching the user from the database. This
+#   makes forged tokens cheap to reject.
+# - A signature covers the primary key, the optional timestamp, the revocation
+#   key, and the scope, like in tokens v2. It's checked after fetching the user.
+# A 4-bytes pre-signature means that an attacker must send about 4 billion
+# forged tokens to trigger one database query.
+PRE_SIGNATURE_SIZE = 4
+
+
+@functools.lru_cache(maxsize=None)
+def get_hashers():
+    """
+    Create pairs of keyed hash objects for each verification key.
+
+    The first hash object of each pair creates pre-signatures; the second one
+    creates signatures. The first pair corresponds to the signing key.
+
+    The result is cached until settings change.
+
+    """
+    return [
+        (
+            hashlib.blake2b(
+                digest_size=PRE_SIGNATURE_SIZE,
+                key=key,
+                person=b"sesame.v3.pre",
+            ),
+            hashlib.blake2b(
+                digest_size=settings.SIGNATURE_SIZE,
+                key=key,
+                person=b"sesame.v3.sig",
+            ),
+        )
+        for key in settings.VERIFICATION_KEYS
+    ]
+
+
+def encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def decode(data):
+    data = data.encode()
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+def create_token(user, scope=""):
+    """
+    Create a v3 signed token for a user.
+
+    """
+    return create_tokens([user], scope)[0]
+
+
+def create_tokens(users, scope=""):
+    """
+    Create v3 signed tokens for several users.
+
+    """
+    pack_pk = packers.packer.pack_pk
+    primary_key_field = settings.PRIMARY_KEY_FIELD
+    timestamp = tokens_v2.pack_timestamp()
+    scope = scope.encode()
+    pre_hasher, hasher = get_hashers()[0]
+    extract_revocation_key = tokens_v2.get_revocation_key_extractor()
+
+    tokens = []
+    for user in users:
+        primary_key = pack_pk(getattr(user, primary_key_field))
+        pre_signature = tokens_v2.sign(primary_key + timestamp + scope, pre_hasher)
+        revocation_key = extract_revocation_key(user)
+        signature = tokens_v2.sign(
+            primary_key + timestamp + revocation_key + scope,
+            hasher,
+        )
+        data = primary_key + timestamp + pre_signature
+        tokens.append(encode(data) + "." + encode(signature))
+    return tokens
+
+
+def decode_token(token, scope="", max_age=None):
+    """
+    Extract the primary key of a user from a v3 signed token.
+
+    Return ``(user_pk, expires_in, payload)`` where ``expires_in`` is the number
+    of seconds before the token expires or :obj:`None` if it doesn't expire and
+    ``payload`` must be passed to :func:`verify_token`. ``expires_in`` is zero
+    or negative if the token is expired.
+
+    Return :obj:`None` if the token is malformed or if the pre-signature is
+    invalid.
+
+    """
+    try:
+        data, signature = token.split(".")
+        data, signature = decode(data), decode(signature)
+    except Exception:
+        logger.debug("Bad token: cannot decode token")
+        return None
+
+    try:
+        user_pk, timestamp_and_pre_signature = packers.packer.unpack_pk(data)
+    except Exception:
+        logger.debug("Bad token: cannot extract primary key")
+        return None
+
+    try:
+        age, pre_signature = tokens_v2.unpack_timestamp(timestamp_and_pre_signature)
+    except Exception:
+        logger.debug("Bad token: cannot extract timestamp")
+        return None
+
+    if (
+        len(pre_signature) != PRE_SIGNATURE_SIZE
+        or len(signature) != settings.SIGNATURE_SIZE
+    ):
+        logger.debug("Bad token: cannot extract signature")
+        return None
+
+    # Check the pre-signature before anything else. It also tells which keys
+    # may have created the signature.
+
+    primary_key_and_timestamp = data[:-PRE_SIGNATURE_SIZE]
+    candidate_hashers = [
+        hasher
+        for pre_hasher, hasher in get_hashers()
+        if hmac.compare_digest(
+            pre_signature,
+            tokens_v2.sign(primary_key_and_timestamp + scope.encode(), pre_hasher),
+        )
+    ]
+    if not candidate_hashers:
+        log_scope = "in default scope" if scope == "" else f"in scope {scope}"
+        logger.debug("Bad token: invalid pre-signature %s", log_scope)
+        return None
+
+    expires_in = tokens_v2.get_expires_in(age, max_age)
+    payload = primary_key_and_timestamp, signature, scope, candidate_hashers
+    return user_pk, expires_in, payload
+
+
+def verify_token(user, payload):
+    """
+    Check the signature of a v3 signed token for a user.
+
+    ``payload`` is returned by :func:`decode_token`.
+
+    """
+    primary_key_and_timestamp, signature, scope, candidate_hashers = payload
+    revocation_key = tokens_v2.extract_revocation_key(user)
+    log_scope = "in default scope" if scope == "" else f"in scope {scope}"
+    for hasher in candidate_hashers:
+        expected_signature = tokens_v2.sign(
+            primary_key_and_timestamp + revocation_key + scope.encode(),
+            hasher,
+        )
+        if hmac.compare_digest(signature, expected_signature):
+            logger.debug("Valid token for user %s %s", user, log_scope)
+            return True
+
+    logger.debug("Invalid token for user %s %s", user, log_scope)
+    return False
+
+
+def parse_token(token, get_user, scope="", max_age=None):
+    """
+    Obtain a user from a v3 signed token.
+
+    """
+    decoded = decode_token(token, scope, max_age)
+    if decoded is None:
+        return None
+    user_pk, expires_in, payload = decoded
+
+    if expires_in is not None and expires_in <= 0:
+        logger.debug("Expired token: expired %d seconds ago", -expires_in)
+        return None
+
+    user = get_user(user_pk)
+    if user is None:
+        logger.debug(
+            "Unknown or inactive user: %s = %r",
+            settings.PRIMARY_KEY_FIELD,
+            user_pk,
+        )
+        return None
+
+    if not verify_token(user, payload):
+        return None
+
+    return user
+
+
+def get_token_sizes():
+    """
+    Return the possible sizes of v3 signed tokens with the current settings.
+
+    The result supports membership tests with ``in``.
+
+    """
+    timestamp_size = 0 if settings.MAX_AGE is None else 4
+    signature_size = tokens_v2.get_base64_size(settings.SIGNATURE_SIZE)
+    if packers.packer.size is None:
+        size = tokens_v2.get_base64_size(timestamp_size + PRE_SIGNATURE_SIZE)
+        return range(size + 1 + signature_size, sys.maxsize)
+    size = tokens_v2.get_base64_size(
+        packers.packer.size + timestamp_size + PRE_SIGNATURE_SIZE
+    )
+    return {size + 1 + signature_size}
+
+
+# Tokens are two Base64-encoded bytestrings separated by a dot. Their size
+# depends on SESAME_PACKER, SESAME_MAX_AGE, and SESAME_SIGNATURE_SIZE. Minimum
+# "sensible" size is 1 + 0 + 4 = 5 bytes = 7 Base64 characters, then 1 byte = 2
+# Base64 characters.
+token_re = re.compile(r"[A-Za-z0-9-_]{7,}\.[A-Za-z0-9-_]{2,}")
+
+
+def detect_token(token):
+    """
+    Tell whether token may be a v3 signed token.
+
+    """
+    return token_re.fullmatch(token) is not None
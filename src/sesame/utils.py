@@ -1,12 +1,48 @@
+import functools
+import itertools
 from urllib.parse import urlencode
 
-from django.contrib.auth import authenticate
+from asgiref.sync import sync_to_async
+from django.conf import settings as django_settings
+from django.contrib.auth import (
+    HASH_SESSION_KEY,
+    SESSION_KEY,
+    get_user_model,
+    load_backend,
+)
+from django.contrib.auth import _clean_credentials as clean_credentials  # private API
+from django.contrib.auth.signals import user_login_failed
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 
-from . import settings
-from .tokens import create_token
+from . import packers, settings, tokens_v1, tokens_v2, tokens_v3
+from .backends import (
+    SesameBackendMixin,
+    forget_users,
+    is_cache_enabled,
+    uncache_users,
+)
+from .tokens import (
+    INVALID_TOKEN,
+    create_token,
+    create_tokens,
+    get_revocation_fields,
+    get_tokens_module_getter,
+    parse_tokens,
+)
 
-__all__ = ["get_token", "get_parameters", "get_query_string", "get_user"]
+__all__ = [
+    "get_token",
+    "get_tokens",
+    "get_parameters",
+    "get_query_string",
+    "iter_query_strings",
+    "get_user",
+    "aget_user",
+    "get_users",
+    "warm_up",
+]
 
 
 def get_token(user, scope=""):
@@ -21,6 +57,22 @@ def get_token(user, scope=""):
     return create_token(user, scope)
 
 
+def get_tokens(users, scope=""):
+    """
+    Generate signed tokens to authenticate several ``users``.
+
+    Set ``scope`` to create :ref:`scoped tokens <Scoped tokens>`.
+
+    Return a :class:`list` of tokens in the same order as ``users``.
+
+    Use this function rather than calling :func:`get_token` repeatedly when
+    you need tokens for many users, for example to send a newsletter. It's
+    faster because it sets up the signing key only once.
+
+    """
+    return create_tokens(users, scope)
+
+
 def get_parameters(user, scope=""):
     """
     Generate a :class:`dict` of query string parameters to authenticate ``user``.
@@ -47,6 +99,30 @@ def get_query_string(user, scope=""):
     return "?" + urlencode({settings.TOKEN_NAME: create_token(user, scope)})
 
 
+def iter_query_strings(queryset, scope="", chunk_size=2000):
+    """
+    Generate complete query strings to authenticate users in ``queryset``.
+
+    Set ``scope`` to create :ref:`scoped tokens <Scoped tokens>`.
+
+    Yield ``(pk, query_string)`` pairs where ``pk`` is the primary key of a
+    user and ``query_string`` is what :func:`get_query_string` would return.
+
+    Use this function to send links to a large number of users. It loads only
+    the fields required for generating tokens and it fetches users from the
+    database by batches of ``chunk_size``. As a consequence, memory usage
+    doesn't grow with the number of users.
+
+    """
+    fields = [queryset.model._meta.pk.name, *get_revocation_fields()]
+    if settings.PRIMARY_KEY_FIELD != "pk":
+        fields.append(settings.PRIMARY_KEY_FIELD)
+    users = queryset.only(*fields).iterator(chunk_size=chunk_size)
+    while chunk := list(itertools.islice(users, chunk_size)):
+        for user, token in zip(chunk, create_tokens(chunk, scope)):
+            yield user.pk, "?" + urlencode({settings.TOKEN_NAME: token})
+
+
 def get_user(request_or_sesame, scope="", max_age=None, *, update_last_login=None):
     """
     Authenticate a user based on a signed token.
@@ -73,27 +149,11 @@ def get_user(request_or_sesame, scope="", max_age=None, *, update_last_login=Non
     :obj:`False` to avoid updating the last login date twice.
 
     """
-    if isinstance(request_or_sesame, str):
-        request = None
-        sesame = request_or_sesame
-    else:
-        # request is expected to be a django.http.HttpRequest
-        request = request_or_sesame
-        try:
-            sesame = request_or_sesame.GET.get(settings.TOKEN_NAME)
-        except Exception:
-            raise TypeError("get_user() expects an HTTPRequest or a token")
-        if sesame is None:
-            return None
-
-    # Call authenticate() to set user.backend to the value expected by login(),
-    # "sesame.backends.ModelBackend" or the dotted path to a subclass.
-    user = authenticate(
-        request,
-        sesame=sesame,
-        scope=scope,
-        max_age=max_age,
-    )
+    request, sesame = get_request_and_token(request_or_sesame)
+    if sesame is None:
+        return None
+
+    user = authenticate(request, sesame, scope, max_age)
     if user is None:
         return None
 
@@ -102,5 +162,266 @@ def get_user(request_or_sesame, scope="", max_age=None, *, update_last_login=Non
     if update_last_login:
         user.last_login = timezone.now()
         user.save(update_fields=["last_login"])
+        forget_users(request)
 
     return user
+
+
+async def aget_user(
+    request_or_sesame, scope="", max_age=None, *, update_last_login=None
+):
+    """
+    Asynchronous version of :func:`get_user`.
+
+    """
+    request, sesame = get_request_and_token(request_or_sesame)
+    if sesame is None:
+        return None
+
+    user = await aauthenticate(request, sesame, scope, max_age)
+    if user is None:
+        return None
+
+    if update_last_login is None:
+        update_last_login = settings.ONE_TIME
+    if update_last_login:
+        user.last_login = timezone.now()
+        await user.asave(update_fields=["last_login"])
+        forget_users(request)
+
+    return user
+
+
+def get_users(tokens, scope="", max_age=None, *, update_last_login=None):
+    """
+    Authenticate several users based on signed tokens.
+
+    Return a :class:`list` of ``(user, reason)`` pairs in the same order as
+    ``tokens``. If a token is valid, ``user`` is the user and ``reason`` is
+    :obj:`None`. Else, ``user`` is :obj:`None` and ``reason`` is a string
+    explaining why the token was rejected: ``"bad token"``, ``"expired
+    token"``, ``"unknown or inactive user"``, or ``"invalid token"``.
+
+    Use this function rather than calling :func:`get_user` repeatedly when you
+    need to validate many tokens, for example in a batch job. It fetches all
+    users at once. With :class:`~sesame.backends.ModelBackend`, this is a
+    single database query.
+
+    ``scope``, ``max_age``, and ``update_last_login`` behave like in
+    :func:`get_user`. When single-use tokens are enabled, each user is
+    authenticated at most once.
+
+    Unlike :func:`get_user`, :func:`get_users` doesn't go through
+    :func:`~django.contrib.auth.authenticate`. It uses the first backend in
+    :setting:`AUTHENTICATION_BACKENDS` that inherits
+    :class:`~sesame.backends.SesameBackendMixin`.
+
+    """
+    try:
+        backend, backend_path = get_backends()[0]
+    except IndexError:
+        raise ImproperlyConfigured(
+            "no django-sesame authentication backend found in AUTHENTICATION_BACKENDS"
+        )
+    results = parse_tokens(tokens, backend.get_users, scope, max_age)
+
+    users = []
+    user_pks = set()
+    for index, (user, _) in enumerate(results):
+        if user is None:
+            continue
+        # A single-use token for a user invalidates other tokens for that user.
+        if settings.ONE_TIME and user.pk in user_pks:
+            results[index] = None, INVALID_TOKEN
+            continue
+        # Set user.backend like authenticate() does.
+        user.backend = backend_path
+        users.append(user)
+        user_pks.add(user.pk)
+
+    if update_last_login is None:
+        update_last_login = settings.ONE_TIME
+    if update_last_login and users:
+        last_login = timezone.now()
+        User = get_user_model()
+        User._default_manager.filter(pk__in=user_pks).update(last_login=last_login)
+        for user in users:
+            user.last_login = last_login
+        # QuerySet.update() doesn't send the post_save signal.
+        if is_cache_enabled():
+            uncache_users(users)
+
+    return results
+
+
+def warm_up():
+    """
+    Perform initialization that django-sesame defers until it's needed.
+
+    django-sesame imports token modules, derives signing keys, checks settings,
+    and loads the user model when the first token is created or validated. Call
+    this function after Django is set up, for example at the end of your
+    ``wsgi.py`` or ``asgi.py`` module, to do this work upfront.
+
+    With a server that loads the application before forking workers, such as
+    gunicorn with ``--preload``, workers inherit the result.
+
+    """
+    # Accessing these attributes derives keys, imports token modules, checks
+    # settings, and loads the user model.
+    settings.TOKENS
+    packers.packer
+
+    get_tokens_module_getter()
+    tokens_v2.get_revocation_key_extractor()
+    tokens_v2.get_hashers()
+    if tokens_v1 in settings.TOKENS:
+        tokens_v1.get_signer()
+    if tokens_v3 in settings.TOKENS:
+        tokens_v3.get_hashers()
+
+
+@functools.lru_cache(maxsize=None)
+def get_backends():
+    """
+    Return django-sesame authentication backends and their paths.
+
+    The result is cached until settings change.
+
+    """
+    backends = []
+    for backend_path in django_settings.AUTHENTICATION_BACKENDS:
+        backend = load_backend(backend_path)
+        if isinstance(backend, SesameBackendMixin):
+            backends.append((backend, backend_path))
+    return backends
+
+
+# authenticate() and aauthenticate() behave like Django's functions of the same
+# name, restricted to django-sesame backends. This avoids loading every backend
+# in AUTHENTICATION_BACKENDS and inspecting its signature for every token.
+
+
+def authenticate(request, sesame, scope="", max_age=None):
+    """
+    Authenticate a user based on a signed token with django-sesame backends.
+
+    Set ``user.backend`` to the value expected by
+    :func:`~django.contrib.auth.login`: ``"sesame.backends.ModelBackend"`` or
+    the dotted path to a subclass.
+
+    """
+    for backend, backend_path in get_backends():
+        try:
+            user = backend.authenticate(
+                request,
+                sesame=sesame,
+                scope=scope,
+                max_age=max_age,
+            )
+        except PermissionDenied:
+            break
+        if user is not None:
+            user.backend = backend_path
+            return user
+
+    user_login_failed.send(
+        sender="django.contrib.auth",  # like authenticate()
+        credentials=clean_credentials(
+            {"sesame": sesame, "scope": scope, "max_age": max_age}
+        ),
+        request=request,
+    )
+    return None
+
+
+async def aauthenticate(request, sesame, scope="", max_age=None):
+    """
+    Asynchronous version of :func:`authenticate`.
+
+    """
+    for backend, backend_path in get_backends():
+        try:
+            user = await backend.aauthenticate(
+                request,
+                sesame=sesame,
+                scope=scope,
+                max_age=max_age,
+            )
+        except PermissionDenied:
+            break
+        if user is not None:
+            user.backend = backend_path
+            return user
+
+    try:
+        asend = user_login_failed.asend
+    except AttributeError:  # Django < 5.0
+        asend = sync_to_async(user_login_failed.send)
+    await asend(
+        sender="django.contrib.auth",  # like aauthenticate()
+        credentials=clean_credentials(
+            {"sesame": sesame, "scope": scope, "max_age": max_age}
+        ),
+        request=request,
+    )
+    return None
+
+
+# Logging a user in rotates the session key, writes the session, and updates
+# the last login date. When a link is clicked again, the user may already be
+# logged in. Then, this work is redundant, unless it invalidates the token.
+
+
+def is_logged_in(request, user):
+    """
+    Tell whether ``user`` is logged in the session of ``request``.
+
+    This compares the session with ``user`` like
+    :func:`~django.contrib.auth.login` does.
+
+    """
+    session_auth_hash = ""
+    if hasattr(user, "get_session_auth_hash"):
+        session_auth_hash = user.get_session_auth_hash()
+    if request.session.get(SESSION_KEY) != user._meta.pk.value_to_string(user):
+        return False
+    return constant_time_compare(
+        request.session.get(HASH_SESSION_KEY, ""),
+        session_auth_hash,
+    )
+
+
+def needs_login(request, user):
+    """
+    Tell whether :func:`~django.contrib.auth.login` must log ``user`` in.
+
+    """
+    if not settings.SKIP_REDUNDANT_LOGIN or settings.ONE_TIME:
+        return True
+    return not is_logged_in(request, user)
+
+
+async def aneeds_login(request, user):
+    """
+    Asynchronous version of :func:`needs_login`.
+
+    """
+    if not settings.SKIP_REDUNDANT_LOGIN or settings.ONE_TIME:
+        return True
+    return not await sync_to_async(is_logged_in)(request, user)
+
+
+def get_request_and_token(request_or_sesame):
+    """
+    Split the argument of :func:`get_user` into a request and a token.
+
+    """
+    if isinstance(request_or_sesame, str):
+        return None, request_or_sesame
+    # request is expected to be a django.http.HttpRequest
+    try:
+        sesame = request_or_sesame.GET.get(settings.TOKEN_NAME)
+    except Exception:
+        raise TypeError("get_user() expects an HTTPRequest or a token")
+    return request_or_sesame, sesame
@@ -1,14 +1,15 @@
 from http import HTTPStatus
 
 from django.conf import settings as django_settings
-from django.contrib.auth import REDIRECT_FIELD_NAME, authenticate, login
+from django.contrib.auth import REDIRECT_FIELD_NAME, login
 from django.core.exceptions import ImproperlyConfigured, PermissionDenied
 from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import resolve_url
 from django.utils.http import url_has_allowed_host_and_scheme  # private API
 from django.views.generic import View
 
-from . import settings
+from . import settings, throttling
+from .utils import authenticate, needs_login
 
 try:
     from django.contrib.auth.views import RedirectURLMixin  # private API
@@ -67,6 +68,10 @@ class LoginView(RedirectURLMixin, View):
     ``get_default_redirect_url()``. These APIs behave like their counterparts
     in Django's built-in :class:`~django.contrib.auth.views.LoginView`.
 
+    When :ref:`throttling <Throttling>` is enabled, :class:`LoginView` returns
+    an HTTP 429 Too Many Requests response to clients that sent too many
+    invalid tokens.
+
     """
 
     scope = ""
@@ -81,6 +86,9 @@ class LoginView(RedirectURLMixin, View):
         if sesame is None:
             return self.login_failed()
 
+        if throttling.is_throttled(request):
+            return throttling.get_throttled_response()
+
         user = authenticate(
             request,
             sesame=sesame,
@@ -88,9 +96,11 @@ class LoginView(RedirectURLMixin, View):
             max_age=self.max_age,
         )
         if user is None:
+            throttling.record_invalid_token(request)
             return self.login_failed()
 
-        login(request, user)  # updates the last login date
+        if needs_login(request, user):
+            login(request, user)  # updates the last login date
 
         return self.login_success()
 
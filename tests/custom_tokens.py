@@ -0,0 +1,18 @@
+"""
+Token format providing only the functions required of third-party modules.
+
+"""
+
+from sesame import tokens_v2
+
+
+def create_token(user, scope=""):
+    return tokens_v2.create_token(user, scope)
+
+
+def detect_token(token):
+    return tokens_v2.detect_token(token)
+
+
+def parse_token(token, get_user, scope="", max_age=None):
+    return tokens_v2.parse_token(token, get_user, scope, max_age)
@@ -4,11 +4,10 @@ import logging
 import unittest
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
 from django.utils import timezone
 
 
-class CreateUserMixin(TestCase):
+class CreateUserMixin(unittest.TestCase):
     def setUp(self):
         super().setUp()
         self.user = self.create_user()
@@ -29,6 +28,11 @@ class CreateUserMixin(TestCase):
         User = get_user_model()
         return User.objects.filter(pk=user_id).first()
 
+    @staticmethod
+    async def aget_user(user_id):
+        User = get_user_model()
+        return await User.objects.filter(pk=user_id).afirst()
+
 
 class CaptureLogMixin(unittest.TestCase):
     logger_name = "sesame"
@@ -1,11 +1,33 @@
-from django.test import TestCase, override_settings
+from unittest import mock
 
-from sesame.backends import ModelBackend
+from django.contrib import auth
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_in
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+
+from sesame.backends import CachedModelBackend, ModelBackend, SesameBackendMixin
 from sesame.tokens import create_token
 
 from .mixins import CaptureLogMixin, CreateUserMixin
 
 
+class NoStaffModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        user = super().get_user(user_id)
+        if user is not None and user.is_staff:
+            return None
+        return user
+
+
+class NoStaffCachedModelBackend(CachedModelBackend):
+    def get_user(self, user_id):
+        user = super().get_user(user_id)
+        if user is not None and user.is_staff:
+            return None
+        return user
+
+
 class TestModelBackend(CaptureLogMixin, CreateUserMixin, TestCase):
     def test_token(self):
         token = create_token(self.user)
@@ -58,3 +80,291 @@ class TestModelBackend(CaptureLogMixin, CreateUserMixin, TestCase):
         user = ModelBackend().authenticate(request=None, sesame=token, max_age=-300)
         self.assertIsNone(user)
         self.assertLogsContain("Expired token")
+
+    def test_get_users(self):
+        user1 = self.user
+        user2 = self.create_user("jane")
+        user3 = self.create_user("jack", is_active=False)
+        with self.assertNumQueries(1):
+            users = ModelBackend().get_users([user1.pk, user2.pk, user3.pk, 42])
+        self.assertEqual(users, {user1.pk: user1, user2.pk: user2})
+
+    @override_settings(SESAME_PRIMARY_KEY_FIELD="username")
+    def test_get_users_alternative_primary_key(self):
+        users = ModelBackend().get_users(["john", "jane"])
+        self.assertEqual(users, {"john": self.user})
+
+    def test_get_users_default_implementation(self):
+        class Backend(SesameBackendMixin):
+            def get_user(self, user_id):
+                return get_user_model()._default_manager.filter(pk=user_id).first()
+
+        users = Backend().get_users([self.user.pk, 42])
+        self.assertEqual(users, {self.user.pk: self.user})
+
+    async def test_aauthenticate(self):
+        token = create_token(self.user)
+        user = await ModelBackend().aauthenticate(request=None, sesame=token)
+        self.assertEqual(user, self.user)
+        self.assertLogsContain("Valid token for user john in default scope")
+
+    async def test_aauthenticate_no_token(self):
+        user = await ModelBackend().aauthenticate(request=None, sesame=None)
+        self.assertIsNone(user)
+        self.assertNoLogs()
+
+    async def test_aauthenticate_inactive_user(self):
+        self.user.is_active = False
+        await self.user.asave()
+        token = create_token(self.user)
+        user = await ModelBackend().aauthenticate(request=None, sesame=token)
+        self.assertIsNone(user)
+        self.assertLogsContain("Unknown or inactive user")
+
+    async def test_aauthenticate_without_aget_user(self):
+        class Backend(SesameBackendMixin):
+            def get_user(self, user_id):
+                return get_user_model()._default_manager.get(pk=user_id)
+
+        token = create_token(self.user)
+        user = await Backend().aauthenticate(request=None, sesame=token)
+        self.assertEqual(user, self.user)
+
+    def test_get_users_with_custom_get_user(self):
+        self.user.is_staff = True
+        self.user.save()
+        user2 = self.create_user("jane")
+        users = NoStaffModelBackend().get_users([self.user.pk, user2.pk])
+        self.assertEqual(users, {user2.pk: user2})
+
+    async def test_aauthenticate_with_custom_get_user(self):
+        self.user.is_staff = True
+        await self.user.asave()
+        token = create_token(self.user)
+        user = await NoStaffModelBackend().aauthenticate(request=None, sesame=token)
+        self.assertIsNone(user)
+        self.assertLogsContain("Unknown or inactive user")
+
+    @override_settings(SESAME_USER_FIELDS=["first_name"])
+    def test_user_fields(self):
+        token = create_token(self.user)
+        with self.assertNumQueries(1):
+            user = ModelBackend().authenticate(request=None, sesame=token)
+            self.assertEqual(user, self.user)
+            self.assertEqual(user.first_name, "")
+        self.assertEqual(
+            user.get_deferred_fields(),
+            {
+                "date_joined",
+                "email",
+                "is_staff",
+                "is_superuser",
+                "last_login",
+                "last_name",
+            },
+        )
+        self.assertLogsContain("Valid token for user john in default scope")
+
+    @override_settings(
+        SESAME_USER_FIELDS=[],
+        SESAME_INVALIDATE_ON_EMAIL_CHANGE=True,
+        SESAME_ONE_TIME=True,
+    )
+    def test_user_fields_include_revocation_fields(self):
+        token = create_token(self.user)
+        user = ModelBackend().authenticate(request=None, sesame=token)
+        self.assertEqual(user, self.user)
+        self.assertNotIn("email", user.get_deferred_fields())
+        self.assertNotIn("last_login", user.get_deferred_fields())
+
+    @override_settings(SESAME_USER_FIELDS=[])
+    def test_user_fields_inactive_user(self):
+        self.test_inactive_user()
+
+    @override_settings(SESAME_USER_FIELDS=[])
+    async def test_user_fields_aauthenticate(self):
+        token = create_token(self.user)
+        user = await ModelBackend().aauthenticate(request=None, sesame=token)
+        self.assertEqual(user, self.user)
+        self.assertIn("email", user.get_deferred_fields())
+
+    @override_settings(SESAME_USER_FIELDS=[])
+    def test_user_fields_get_users(self):
+        users = ModelBackend().get_users([self.user.pk])
+        self.assertEqual(users, {self.user.pk: self.user})
+        self.assertIn("email", users[self.user.pk].get_deferred_fields())
+
+    @override_settings(SESAME_USER_FIELDS=[])
+    def test_user_fields_dont_apply_to_sessions(self):
+        self.client.force_login(self.user, backend="sesame.backends.ModelBackend")
+        request = RequestFactory().get("/")
+        request.session = self.client.session
+        user = auth.get_user(request)
+        self.assertEqual(user, self.user)
+        self.assertEqual(user.get_deferred_fields(), set())
+
+    @override_settings(SESAME_USER_FIELDS=[])
+    async def test_user_fields_dont_apply_to_aget_user(self):
+        user = await ModelBackend().aget_user(self.user.pk)
+        self.assertEqual(user, self.user)
+        self.assertEqual(user.get_deferred_fields(), set())
+
+    # Test memoization per request
+
+    def test_authenticate_request_twice(self):
+        request = RequestFactory().get("/")
+        token = create_token(self.user)
+        with self.assertNumQueries(1):
+            user1 = ModelBackend().authenticate(request=request, sesame=token)
+            user2 = ModelBackend().authenticate(request=request, sesame=token)
+        self.assertEqual(user1, self.user)
+        self.assertIs(user2, user1)
+
+    async def test_aauthenticate_request_twice(self):
+        request = RequestFactory().get("/")
+        token = create_token(self.user)
+        user1 = await ModelBackend().aauthenticate(request=request, sesame=token)
+        user2 = await ModelBackend().aauthenticate(request=request, sesame=token)
+        self.assertEqual(user1, self.user)
+        self.assertIs(user2, user1)
+
+    def test_authenticate_request_twice_with_different_scopes(self):
+        request = RequestFactory().get("/")
+        token = create_token(self.user)
+        with self.assertNumQueries(2):
+            user1 = ModelBackend().authenticate(request=request, sesame=token)
+            user2 = ModelBackend().authenticate(
+                request=request, sesame=token, scope="test"
+            )
+        self.assertEqual(user1, self.user)
+        self.assertIsNone(user2)
+
+    def test_authenticate_different_requests(self):
+        token = create_token(self.user)
+        with self.assertNumQueries(2):
+            ModelBackend().authenticate(request=RequestFactory().get("/"), sesame=token)
+            ModelBackend().authenticate(request=RequestFactory().get("/"), sesame=token)
+
+    @override_settings(SESAME_ONE_TIME=True)
+    def test_authenticate_request_after_login_with_one_time_token(self):
+        request = RequestFactory().get("/")
+        token = create_token(self.user)
+        user = ModelBackend().authenticate(request=request, sesame=token)
+        user_logged_in.send(sender=type(user), request=request, user=user)
+        user = ModelBackend().authenticate(request=request, sesame=token)
+        self.assertIsNone(user)
+        self.assertLogsContain("Invalid token for user john in default scope")
+
+    def test_save_user_skips_cache_invalidation(self):
+        with mock.patch.object(cache, "delete_many") as delete_many:
+            self.user.save()
+            self.user.delete()
+        delete_many.assert_not_called()
+
+    @override_settings(SESAME_PRIMARY_KEY_FIELD="username")
+    def test_save_user_skips_primary_key_lookup(self):
+        with self.assertNumQueries(1):
+            self.user.save()
+
+
+@override_settings(AUTHENTICATION_BACKENDS=["sesame.backends.CachedModelBackend"])
+class TestCachedModelBackend(CaptureLogMixin, CreateUserMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_token(self):
+        token = create_token(self.user)
+        with self.assertNumQueries(1):
+            user = CachedModelBackend().authenticate(request=None, sesame=token)
+        self.assertEqual(user, self.user)
+        with self.assertNumQueries(0):
+            user = CachedModelBackend().authenticate(request=None, sesame=token)
+        self.assertEqual(user, self.user)
+        self.assertLogsContain("Valid token for user john in default scope")
+
+    def test_inactive_user(self):
+        self.user.is_active = False
+        self.user.save()
+        token = create_token(self.user)
+        user = CachedModelBackend().authenticate(request=None, sesame=token)
+        self.assertIsNone(user)
+        self.assertLogsContain("Unknown or inactive user")
+
+    def test_invalid_token_after_password_change(self):
+        token = create_token(self.user)
+        CachedModelBackend().authenticate(request=None, sesame=token)
+        self.user.set_password("hunter2")
+        self.user.save()
+        user = CachedModelBackend().authenticate(request=None, sesame=token)
+        self.assertIsNone(user)
+        self.assertLogsContain("Invalid token for user john in default scope")
+
+    def test_invalid_token_after_user_deactivation(self):
+        token = create_token(self.user)
+        CachedModelBackend().authenticate(request=None, sesame=token)
+        self.user.is_active = False
+        self.user.save()
+        user = CachedModelBackend().authenticate(request=None, sesame=token)
+        self.assertIsNone(user)
+        self.assertLogsContain("Unknown or inactive user")
+
+    def test_invalid_token_after_user_deletion(self):
+        token = create_token(self.user)
+        CachedModelBackend().authenticate(request=None, sesame=token)
+        self.user.delete()
+        user = CachedModelBackend().authenticate(request=None, sesame=token)
+        self.assertIsNone(user)
+        self.assertLogsContain("Unknown or inactive user")
+
+    @override_settings(SESAME_PRIMARY_KEY_FIELD="username")
+    def test_invalid_token_after_primary_key_change(self):
+        token = create_token(self.user)
+        CachedModelBackend().authenticate(request=None, sesame=token)
+        self.user.username = "jack"
+        self.user.save()
+        user = CachedModelBackend().authenticate(request=None, sesame=token)
+        self.assertIsNone(user)
+        self.assertLogsContain("Unknown or inactive user")
+
+    @override_settings(SESAME_PRIMARY_KEY_FIELD="username")
+    def test_last_login_update_skips_primary_key_lookup(self):
+        with self.assertNumQueries(1):
+            self.user.save(update_fields=["last_login"])
+
+    async def test_aauthenticate(self):
+        token = create_token(self.user)
+        user = await CachedModelBackend().aauthenticate(request=None, sesame=token)
+        self.assertEqual(user, self.user)
+        # Updating the database without sending signals leaves a stale entry.
+        users = get_user_model().objects.filter(pk=self.user.pk)
+        await users.aupdate(is_active=False)
+        user = await CachedModelBackend().aauthenticate(request=None, sesame=token)
+        self.assertEqual(user, self.user)
+
+    def test_get_users_with_custom_get_user(self):
+        self.user.is_staff = True
+        self.user.save()
+        user2 = self.create_user("jane")
+        users = NoStaffCachedModelBackend().get_users([self.user.pk, user2.pk])
+        self.assertEqual(users, {user2.pk: user2})
+
+    async def test_aauthenticate_with_custom_get_user(self):
+        self.user.is_staff = True
+        await self.user.asave()
+        token = create_token(self.user)
+        backend = NoStaffCachedModelBackend()
+        user = await backend.aauthenticate(request=None, sesame=token)
+        self.assertIsNone(user)
+        self.assertLogsContain("Unknown or inactive user")
+
+    def test_get_users(self):
+        user1 = self.user
+        user2 = self.create_user("jane")
+        CachedModelBackend().get_user(user1.pk)
+        with self.assertNumQueries(1):
+            users = CachedModelBackend().get_users([user1.pk, user2.pk])
+        self.assertEqual(users, {user1.pk: user1, user2.pk: user2})
+        with self.assertNumQueries(0):
+            users = CachedModelBackend().get_users([user1.pk, user2.pk])
+        self.assertEqual(users, {user1.pk: user1, user2.pk: user2})
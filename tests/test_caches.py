@@ -0,0 +1,71 @@
+import unittest
+import unittest.mock
+
+from sesame.caches import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get_set(self):
+        cache = LRUCache(2)
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+
+    def test_delete(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.delete("a")
+        self.assertIsNone(cache.get("a"))
+        cache.delete("a")
+
+    def test_clear(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.clear()
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+
+    def test_evict_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+    @unittest.mock.patch("time.monotonic")
+    def test_expire(self, monotonic):
+        monotonic.return_value = 0
+        cache = LRUCache(3, ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=5)
+        cache.set("c", 3, ttl=20)
+        monotonic.return_value = 5
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        monotonic.return_value = 10
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNone(cache.get("c"))
+
+    def test_expire_immediately(self):
+        cache = LRUCache(2, ttl=10)
+        cache.set("a", 1, ttl=0)
+        self.assertIsNone(cache.get("a"))
+
+    def test_no_expiry(self):
+        cache = LRUCache(2, ttl=None)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+
+    def test_info(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("b")
+        self.assertEqual(
+            cache.info(),
+            {"hits": 1, "misses": 1, "size": 1, "max_size": 2},
+        )
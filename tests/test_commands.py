@@ -0,0 +1,117 @@
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+from django.core.management import call_command
+from django.db import connections
+from django.test import TestCase, TransactionTestCase
+
+from sesame.tokens import parse_token
+
+from .mixins import CreateUserMixin
+
+
+class GenerateLinksMixin:
+    def setUp(self):
+        super().setUp()
+        self.users = [self.user] + [self.create_user(f"user{i}") for i in range(4)]
+
+    def generate_links(self, *args, **kwargs):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        kwargs.setdefault("workers", 1)
+        call_command(
+            "sesame_generate_links",
+            *args,
+            stdout=stdout,
+            stderr=stderr,
+            **kwargs,
+        )
+        return stdout.getvalue(), stderr.getvalue()
+
+    def assertTokensValid(self, rows, scope=""):
+        self.assertEqual([pk for pk, _ in rows], [user.pk for user in self.users])
+        for (pk, token), user in zip(rows, self.users):
+            self.assertEqual(parse_token(token, self.get_user, scope), user)
+
+
+class TestGenerateLinks(GenerateLinksMixin, CreateUserMixin, TestCase):
+    def test_csv(self):
+        stdout, stderr = self.generate_links()
+        header, *lines = stdout.splitlines()
+        self.assertEqual(header, "pk,token")
+        rows = [line.split(",") for line in lines]
+        self.assertTokensValid([(int(pk), token) for pk, token in rows])
+        self.assertIn("5 tokens generated", stderr)
+
+    def test_jsonl(self):
+        stdout, _ = self.generate_links(format="jsonl")
+        rows = [json.loads(line) for line in stdout.splitlines()]
+        self.assertTokensValid([(row["pk"], row["token"]) for row in rows])
+
+    def test_scope(self):
+        stdout, _ = self.generate_links(format="jsonl", scope="test")
+        rows = [json.loads(line) for line in stdout.splitlines()]
+        self.assertTokensValid([(row["pk"], row["token"]) for row in rows], "test")
+
+    def test_small_chunks(self):
+        with self.assertNumQueries(4):  # 1 for primary keys + 3 for chunks
+            stdout, _ = self.generate_links(format="jsonl", chunk_size=2)
+        rows = [json.loads(line) for line in stdout.splitlines()]
+        self.assertTokensValid([(row["pk"], row["token"]) for row in rows])
+
+    def test_output_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "links.jsonl")
+            stdout, _ = self.generate_links(format="jsonl", output=path)
+            with open(path) as output:
+                rows = [json.loads(line) for line in output]
+        self.assertEqual(stdout, "")
+        self.assertTokensValid([(row["pk"], row["token"]) for row in rows])
+
+    def test_quiet(self):
+        _, stderr = self.generate_links(verbosity=0)
+        self.assertEqual(stderr, "")
+
+
+# Worker processes open their own connections to the database. They can't see
+# the in-memory test database. Use a database stored in a file instead. Workers
+# inherit its settings when they're forked.
+
+
+@unittest.skipUnless(
+    multiprocessing.get_start_method() == "fork",
+    "worker processes must inherit database settings",
+)
+class TestGenerateLinksWorkers(
+    GenerateLinksMixin, CreateUserMixin, TransactionTestCase
+):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.connection = connections["default"]
+        connection = cls.connection.copy()
+        connection.settings_dict = {
+            **cls.connection.settings_dict,
+            "NAME": os.path.join(cls.directory.name, "db.sqlite3"),
+        }
+        connections["default"] = connection
+        call_command("migrate", run_syncdb=True, verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections["default"].close()
+        connections["default"] = cls.connection
+        cls.directory.cleanup()
+
+    def test_workers(self):
+        single_process, _ = self.generate_links(format="jsonl", chunk_size=2)
+        stdout, stderr = self.generate_links(format="jsonl", chunk_size=2, workers=2)
+        self.assertEqual(stdout, single_process)
+        rows = [json.loads(line) for line in stdout.splitlines()]
+        self.assertTokensValid([(row["pk"], row["token"]) for row in rows])
+        self.assertIn("5 tokens generated", stderr)
@@ -1,6 +1,7 @@
 import http
 
-from django.contrib.auth import get_user
+from asgiref.sync import sync_to_async
+from django.contrib.auth import SESSION_KEY, get_user
 from django.contrib.auth.models import AnonymousUser
 from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
@@ -96,3 +97,48 @@ class TestAuthenticate(CreateUserMixin, TestCase):
             str(exc.exception),
             "authenticate(permanent=True) requires django.contrib.sessions",
         )
+
+
+class TestAsyncAuthenticate(CreateUserMixin, TestCase):
+    async def test_success(self):
+        params = get_parameters(self.user)
+        response = await self.async_client.get("/authenticate/async/", params)
+        self.assertEqual(response.asgi_request.user, self.user)
+        self.assertContains(response, self.user.username)
+
+    async def test_default_required(self):
+        response = await self.async_client.get("/authenticate/async/")
+        self.assertIsInstance(response.asgi_request.user, AnonymousUser)
+        self.assertEqual(response.status_code, http.HTTPStatus.FORBIDDEN)
+
+    async def test_not_required(self):
+        response = await self.async_client.get("/authenticate/async/not_required/")
+        self.assertIsInstance(response.asgi_request.user, AnonymousUser)
+        self.assertContains(response, "anonymous")
+
+    async def test_permanent(self):
+        params = get_parameters(self.user)
+        response = await self.async_client.get("/authenticate/async/permanent/", params)
+        self.assertEqual(
+            response.asgi_request.session[SESSION_KEY],
+            str(self.user.pk),
+        )
+        self.assertContains(response, self.user.username)
+
+    async def test_no_override(self):
+        user1 = self.user
+        user2 = await sync_to_async(self.create_user)("jane")
+        await self.async_client.aforce_login(user1)
+        params = get_parameters(user2)
+        response = await self.async_client.get(
+            "/authenticate/async/no_override/", params
+        )
+        self.assertContains(response, user1.username)
+
+    async def test_override(self):
+        user1 = self.user
+        user2 = await sync_to_async(self.create_user)("jane")
+        await self.async_client.aforce_login(user1)
+        params = get_parameters(user2)
+        response = await self.async_client.get("/authenticate/async/", params)
+        self.assertContains(response, user2.username)
@@ -1,10 +1,14 @@
 import unittest
+from unittest import mock
+from urllib.parse import urlencode
 
-from django.contrib.auth import get_user
+from django.contrib.auth import SESSION_KEY, get_user
 from django.contrib.auth.models import AnonymousUser
-from django.test import TestCase
+from django.test import RequestFactory, SimpleTestCase, TestCase
 from django.test.utils import override_settings
 
+from sesame.middleware import AuthenticationMiddleware, is_safari_user_agent
+from sesame.tokens import create_token
 from sesame.utils import get_parameters, get_query_string
 
 from .mixins import CreateUserMixin
@@ -28,6 +32,18 @@ CHROME_IOS_USER_AGENT = (
 )
 
 
+CHROME_USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/120.0.0.0 Safari/537.36"
+)
+
+FIREFOX_USER_AGENT = (
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:121.0) "
+    "Gecko/20100101 Firefox/121.0"
+)
+
+
 @override_settings(
     MIDDLEWARE=[
         "django.contrib.sessions.middleware.SessionMiddleware",
@@ -99,6 +115,40 @@ class TestMiddleware(CreateUserMixin, TestCase):
         response = self.client.get("/", params)
         self.assertUserNotLoggedIn(response)
 
+    def test_no_token_doesnt_parse_query_string(self):
+        response = self.client.get("/", {"page": 2})
+        self.assertUserNotLoggedIn(response)
+        self.assertNotIn("GET", vars(response.wsgi_request))
+
+    @override_settings(SESAME_MIDDLEWARE_INCLUDE_PATHS=["/foo"])
+    def test_token_in_included_path(self):
+        response = self.client.get("/foo", get_parameters(self.user))
+        self.assertUserLoggedIn(response, redirect_url="/foo")
+
+    @override_settings(SESAME_MIDDLEWARE_INCLUDE_PATHS=["/foo"])
+    def test_token_outside_included_paths(self):
+        response = self.client.get("/bar", get_parameters(self.user))
+        self.assertUserNotLoggedIn(response)
+
+    @override_settings(SESAME_MIDDLEWARE_EXCLUDE_PATHS=["/foo"])
+    def test_token_in_excluded_path(self):
+        with self.assertNumQueries(0):
+            response = self.client.get("/foo", get_parameters(self.user))
+        self.assertUserNotLoggedIn(response)
+
+    @override_settings(
+        SESAME_MIDDLEWARE_INCLUDE_PATHS=["/foo"],
+        SESAME_MIDDLEWARE_EXCLUDE_PATHS=["/foo/bar"],
+    )
+    def test_token_in_excluded_path_within_included_path(self):
+        response = self.client.get("/foo/bar", get_parameters(self.user))
+        self.assertUserNotLoggedIn(response)
+
+    @override_settings(SESAME_TOKEN_NAME="url auth")
+    def test_token_with_custom_name(self):
+        response = self.client.get("/", {"url auth": create_token(self.user)})
+        self.assertUserLoggedIn(response, redirect_url="/")
+
     # one query to get the user matching the token
     # one query to update their last login date
     NUM_QUERIES = 2
@@ -187,3 +237,209 @@ class TestWithoutSessionMiddleware(TestMiddleware):
     # The last login date isn't updated when the session middleware isn't
     # enabled, except for one-time tokens.
     NUM_QUERIES = TestMiddleware.NUM_QUERIES - 1
+
+
+@override_settings(
+    MIDDLEWARE=[
+        "django.contrib.sessions.middleware.SessionMiddleware",
+        "django.contrib.auth.middleware.AuthenticationMiddleware",
+        "sesame.middleware.AuthenticationMiddleware",
+    ],
+    SESAME_SKIP_REDUNDANT_LOGIN=True,
+)
+class TestSkipRedundantLogin(CreateUserMixin, TestCase):
+    def test_token_when_logged_in(self):
+        params = get_parameters(self.user)
+        self.client.get("/", params)
+        self.user.refresh_from_db()
+        last_login = self.user.last_login
+        # one query to get the user matching the token
+        with self.assertNumQueries(1):
+            response = self.client.get("/", params)
+        self.assertRedirects(response, "/")
+        self.assertEqual(get_user(response.wsgi_request), self.user)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_login, last_login)
+
+    def test_token_when_logged_in_as_other_user(self):
+        other_user = self.create_user("jane")
+        self.client.force_login(other_user)
+        response = self.client.get("/", get_parameters(self.user))
+        self.assertRedirects(response, "/")
+        self.assertEqual(get_user(response.wsgi_request), self.user)
+
+    def test_token_after_password_change(self):
+        params = get_parameters(self.user)
+        self.client.get("/", params)
+        self.user.set_password("hunter2")
+        self.user.save()
+        response = self.client.get("/", get_parameters(self.user))
+        self.assertRedirects(response, "/")
+        self.assertEqual(get_user(response.wsgi_request), self.user)
+
+    @override_settings(SESAME_ONE_TIME=True)
+    def test_one_time_token_when_logged_in(self):
+        self.client.force_login(self.user)
+        self.user.refresh_from_db()
+        last_login = self.user.last_login
+        response = self.client.get("/", get_parameters(self.user))
+        self.assertRedirects(response, "/")
+        # The token is invalidated by updating the last login date.
+        self.user.refresh_from_db()
+        self.assertGreater(self.user.last_login, last_login)
+
+    async def test_async_token_when_logged_in(self):
+        params = get_parameters(self.user)
+        await self.async_client.get("/async/", params)
+        await self.user.arefresh_from_db()
+        last_login = self.user.last_login
+        response = await self.async_client.get("/async/", params)
+        self.assertRedirects(response, "/async/", fetch_redirect_response=False)
+        await self.user.arefresh_from_db()
+        self.assertEqual(self.user.last_login, last_login)
+
+
+@unittest.skipIf(ua_parser is None, "test requires ua-parser")
+class TestSafariDetection(SimpleTestCase):
+    def setUp(self):
+        is_safari_user_agent.cache_clear()
+
+    def is_safari(self, user_agent, **extra):
+        request = RequestFactory().get("/", HTTP_USER_AGENT=user_agent, **extra)
+        return AuthenticationMiddleware.is_safari(request)
+
+    def test_safari(self):
+        self.assertTrue(self.is_safari(SAFARI_USER_AGENT))
+
+    def test_ios(self):
+        self.assertTrue(self.is_safari(CHROME_IOS_USER_AGENT))
+
+    @mock.patch("ua_parser.user_agent_parser.Parse")
+    def test_chrome_without_parsing(self, Parse):
+        self.assertFalse(self.is_safari(CHROME_USER_AGENT))
+        Parse.assert_not_called()
+
+    @mock.patch("ua_parser.user_agent_parser.Parse")
+    def test_firefox_without_parsing(self, Parse):
+        self.assertFalse(self.is_safari(FIREFOX_USER_AGENT))
+        Parse.assert_not_called()
+
+    @mock.patch("ua_parser.user_agent_parser.Parse")
+    def test_client_hints_without_parsing(self, Parse):
+        self.assertFalse(
+            self.is_safari(SAFARI_USER_AGENT, HTTP_SEC_CH_UA='"Chromium";v="120"')
+        )
+        Parse.assert_not_called()
+
+    def test_cache(self):
+        self.assertTrue(self.is_safari(SAFARI_USER_AGENT))
+        with mock.patch("ua_parser.user_agent_parser.Parse") as Parse:
+            self.assertTrue(self.is_safari(SAFARI_USER_AGENT))
+        Parse.assert_not_called()
+
+
+@override_settings(
+    MIDDLEWARE=["sesame.middleware.AuthenticationMiddleware"],
+    SESAME_UPGRADE_TOKENS=True,
+)
+class TestUpgradeTokens(CreateUserMixin, TestCase):
+    def get_v1_parameters(self):
+        with override_settings(SESAME_TOKENS=["sesame.tokens_v1"]):
+            return get_parameters(self.user)
+
+    def test_legacy_token(self):
+        response = self.client.get("/foo", {"bar": 42, **self.get_v1_parameters()})
+        token = create_token(self.user)
+        self.assertRedirects(
+            response,
+            "/foo?" + urlencode({"bar": 42, "sesame": token}),
+            fetch_redirect_response=False,
+        )
+        response = self.client.get(response.url)
+        self.assertContains(response, self.user.username)
+
+    async def test_async_legacy_token(self):
+        response = await self.async_client.get("/async/", self.get_v1_parameters())
+        self.assertRedirects(
+            response,
+            "/async/" + get_query_string(self.user),
+            fetch_redirect_response=False,
+        )
+
+    def test_current_token(self):
+        response = self.client.get("/", get_parameters(self.user))
+        self.assertContains(response, self.user.username)
+
+    def test_legacy_token_in_POST_request(self):
+        response = self.client.post("/?" + urlencode(self.get_v1_parameters()))
+        self.assertContains(response, self.user.username)
+
+    @override_settings(SESAME_UPGRADE_TOKENS=False)
+    def test_legacy_token_when_disabled(self):
+        response = self.client.get("/", self.get_v1_parameters())
+        self.assertContains(response, self.user.username)
+
+    @override_settings(
+        MIDDLEWARE=[
+            "django.contrib.sessions.middleware.SessionMiddleware",
+            "django.contrib.auth.middleware.AuthenticationMiddleware",
+            "sesame.middleware.AuthenticationMiddleware",
+        ],
+    )
+    def test_legacy_token_removed_from_url(self):
+        response = self.client.get("/", self.get_v1_parameters())
+        self.assertRedirects(response, "/")
+
+
+@override_settings(
+    MIDDLEWARE=[
+        "django.contrib.sessions.middleware.SessionMiddleware",
+        "django.contrib.auth.middleware.AuthenticationMiddleware",
+        "sesame.middleware.AuthenticationMiddleware",
+    ],
+)
+class TestAsyncMiddleware(CreateUserMixin, TestCase):
+    async def test_token(self):
+        response = await self.async_client.get("/async/", get_parameters(self.user))
+        self.assertEqual(
+            response.asgi_request.session[SESSION_KEY],
+            str(self.user.pk),
+        )
+        self.assertRedirects(response, "/async/", fetch_redirect_response=False)
+
+    async def test_no_token(self):
+        response = await self.async_client.get("/async/")
+        self.assertNotIn(SESSION_KEY, response.asgi_request.session)
+        self.assertContains(response, "anonymous")
+
+    async def test_bad_token(self):
+        params = get_parameters(self.user)
+        params["sesame"] = params["sesame"].lower()
+        response = await self.async_client.get("/async/", params)
+        self.assertNotIn(SESSION_KEY, response.asgi_request.session)
+        self.assertContains(response, "anonymous")
+
+    @override_settings(SESAME_ONE_TIME=True)
+    async def test_reuse_one_time_token(self):
+        params = get_parameters(self.user)
+        response = await self.async_client.get("/async/", params)
+        self.assertIn(SESSION_KEY, response.asgi_request.session)
+        await self.async_client.alogout()
+        response = await self.async_client.get("/async/", params)
+        self.assertNotIn(SESSION_KEY, response.asgi_request.session)
+
+    async def test_token_in_POST_request(self):
+        response = await self.async_client.post("/async/" + get_query_string(self.user))
+        self.assertContains(response, self.user.username)
+
+    @override_settings(SESAME_MIDDLEWARE_EXCLUDE_PATHS=["/async/"])
+    async def test_token_in_excluded_path(self):
+        response = await self.async_client.get("/async/", get_parameters(self.user))
+        self.assertNotIn(SESSION_KEY, response.asgi_request.session)
+        self.assertContains(response, "anonymous")
+
+    @override_settings(MIDDLEWARE=["sesame.middleware.AuthenticationMiddleware"])
+    async def test_without_session_middleware(self):
+        response = await self.async_client.get("/async/", get_parameters(self.user))
+        self.assertEqual(response.asgi_request.user, self.user)
+        self.assertContains(response, self.user.username)
@@ -1,4 +1,5 @@
 import datetime
+from unittest import mock
 
 from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase, override_settings
@@ -24,6 +25,17 @@ class TestSettings(TestCase):
             "or set SESAME_INVALIDATE_ON_PASSWORD_CHANGE to True",
         )
 
+    @override_settings(
+        SESAME_INVALIDATE_ON_PASSWORD_CHANGE=False,
+        SESAME_MAX_AGE=None,
+    )
+    def test_insecure_configuration_prevents_deriving_keys(self):
+        with mock.patch.object(settings, "checked", False):
+            with self.assertRaises(ImproperlyConfigured):
+                settings.SIGNING_KEY
+            with self.assertRaises(ImproperlyConfigured):
+                settings.SIGNING_KEY
+
     @override_settings(
         SESAME_INVALIDATE_ON_EMAIL_CHANGE=True,
         AUTH_USER_MODEL="tests.StrUser",
@@ -36,3 +48,14 @@ class TestSettings(TestCase):
             "invalid configuration: set User.EMAIL_FIELD correctly "
             "or set SESAME_INVALIDATE_ON_EMAIL_CHANGE to False",
         )
+
+    @override_settings(SECRET_KEY="new")
+    def test_derived_settings_follow_settings_changes(self):
+        self.assertEqual(
+            settings.SIGNING_KEY,
+            settings.derive_key("new", settings.KEY),
+        )
+
+    def test_unknown_setting(self):
+        with self.assertRaises(AttributeError):
+            settings.UNKNOWN
@@ -0,0 +1,168 @@
+import http
+from unittest import mock
+
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+from django.test.utils import override_settings
+
+from sesame.throttling import (
+    ais_throttled,
+    arecord_invalid_token,
+    is_throttled,
+    record_invalid_token,
+)
+from sesame.utils import get_parameters
+
+from .mixins import CreateUserMixin
+
+
+@override_settings(SESAME_THROTTLE_LIMIT=2)
+class TestThrottling(CreateUserMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def get_invalid_parameters(self):
+        params = get_parameters(self.user)
+        params["sesame"] = params["sesame"].lower()
+        return params
+
+    def test_throttle_after_limit(self):
+        request = self.factory.get("/", self.get_invalid_parameters())
+        self.assertFalse(is_throttled(request))
+        record_invalid_token(request)
+        request = self.factory.get("/", self.get_invalid_parameters())
+        self.assertFalse(is_throttled(request))
+        record_invalid_token(request)
+        self.assertTrue(is_throttled(request))
+
+    async def test_athrottle_after_limit(self):
+        request = self.factory.get("/", self.get_invalid_parameters())
+        self.assertFalse(await ais_throttled(request))
+        await arecord_invalid_token(request)
+        request = self.factory.get("/", self.get_invalid_parameters())
+        self.assertFalse(await ais_throttled(request))
+        await arecord_invalid_token(request)
+        self.assertTrue(await ais_throttled(request))
+
+    def test_record_invalid_token_once_per_request(self):
+        request = self.factory.get("/", self.get_invalid_parameters())
+        record_invalid_token(request)
+        record_invalid_token(request)
+        self.assertFalse(is_throttled(request))
+
+    async def test_arecord_invalid_token_once_per_request(self):
+        request = self.factory.get("/", self.get_invalid_parameters())
+        await arecord_invalid_token(request)
+        await arecord_invalid_token(request)
+        self.assertFalse(await ais_throttled(request))
+
+    def test_throttle_per_client(self):
+        request = self.factory.get("/", self.get_invalid_parameters())
+        other_request = self.factory.get(
+            "/", self.get_invalid_parameters(), REMOTE_ADDR="192.0.2.1"
+        )
+        for _ in range(2):
+            record_invalid_token(self.factory.get("/", self.get_invalid_parameters()))
+        self.assertTrue(is_throttled(request))
+        self.assertFalse(is_throttled(other_request))
+
+    def test_throttle_per_period(self):
+        request = self.factory.get("/", self.get_invalid_parameters())
+        with mock.patch("time.time", return_value=1_000_000_000):
+            for _ in range(2):
+                record_invalid_token(
+                    self.factory.get("/", self.get_invalid_parameters())
+                )
+            self.assertTrue(is_throttled(request))
+        with mock.patch("time.time", return_value=1_000_000_060):
+            self.assertFalse(is_throttled(request))
+
+    def test_no_throttle_without_token(self):
+        for _ in range(2):
+            record_invalid_token(self.factory.get("/"))
+        self.assertFalse(is_throttled(self.factory.get("/")))
+
+    @override_settings(SESAME_THROTTLE_LIMIT=None)
+    def test_no_throttle_by_default(self):
+        for _ in range(2):
+            record_invalid_token(self.factory.get("/", self.get_invalid_parameters()))
+        request = self.factory.get("/", self.get_invalid_parameters())
+        self.assertFalse(is_throttled(request))
+
+    @override_settings(
+        MIDDLEWARE=[
+            "django.contrib.sessions.middleware.SessionMiddleware",
+            "django.contrib.auth.middleware.AuthenticationMiddleware",
+            "sesame.middleware.AuthenticationMiddleware",
+        ],
+    )
+    def test_middleware(self):
+        params = self.get_invalid_parameters()
+        for _ in range(2):
+            response = self.client.get("/", params)
+            self.assertContains(response, "anonymous")
+        with self.assertNumQueries(0):
+            response = self.client.get("/", get_parameters(self.user))
+        self.assertEqual(response.status_code, http.HTTPStatus.TOO_MANY_REQUESTS)
+        # Requests without a token aren't throttled.
+        response = self.client.get("/")
+        self.assertContains(response, "anonymous")
+
+    @override_settings(
+        MIDDLEWARE=[
+            "django.contrib.sessions.middleware.SessionMiddleware",
+            "django.contrib.auth.middleware.AuthenticationMiddleware",
+            "sesame.middleware.AuthenticationMiddleware",
+        ],
+    )
+    async def test_async_middleware(self):
+        params = self.get_invalid_parameters()
+        for _ in range(2):
+            response = await self.async_client.get("/async/", params)
+            self.assertContains(response, "anonymous")
+        response = await self.async_client.get("/async/", get_parameters(self.user))
+        self.assertNotIn(SESSION_KEY, response.asgi_request.session)
+        self.assertEqual(response.status_code, http.HTTPStatus.TOO_MANY_REQUESTS)
+
+    def test_login_view(self):
+        params = self.get_invalid_parameters()
+        for _ in range(2):
+            response = self.client.get("/login/", params)
+            self.assertEqual(response.status_code, http.HTTPStatus.FORBIDDEN)
+        response = self.client.get("/login/", get_parameters(self.user))
+        self.assertEqual(response.status_code, http.HTTPStatus.TOO_MANY_REQUESTS)
+
+    @override_settings(
+        MIDDLEWARE=[
+            "django.contrib.sessions.middleware.SessionMiddleware",
+            "django.contrib.auth.middleware.AuthenticationMiddleware",
+            "sesame.middleware.AuthenticationMiddleware",
+        ],
+    )
+    def test_middleware_and_decorator(self):
+        params = self.get_invalid_parameters()
+        response = self.client.get("/authenticate/not_required/", params)
+        self.assertContains(response, "anonymous")
+        response = self.client.get("/authenticate/", get_parameters(self.user))
+        self.assertNotEqual(response.status_code, http.HTTPStatus.TOO_MANY_REQUESTS)
+
+    def test_decorator(self):
+        params = self.get_invalid_parameters()
+        for _ in range(2):
+            response = self.client.get("/authenticate/not_required/", params)
+            self.assertContains(response, "anonymous")
+        response = self.client.get("/authenticate/", get_parameters(self.user))
+        self.assertEqual(response.status_code, http.HTTPStatus.TOO_MANY_REQUESTS)
+
+    async def test_async_decorator(self):
+        params = self.get_invalid_parameters()
+        for _ in range(2):
+            response = await self.async_client.get("/authenticate/async/", params)
+            self.assertEqual(response.status_code, http.HTTPStatus.FORBIDDEN)
+        response = await self.async_client.get(
+            "/authenticate/async/", get_parameters(self.user)
+        )
+        self.assertEqual(response.status_code, http.HTTPStatus.TOO_MANY_REQUESTS)
@@ -1,7 +1,23 @@
+import contextlib
+import unittest.mock
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase, override_settings
 
-from sesame import tokens_v1, tokens_v2
-from sesame.tokens import create_token, parse_token
+from sesame import tokens, tokens_v1, tokens_v2, tokens_v3
+from sesame.signals import legacy_token_used
+from sesame.tokens import (
+    BAD_TOKEN,
+    EXPIRED_TOKEN,
+    INVALID_TOKEN,
+    UNKNOWN_USER,
+    aparse_token,
+    create_token,
+    create_tokens,
+    is_legacy_token,
+    parse_token,
+    parse_tokens,
+)
 
 from .mixins import CaptureLogMixin, CreateUserMixin
 
@@ -30,6 +46,22 @@ class TestUtils(CaptureLogMixin, CreateUserMixin, TestCase):
         self.assertTrue(tokens_v1.detect_token(token))
         self.assertFalse(tokens_v2.detect_token(token))
 
+    def test_create_tokens_default_v2(self):
+        (token,) = create_tokens([self.user])
+        self.assertTrue(tokens_v2.detect_token(token))
+        self.assertFalse(tokens_v1.detect_token(token))
+
+    @override_settings(SESAME_TOKENS=["sesame.tokens_v1"])
+    def test_create_tokens_force_v1(self):
+        (token,) = create_tokens([self.user])
+        self.assertTrue(tokens_v1.detect_token(token))
+        self.assertFalse(tokens_v2.detect_token(token))
+
+    @override_settings(SESAME_TOKENS=["tests.custom_tokens"])
+    def test_create_tokens_custom_module(self):
+        (token,) = create_tokens([self.user])
+        self.assertTrue(tokens_v2.detect_token(token))
+
     def test_parse_token_accepts_v2(self):
         token = create_token(self.user)
         user = parse_token(token, self.get_user)
@@ -43,6 +75,48 @@ class TestUtils(CaptureLogMixin, CreateUserMixin, TestCase):
         self.assertEqual(user, self.user)
         self.assertLogsContain("Valid token for user john")
 
+    @override_settings(SESAME_TOKENS=["tests.custom_tokens"])
+    def test_parse_token_accepts_custom_module(self):
+        token = create_token(self.user)
+        user = parse_token(token, self.get_user)
+        self.assertEqual(user, self.user)
+        self.assertLogsContain("Valid token for user john")
+
+    async def test_aparse_token(self):
+        token = create_token(self.user)
+        user = await aparse_token(token, self.aget_user)
+        self.assertEqual(user, self.user)
+        self.assertLogsContain("Valid token for user john")
+
+    @override_settings(SESAME_TOKENS=["tests.custom_tokens"])
+    async def test_aparse_token_accepts_custom_module(self):
+        token = create_token(self.user)
+        user = await aparse_token(token, self.aget_user)
+        self.assertEqual(user, self.user)
+        self.assertLogsContain("Valid token for user john")
+
+    async def test_aparse_token_bad_token(self):
+        user = await aparse_token("~!@#$%^&*~!@#$%^&*~", self.aget_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Bad token: doesn't match a supported format")
+
+    @override_settings(SESAME_TOKEN_CACHE_SIZE=10)
+    async def test_aparse_token_cache_hit(self):
+        token = create_token(self.user)
+        self.assertEqual(await aparse_token(token, self.aget_user), self.user)
+        self.assertEqual(await aparse_token(token, self.aget_user), self.user)
+        self.assertLogsContain("Valid token for user john: cached")
+
+    @override_settings(
+        SESAME_TOKENS=["sesame.tokens_v3", "sesame.tokens_v2", "sesame.tokens_v1"]
+    )
+    def test_parse_token_accepts_v3(self):
+        token = create_token(self.user)
+        self.assertTrue(tokens_v3.detect_token(token))
+        user = parse_token(token, self.get_user)
+        self.assertEqual(user, self.user)
+        self.assertLogsContain("Valid token for user john")
+
     @override_settings(SESAME_TOKENS=["sesame.tokens_v2"])
     def test_parse_token_force_v2(self):
         with override_settings(SESAME_TOKENS=["sesame.tokens_v1"]):
@@ -58,3 +132,334 @@ class TestUtils(CaptureLogMixin, CreateUserMixin, TestCase):
         user = parse_token(token, self.get_user)
         self.assertIsNone(user)
         self.assertLogsContain("Bad token: doesn't match a supported format")
+
+    def test_parse_token_rejects_truncated_token_without_decoding(self):
+        token = create_token(self.user)
+        with unittest.mock.patch("sesame.tokens_v2.decode_token") as decode_token:
+            user = parse_token(token[:-1], self.get_user)
+        self.assertIsNone(user)
+        decode_token.assert_not_called()
+        self.assertLogsContain("Bad token: doesn't match a supported format")
+
+    def test_parse_token_rejects_invalid_characters(self):
+        token = create_token(self.user)
+        user = parse_token(token[:-1] + "=", self.get_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Bad token: doesn't match a supported format")
+
+    @override_settings(SESAME_MAX_AGE=300)
+    def test_parse_token_accepts_v1_max_age(self):
+        with override_settings(SESAME_TOKENS=["sesame.tokens_v1"]):
+            token = create_token(self.user)
+        user = parse_token(token, self.get_user)
+        self.assertEqual(user, self.user)
+        self.assertLogsContain("Valid token for user john")
+
+    @override_settings(
+        SESAME_TOKENS=["sesame.tokens_v3", "sesame.tokens_v2", "sesame.tokens_v1"],
+        AUTH_USER_MODEL="tests.StrUser",
+    )
+    def test_parse_token_accepts_v3_variable_size(self):
+        user = self.create_user("jane")
+        token = create_token(user)
+        self.assertEqual(parse_token(token, self.get_user), user)
+        self.assertLogsContain("Valid token for user jane")
+
+    # Test legacy tokens
+
+    def test_legacy_token_used(self):
+        with override_settings(SESAME_TOKENS=["sesame.tokens_v1"]):
+            token = create_token(self.user)
+        with self.captureLegacyTokens() as senders:
+            self.assertEqual(parse_token(token, self.get_user), self.user)
+        self.assertEqual(senders, [(tokens_v1, self.user)])
+
+    def test_legacy_token_not_used(self):
+        token = create_token(self.user)
+        with self.captureLegacyTokens() as senders:
+            self.assertEqual(parse_token(token, self.get_user), self.user)
+        self.assertEqual(senders, [])
+
+    def test_invalid_legacy_token_not_reported(self):
+        with override_settings(SESAME_TOKENS=["sesame.tokens_v1"]):
+            token = create_token(self.user)
+        self.user.set_password("hunter2")
+        self.user.save()
+        with self.captureLegacyTokens() as senders:
+            self.assertIsNone(parse_token(token, self.get_user))
+        self.assertEqual(senders, [])
+
+    @override_settings(SESAME_TOKEN_CACHE_SIZE=10)
+    def test_legacy_token_used_cached(self):
+        with override_settings(SESAME_TOKENS=["sesame.tokens_v1"]):
+            token = create_token(self.user)
+        with self.captureLegacyTokens() as senders:
+            self.assertEqual(parse_token(token, self.get_user), self.user)
+            self.assertEqual(parse_token(token, self.get_user), self.user)
+        self.assertEqual(senders, [(tokens_v1, self.user), (tokens_v1, self.user)])
+
+    async def test_legacy_token_used_async(self):
+        with override_settings(SESAME_TOKENS=["sesame.tokens_v1"]):
+            token = create_token(self.user)
+        with self.captureLegacyTokens() as senders:
+            self.assertEqual(await aparse_token(token, self.aget_user), self.user)
+        self.assertEqual(senders, [(tokens_v1, self.user)])
+
+    def test_legacy_tokens_used(self):
+        with override_settings(SESAME_TOKENS=["sesame.tokens_v1"]):
+            legacy_token = create_token(self.user)
+        token = create_token(self.user)
+        with self.captureLegacyTokens() as senders:
+            parse_tokens([legacy_token, token], self.get_users)
+        self.assertEqual(senders, [(tokens_v1, self.user)])
+
+    def test_is_legacy_token(self):
+        with override_settings(SESAME_TOKENS=["sesame.tokens_v1"]):
+            legacy_token = create_token(self.user)
+        self.assertTrue(is_legacy_token(legacy_token))
+        self.assertFalse(is_legacy_token(create_token(self.user)))
+        self.assertFalse(is_legacy_token("~!@#$%^&*~!@#$%^&*~"))
+
+    @override_settings(SESAME_TOKENS=["tests.custom_tokens", "sesame.tokens_v1"])
+    def test_parse_token_detects_custom_and_builtin_modules(self):
+        with override_settings(SESAME_TOKENS=["sesame.tokens_v1"]):
+            legacy_token = create_token(self.user)
+        token = create_token(self.user)
+        self.assertFalse(is_legacy_token(token))
+        self.assertTrue(is_legacy_token(legacy_token))
+        self.assertEqual(parse_token(token, self.get_user), self.user)
+        self.assertEqual(parse_token(legacy_token, self.get_user), self.user)
+        self.assertIsNone(parse_token("~!@#$%^&*~!@#$%^&*~", self.get_user))
+
+    @contextlib.contextmanager
+    def captureLegacyTokens(self):
+        senders = []
+
+        def receiver(sender, user, **kwargs):
+            senders.append((sender, user))
+
+        legacy_token_used.connect(receiver)
+        try:
+            yield senders
+        finally:
+            legacy_token_used.disconnect(receiver)
+
+    # Test batch validation
+
+    def get_users(self, user_ids):
+        User = get_user_model()
+        return User.objects.in_bulk(user_ids)
+
+    def test_parse_tokens(self):
+        user1 = self.user
+        user2 = self.create_user("jane")
+        tokens = create_tokens([user1, user2, user1])
+        with self.assertNumQueries(1):
+            results = parse_tokens(tokens, self.get_users)
+        self.assertEqual(results, [(user1, None), (user2, None), (user1, None)])
+
+    @override_settings(SESAME_TOKENS=["tests.custom_tokens"])
+    def test_parse_tokens_custom_module(self):
+        user1 = self.user
+        user2 = self.create_user("jane")
+        user3 = self.create_user("jack")
+        tokens = create_tokens([user1, user2, user3])
+        user2.set_password("hunter2")
+        user2.save()
+        user3.delete()
+        with self.assertNumQueries(1):
+            results = parse_tokens(tokens + ["~!@#$%^&*~!@#$%^&*~"], self.get_users)
+        self.assertEqual(
+            results,
+            [
+                (user1, None),
+                (None, INVALID_TOKEN),
+                (None, UNKNOWN_USER),
+                (None, BAD_TOKEN),
+            ],
+        )
+
+    def test_parse_tokens_v1(self):
+        with override_settings(SESAME_TOKENS=["sesame.tokens_v1"]):
+            (token,) = create_tokens([self.user])
+        self.assertEqual(parse_tokens([token], self.get_users), [(self.user, None)])
+
+    def test_parse_tokens_reports_reasons(self):
+        user1 = self.user
+        user2 = self.create_user("jane")
+        user3 = self.create_user("jack")
+        tokens = create_tokens([user1, user2, user3])
+        user2.delete()
+        user3.set_password("hunter2")
+        user3.save()
+        results = parse_tokens(["~!@#$%^&*~!@#$%^&*~", *tokens], self.get_users)
+        self.assertEqual(
+            results,
+            [
+                (None, BAD_TOKEN),
+                (user1, None),
+                (None, UNKNOWN_USER),
+                (None, INVALID_TOKEN),
+            ],
+        )
+
+    @override_settings(SESAME_MAX_AGE=-300)
+    def test_parse_tokens_expired_token(self):
+        tokens = create_tokens([self.user])
+        with self.assertNumQueries(0):
+            results = parse_tokens(tokens, self.get_users)
+        self.assertEqual(results, [(None, EXPIRED_TOKEN)])
+        self.assertLogsContain("Expired token")
+
+    def test_parse_tokens_scope(self):
+        tokens = create_tokens([self.user], scope="test")
+        self.assertEqual(
+            parse_tokens(tokens, self.get_users, scope="test"),
+            [(self.user, None)],
+        )
+        self.assertEqual(parse_tokens(tokens, self.get_users), [(None, INVALID_TOKEN)])
+
+    def test_parse_tokens_empty(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(parse_tokens([], self.get_users), [])
+
+    # Test token cache
+
+    @override_settings(SESAME_TOKEN_CACHE_SIZE=10)
+    def test_parse_token_cache_hit(self):
+        token = create_token(self.user)
+        self.assertEqual(parse_token(token, self.get_user), self.user)
+        self.assertEqual(parse_token(token, self.get_user), self.user)
+        self.assertLogsContain("Valid token for user john: cached")
+        self.assertEqual(tokens.cache.info()["hits"], 1)
+        self.assertEqual(tokens.cache.info()["misses"], 1)
+
+    @override_settings(SESAME_TOKEN_CACHE_SIZE=10)
+    def test_parse_token_cache_hit_v1(self):
+        with override_settings(SESAME_TOKENS=["sesame.tokens_v1"]):
+            token = create_token(self.user)
+        self.assertEqual(parse_token(token, self.get_user), self.user)
+        self.assertEqual(parse_token(token, self.get_user), self.user)
+        self.assertLogsContain("Valid token for user john: cached")
+
+    @override_settings(SESAME_TOKEN_CACHE_SIZE=10)
+    def test_parse_token_cache_key_includes_scope(self):
+        token = create_token(self.user)
+        self.assertEqual(parse_token(token, self.get_user), self.user)
+        self.assertIsNone(parse_token(token, self.get_user, scope="test"))
+        self.assertEqual(tokens.cache.info()["hits"], 0)
+
+    @override_settings(SESAME_TOKEN_CACHE_SIZE=10)
+    def test_parse_token_cache_checks_revocation_key(self):
+        token = create_token(self.user)
+        self.assertEqual(parse_token(token, self.get_user), self.user)
+        self.user.set_password("hunter2")
+        self.user.save()
+        self.assertIsNone(parse_token(token, self.get_user))
+        self.assertLogsContain("Invalid token for user john: revoked")
+        self.assertEqual(tokens.cache.info()["size"], 0)
+
+    @override_settings(SESAME_TOKEN_CACHE_SIZE=10)
+    def test_parse_token_cache_doesnt_store_revocation_key(self):
+        token = create_token(self.user)
+        self.assertEqual(parse_token(token, self.get_user), self.user)
+        _, revocation_digest = tokens.cache.get((token, "", None))
+        self.assertNotEqual(
+            revocation_digest, tokens_v2.extract_revocation_key(self.user)
+        )
+
+    @override_settings(SESAME_TOKEN_CACHE_SIZE=10)
+    def test_parse_token_cache_checks_user(self):
+        token = create_token(self.user)
+        self.assertEqual(parse_token(token, self.get_user), self.user)
+        self.user.delete()
+        self.assertIsNone(parse_token(token, self.get_user))
+        self.assertLogsContain("Unknown or inactive user")
+
+    @override_settings(SESAME_TOKEN_CACHE_SIZE=10, SESAME_MAX_AGE=300)
+    def test_parse_token_cache_entry_expires_with_token(self):
+        token = create_token(self.user)
+        with unittest.mock.patch("time.monotonic", return_value=0):
+            self.assertEqual(parse_token(token, self.get_user), self.user)
+        (_, expires_at) = next(iter(tokens.cache.entries.values()))
+        self.assertLessEqual(expires_at, 300)
+
+    @override_settings(SESAME_TOKEN_CACHE_SIZE=10)
+    def test_parse_token_cache_invalid_token(self):
+        token = create_token(self.user)
+        token = token[:6] + token[6:].lower()
+        self.assertIsNone(parse_token(token, self.get_user))
+        self.assertEqual(tokens.cache.info()["size"], 0)
+
+    # Test negative cache
+
+    @override_settings(SESAME_NEGATIVE_CACHE_SIZE=10)
+    def test_parse_token_negative_cache_hit(self):
+        token = create_token(self.user)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertIsNone(parse_token(token, self.get_active_user))
+        with self.assertNumQueries(0):
+            self.assertIsNone(parse_token(token, self.get_active_user))
+        self.assertLogsContain("Unknown or inactive user")
+
+    @override_settings(SESAME_NEGATIVE_CACHE_SIZE=10, SESAME_NEGATIVE_CACHE_TTL=60)
+    def test_parse_token_negative_cache_hit_doesnt_extend_expiry(self):
+        token = create_token(self.user)
+        self.user.delete()
+        with unittest.mock.patch("time.monotonic", return_value=0):
+            self.assertIsNone(parse_token(token, self.get_user))
+        with unittest.mock.patch("time.monotonic", return_value=30):
+            with self.assertNumQueries(0):
+                self.assertIsNone(parse_token(token, self.get_user))
+        with unittest.mock.patch("time.monotonic", return_value=60):
+            with self.assertNumQueries(1):
+                self.assertIsNone(parse_token(token, self.get_user))
+
+    @override_settings(SESAME_NEGATIVE_CACHE_SIZE=10, SESAME_NEGATIVE_CACHE_TTL=60)
+    def test_parse_tokens_negative_cache_hit_doesnt_extend_expiry(self):
+        token = create_token(self.user)
+        self.user.delete()
+        with unittest.mock.patch("time.monotonic", return_value=0):
+            parse_tokens([token], self.get_users)
+        with unittest.mock.patch("time.monotonic", return_value=30):
+            with self.assertNumQueries(0):
+                parse_tokens([token], self.get_users)
+        with unittest.mock.patch("time.monotonic", return_value=60):
+            with self.assertNumQueries(1):
+                parse_tokens([token], self.get_users)
+
+    @override_settings(SESAME_NEGATIVE_CACHE_SIZE=10)
+    def test_parse_token_negative_cache_cleared_on_save(self):
+        token = create_token(self.user)
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(parse_token(token, self.get_active_user))
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(parse_token(token, self.get_active_user), self.user)
+
+    @override_settings(SESAME_NEGATIVE_CACHE_SIZE=10)
+    async def test_aparse_token_negative_cache_hit(self):
+        token = create_token(self.user)
+        await self.user.adelete()
+        self.assertIsNone(await aparse_token(token, self.aget_user))
+        self.assertIsNone(await aparse_token(token, self.aget_user))
+        self.assertEqual(tokens.negative_cache.info()["hits"], 1)
+
+    @override_settings(SESAME_NEGATIVE_CACHE_SIZE=10)
+    def test_parse_tokens_negative_cache_hit(self):
+        token = create_token(self.user)
+        self.user.delete()
+        self.assertEqual(parse_tokens([token], self.get_users), [(None, UNKNOWN_USER)])
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                parse_tokens([token], self.get_users),
+                [(None, UNKNOWN_USER)],
+            )
+
+    @staticmethod
+    def get_active_user(user_id):
+        User = get_user_model()
+        return User.objects.filter(pk=user_id, is_active=True).first()
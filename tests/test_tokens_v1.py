@@ -1,11 +1,20 @@
 import datetime
+import unittest.mock
 
+from django.conf import settings
 from django.core import signing
 from django.test import TestCase, override_settings
-from django.utils import timezone
-
-from sesame import packers
-from sesame.tokens_v1 import create_token, detect_token, parse_token
+from django.utils import crypto, timezone
+
+from sesame import packers, tokens_v1
+from sesame.tokens_v1 import (
+    averify_token,
+    create_token,
+    create_tokens,
+    decode_token,
+    detect_token,
+    parse_token,
+)
 
 from .mixins import CaptureLogMixin, CreateUserMixin
 
@@ -18,6 +27,81 @@ class TestTokensV1(CaptureLogMixin, CreateUserMixin, TestCase):
         self.assertEqual(user, self.user)
         self.assertLogsContain("Valid token for user john")
 
+    def test_valid_tokens(self):
+        user1 = self.user
+        user2 = self.create_user("jane")
+        tokens = create_tokens([user1, user2])
+        self.assertEqual(tokens, [create_token(user1), create_token(user2)])
+
+    def test_signature_matches_django_signer(self):
+        token = create_token(self.user)
+        data = token.rpartition(":")[0]
+        signer = signing.Signer(salt="sesame", algorithm="sha1")
+        self.assertEqual(token, signer.sign(data))
+
+    @override_settings(SESAME_MAX_AGE=300)
+    def test_timestamp_signature_matches_django_signer(self):
+        token = create_token(self.user)
+        signer = signing.TimestampSigner(salt="sesame", algorithm="sha1")
+        signer.unsign(token)
+
+    def test_secret_key_fallback_keeps_tokens_valid(self):
+        token = create_token(self.user)
+        with override_settings(
+            SECRET_KEY="new",
+            SECRET_KEY_FALLBACKS=[settings.SECRET_KEY],
+        ):
+            user = parse_token(token, self.get_user)
+        self.assertEqual(user, self.user)
+        self.assertLogsContain("Valid token for user john")
+
+    def test_secret_key_change_invalidates_tokens(self):
+        token = create_token(self.user)
+        with override_settings(SECRET_KEY="new"):
+            user = parse_token(token, self.get_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Bad token")
+
+    # Test revocation keys memo
+
+    def test_revocation_key_is_memoized(self):
+        token = create_token(self.user)
+        with unittest.mock.patch(
+            "django.utils.crypto.pbkdf2", wraps=crypto.pbkdf2
+        ) as pbkdf2:
+            self.assertEqual(parse_token(token, self.get_user), self.user)
+        pbkdf2.assert_not_called()
+
+    def test_revocation_key_memo_follows_password_change(self):
+        token = create_token(self.user)
+        self.user.set_password("hunter2")
+        self.user.save()
+        self.assertIsNone(parse_token(token, self.get_user))
+        self.assertLogsContain("Invalid token")
+
+    @override_settings(SESAME_ITERATIONS=1000)
+    def test_revocation_key_memo_follows_settings(self):
+        token = create_token(self.user)
+        with override_settings(SESAME_ITERATIONS=2000):
+            user = parse_token(token, self.get_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Invalid token")
+
+    async def test_averify_token(self):
+        token = create_token(self.user)
+        tokens_v1.revocation_keys.clear()
+        user_pk, _, payload = decode_token(token)
+        self.assertEqual(user_pk, self.user.pk)
+        self.assertTrue(await averify_token(self.user, payload))
+        self.assertLogsContain("Valid token for user john")
+
+    async def test_averify_token_invalid(self):
+        token = create_token(self.user)
+        self.user.set_password("hunter2")
+        _, _, payload = decode_token(token)
+        self.assertFalse(await averify_token(self.user, payload))
+        self.assertLogsContain("Invalid token")
+
     # Test invalid tokens
 
     def test_invalid_signature(self):
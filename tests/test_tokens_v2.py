@@ -7,10 +7,11 @@ from django.conf import settings
 from django.test import TestCase, override_settings
 from django.utils import timezone
 
-from sesame import packers
+from sesame import packers, tokens_v2
 from sesame.tokens_v2 import (
     TIMESTAMP_OFFSET,
     create_token,
+    create_tokens,
     detect_token,
     get_revocation_key,
     parse_token,
@@ -27,6 +28,24 @@ class TestTokensV2(CaptureLogMixin, CreateUserMixin, TestCase):
         self.assertEqual(user, self.user)
         self.assertLogsContain("Valid token for user john in default scope")
 
+    def test_valid_tokens(self):
+        user1 = self.user
+        user2 = self.create_user("jane")
+        tokens = create_tokens([user1, user2])
+        self.assertEqual(tokens, [create_token(user1), create_token(user2)])
+        self.assertEqual(parse_token(tokens[0], self.get_user), user1)
+        self.assertEqual(parse_token(tokens[1], self.get_user), user2)
+
+    @override_settings(SESAME_MAX_AGE=300)
+    def test_valid_max_age_tokens(self):
+        (token,) = create_tokens([self.user])
+        user = parse_token(token, self.get_user)
+        self.assertEqual(user, self.user)
+
+    def test_valid_scoped_tokens(self):
+        (token,) = create_tokens([self.user], scope="test")
+        self.assertEqual(token, create_token(self.user, scope="test"))
+
     # Test invalid tokens
 
     @override_settings(SESAME_MAX_AGE=300)
@@ -206,6 +225,35 @@ class TestTokensV2(CaptureLogMixin, CreateUserMixin, TestCase):
         self.assertIsNone(user)
         self.assertLogsContain("Invalid token for user john in default scope")
 
+    # Test revocation keys
+
+    @override_settings(SESAME_INVALIDATE_ON_PASSWORD_CHANGE=False)
+    def test_empty_revocation_key(self):
+        self.assertEqual(get_revocation_key(self.user), b"")
+
+    @override_settings(
+        SESAME_INVALIDATE_ON_PASSWORD_CHANGE=False,
+        SESAME_INVALIDATE_ON_EMAIL_CHANGE=True,
+    )
+    def test_revocation_key_from_email(self):
+        self.user.email = "john@example.com"
+        self.assertEqual(get_revocation_key(self.user), b"john@example.com")
+
+    @override_settings(
+        SESAME_INVALIDATE_ON_EMAIL_CHANGE=True,
+        SESAME_ONE_TIME=True,
+    )
+    def test_revocation_key_from_all_fields(self):
+        self.user.email = "john@example.com"
+        self.assertEqual(
+            get_revocation_key(self.user),
+            (
+                self.user.password.rpartition("$")[2]
+                + "john@example.com"
+                + self.user.last_login.isoformat()
+            ).encode(),
+        )
+
     # Test scoped tokens
 
     def test_valid_scoped_token_in_scope(self):
@@ -324,6 +372,24 @@ class TestTokensV2(CaptureLogMixin, CreateUserMixin, TestCase):
         self.assertIsNone(user)
         self.assertLogsContain("Bad token: cannot extract primary key")
 
+    # Test signature size
+
+    @override_settings(SESAME_SIGNATURE_SIZE=16)
+    def test_custom_signature_size(self):
+        token = create_token(self.user)
+        # 4 bytes for the primary key + 16 bytes for the signature
+        self.assertEqual(len(self.decode_token(token)), 20)
+        user = parse_token(token, self.get_user)
+        self.assertEqual(user, self.user)
+        self.assertLogsContain("Valid token for user john in default scope")
+
+    def test_signature_size_change_invalidates_tokens(self):
+        token = create_token(self.user)
+        with override_settings(SESAME_SIGNATURE_SIZE=16):
+            user = parse_token(token, self.get_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Bad token: cannot extract signature")
+
     # Test key rotation
 
     def test_key_change_invalidates_tokens(self):
@@ -362,6 +428,55 @@ class TestTokensV2(CaptureLogMixin, CreateUserMixin, TestCase):
         self.assertIsNone(user)
         self.assertLogsContain("Invalid token for user john in default scope")
 
+    # Test key identifiers
+
+    @override_settings(SESAME_KEY_ID=True)
+    def test_valid_token_with_key_id(self):
+        token = create_token(self.user)
+        self.assertEqual(token[2], "~")
+        self.assertTrue(detect_token(token))
+        user = parse_token(token, self.get_user)
+        self.assertEqual(user, self.user)
+        self.assertLogsContain("Valid token for user john in default scope")
+
+    def test_valid_token_with_key_id_when_disabled(self):
+        with override_settings(SESAME_KEY_ID=True):
+            token = create_token(self.user)
+        user = parse_token(token, self.get_user)
+        self.assertEqual(user, self.user)
+        self.assertLogsContain("Valid token for user john in default scope")
+
+    def test_valid_token_without_key_id_when_enabled(self):
+        token = create_token(self.user)
+        with override_settings(SESAME_KEY_ID=True):
+            user = parse_token(token, self.get_user)
+        self.assertEqual(user, self.user)
+        self.assertLogsContain("Valid token for user john in default scope")
+
+    @override_settings(SESAME_KEY_ID=True)
+    def test_secret_key_fallback_with_key_id_checks_one_key(self):
+        token = create_token(self.user)
+        with override_settings(
+            SECRET_KEY="new",
+            SECRET_KEY_FALLBACKS=["bad", settings.SECRET_KEY],
+        ):
+            with unittest.mock.patch(
+                "sesame.tokens_v2.sign", wraps=tokens_v2.sign
+            ) as sign:
+                user = parse_token(token, self.get_user)
+        self.assertEqual(user, self.user)
+        self.assertEqual(sign.call_count, 1)
+        self.assertLogsContain("Valid token for user john in default scope")
+
+    @override_settings(SESAME_KEY_ID=True)
+    def test_unknown_key_id(self):
+        token = create_token(self.user)
+        with override_settings(SECRET_KEY="new"):
+            with self.assertNumQueries(0):
+                user = parse_token(token, self.get_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Bad token: unknown key identifier")
+
     # Miscellaneous tests
 
     @staticmethod
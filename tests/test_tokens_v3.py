@@ -0,0 +1,183 @@
+import datetime
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from sesame import tokens_v1, tokens_v2
+from sesame.tokens_v3 import create_token, create_tokens, detect_token, parse_token
+
+from .mixins import CaptureLogMixin, CreateUserMixin
+
+
+class TestTokensV3(CaptureLogMixin, CreateUserMixin, TestCase):
+    def test_valid_token(self):
+        token = create_token(self.user)
+        self.assertTrue(detect_token(token))
+        user = parse_token(token, self.get_user)
+        self.assertEqual(user, self.user)
+        self.assertLogsContain("Valid token for user john in default scope")
+
+    def test_valid_tokens(self):
+        user1 = self.user
+        user2 = self.create_user("jane")
+        tokens = create_tokens([user1, user2])
+        self.assertEqual(tokens, [create_token(user1), create_token(user2)])
+        self.assertEqual(parse_token(tokens[0], self.get_user), user1)
+        self.assertEqual(parse_token(tokens[1], self.get_user), user2)
+
+    def test_token_detection(self):
+        token = create_token(self.user)
+        self.assertFalse(tokens_v2.detect_token(token))
+        self.assertFalse(tokens_v1.detect_token(token))
+        self.assertFalse(detect_token(tokens_v2.create_token(self.user)))
+        self.assertFalse(detect_token(tokens_v1.create_token(self.user)))
+
+    # Test invalid tokens
+
+    def test_invalid_base64_string(self):
+        token = "deadbeef-.deadbeef-"
+        self.assertTrue(detect_token(token))
+        user = parse_token(token, self.get_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Bad token: cannot decode token")
+
+    @override_settings(SESAME_MAX_AGE=300)
+    def test_truncated_token_in_timestamp(self):
+        token = create_token(self.user)
+        # Primary key is in bytes 0 - 5 1/3
+        token = token[:7] + token[token.index(".") :]
+        self.assertTrue(detect_token(token))
+        user = parse_token(token, self.get_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Bad token: cannot extract timestamp")
+
+    def test_truncated_token_in_signature(self):
+        token = create_token(self.user)
+        token = token[:-2]
+        self.assertTrue(detect_token(token))
+        user = parse_token(token, self.get_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Bad token: cannot extract signature")
+
+    def test_forged_token_is_rejected_without_query(self):
+        token = create_token(self.user)
+        data, signature = token.split(".")
+        # Alter pre-signature, which is in bytes 4 - 8
+        token = data[:6] + data[6:].swapcase() + "." + signature
+        self.assertTrue(detect_token(token))
+        with self.assertNumQueries(0):
+            user = parse_token(token, self.get_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Bad token: invalid pre-signature in default scope")
+
+    def test_invalid_signature(self):
+        token = create_token(self.user)
+        data, signature = token.split(".")
+        token = data + "." + signature.swapcase()
+        self.assertTrue(detect_token(token))
+        user = parse_token(token, self.get_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Invalid token for user john in default scope")
+
+    def test_unknown_user(self):
+        token = create_token(self.user)
+        self.user.delete()
+        user = parse_token(token, self.get_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Unknown or inactive user: pk = 1")
+
+    # Test token expiry
+
+    @override_settings(SESAME_MAX_AGE=300)
+    def test_valid_max_age_token(self):
+        token = create_token(self.user)
+        user = parse_token(token, self.get_user)
+        self.assertEqual(user, self.user)
+        self.assertLogsContain("Valid token for user john in default scope")
+
+    @override_settings(SESAME_MAX_AGE=-300)
+    def test_expired_max_age_token(self):
+        token = create_token(self.user)
+        with self.assertNumQueries(0):
+            user = parse_token(token, self.get_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Expired token")
+
+    @override_settings(SESAME_MAX_AGE=-300)
+    def test_custom_max_age(self):
+        token = create_token(self.user)
+        max_age = datetime.timedelta(seconds=300)
+        user = parse_token(token, self.get_user, max_age=max_age)
+        self.assertEqual(user, self.user)
+        self.assertLogsContain("Valid token for user john")
+
+    # Test token revocation
+
+    @override_settings(SESAME_ONE_TIME=True)
+    def test_one_time_token_invalidation_when_last_login_date_changes(self):
+        token = create_token(self.user)
+        self.user.last_login = timezone.now() - datetime.timedelta(1800)
+        self.user.save()
+        user = parse_token(token, self.get_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Invalid token for user john in default scope")
+
+    def test_invalid_token_after_password_change(self):
+        token = create_token(self.user)
+        self.user.set_password("hunter2")
+        self.user.save()
+        user = parse_token(token, self.get_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Invalid token for user john in default scope")
+
+    # Test scoped tokens
+
+    def test_valid_scoped_token_in_scope(self):
+        token = create_token(self.user, scope="test")
+        user = parse_token(token, self.get_user, scope="test")
+        self.assertEqual(user, self.user)
+        self.assertLogsContain("Valid token for user john in scope test")
+
+    def test_invalid_scoped_token_in_default_scope(self):
+        token = create_token(self.user, scope="test")
+        with self.assertNumQueries(0):
+            user = parse_token(token, self.get_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Bad token: invalid pre-signature in default scope")
+
+    # Test key rotation
+
+    def test_secret_key_change_invalidates_tokens(self):
+        token = create_token(self.user)
+        with override_settings(SECRET_KEY="new"):
+            with self.assertNumQueries(0):
+                user = parse_token(token, self.get_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Bad token: invalid pre-signature")
+
+    def test_secret_key_fallback_keeps_tokens_valid(self):
+        token = create_token(self.user)
+        with override_settings(
+            SECRET_KEY="new",
+            SECRET_KEY_FALLBACKS=[settings.SECRET_KEY],
+        ):
+            user = parse_token(token, self.get_user)
+        self.assertEqual(user, self.user)
+        self.assertLogsContain("Valid token for user john in default scope")
+
+    # Test signature size
+
+    @override_settings(SESAME_SIGNATURE_SIZE=16)
+    def test_custom_signature_size(self):
+        token = create_token(self.user)
+        user = parse_token(token, self.get_user)
+        self.assertEqual(user, self.user)
+        self.assertLogsContain("Valid token for user john in default scope")
+
+    def test_signature_size_change_invalidates_tokens(self):
+        token = create_token(self.user)
+        with override_settings(SESAME_SIGNATURE_SIZE=16):
+            user = parse_token(token, self.get_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Bad token: cannot extract signature")
@@ -1,10 +1,35 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_login_failed
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
 from django.test import RequestFactory, TestCase, override_settings
 
-from sesame.utils import get_parameters, get_query_string, get_token, get_user
+from sesame import tokens, tokens_v2
+from sesame.backends import SesameBackendMixin
+from sesame.utils import (
+    aget_user,
+    get_parameters,
+    get_query_string,
+    get_token,
+    get_tokens,
+    get_user,
+    get_users,
+    iter_query_strings,
+    warm_up,
+)
 
 from .mixins import CaptureLogMixin, CreateUserMixin
 
 
+class DenyingBackend(SesameBackendMixin):
+    def authenticate(self, request, sesame, scope="", max_age=None):
+        raise PermissionDenied
+
+    def get_user(self, user_id):
+        return None
+
+
 class TestUtils(CaptureLogMixin, CreateUserMixin, TestCase):
     def test_get_token(self):
         self.assertIsInstance(get_token(self.user), str)
@@ -12,6 +37,20 @@ class TestUtils(CaptureLogMixin, CreateUserMixin, TestCase):
     def test_get_scoped_token(self):
         self.assertIsInstance(get_token(self.user, scope="test"), str)
 
+    def test_get_tokens(self):
+        user1 = self.user
+        user2 = self.create_user("jane")
+        self.assertEqual(
+            get_tokens([user1, user2]),
+            [get_token(user1), get_token(user2)],
+        )
+
+    def test_get_tokens_with_scope(self):
+        self.assertEqual(
+            get_tokens([self.user], scope="test"),
+            [get_token(self.user, scope="test")],
+        )
+
     def test_get_parameters(self):
         self.assertEqual(get_parameters(self.user), {"sesame": get_token(self.user)})
 
@@ -32,6 +71,54 @@ class TestUtils(CaptureLogMixin, CreateUserMixin, TestCase):
             "?sesame=" + get_token(self.user, scope="test"),
         )
 
+    def test_iter_query_strings(self):
+        user1 = self.user
+        user2 = self.create_user("jane")
+        User = get_user_model()
+        with self.assertNumQueries(1):
+            query_strings = list(iter_query_strings(User.objects.order_by("pk")))
+        self.assertEqual(
+            query_strings,
+            [
+                (user1.pk, get_query_string(user1)),
+                (user2.pk, get_query_string(user2)),
+            ],
+        )
+
+    def test_iter_query_strings_with_scope(self):
+        User = get_user_model()
+        self.assertEqual(
+            list(iter_query_strings(User.objects.all(), scope="test")),
+            [(self.user.pk, get_query_string(self.user, scope="test"))],
+        )
+
+    def test_iter_query_strings_with_small_chunks(self):
+        users = [self.user] + [self.create_user(f"user{i}") for i in range(4)]
+        User = get_user_model()
+        self.assertEqual(
+            list(iter_query_strings(User.objects.order_by("pk"), chunk_size=2)),
+            [(user.pk, get_query_string(user)) for user in users],
+        )
+
+    @override_settings(
+        SESAME_INVALIDATE_ON_EMAIL_CHANGE=True,
+        SESAME_ONE_TIME=True,
+    )
+    def test_iter_query_strings_with_all_revocation_fields(self):
+        User = get_user_model()
+        self.assertEqual(
+            list(iter_query_strings(User.objects.all())),
+            [(self.user.pk, get_query_string(self.user))],
+        )
+
+    @override_settings(SESAME_PRIMARY_KEY_FIELD="username")
+    def test_iter_query_strings_with_alternative_primary_key(self):
+        User = get_user_model()
+        self.assertEqual(
+            list(iter_query_strings(User.objects.all())),
+            [(self.user.pk, get_query_string(self.user))],
+        )
+
     def test_get_user_no_request_or_token(self):
         with self.assertRaises(TypeError) as exc:
             self.assertIsNone(get_user(None))
@@ -57,6 +144,62 @@ class TestUtils(CaptureLogMixin, CreateUserMixin, TestCase):
         request = RequestFactory().get("/", get_parameters(self.user))
         self.assertEqual(get_user(request), self.user)
 
+    def test_get_user_request_twice(self):
+        request = RequestFactory().get("/", get_parameters(self.user))
+        with self.assertNumQueries(1):
+            self.assertEqual(get_user(request), self.user)
+            self.assertEqual(get_user(request), self.user)
+
+    @override_settings(SESAME_ONE_TIME=True)
+    def test_get_user_request_twice_with_one_time_token(self):
+        request = RequestFactory().get("/", get_parameters(self.user))
+        self.assertEqual(get_user(request), self.user)
+        self.assertIsNone(get_user(request))
+        self.assertLogsContain("Invalid token")
+
+    def test_get_user_sets_backend(self):
+        user = get_user(get_token(self.user))
+        self.assertEqual(user.backend, "sesame.backends.ModelBackend")
+
+    @override_settings(
+        AUTHENTICATION_BACKENDS=[
+            "django.contrib.auth.backends.ModelBackend",
+            "sesame.backends.CachedModelBackend",
+        ]
+    )
+    def test_get_user_sets_backend_to_sesame_backend(self):
+        user = get_user(get_token(self.user))
+        self.assertEqual(user.backend, "sesame.backends.CachedModelBackend")
+
+    @override_settings(
+        AUTHENTICATION_BACKENDS=["django.contrib.auth.backends.ModelBackend"]
+    )
+    def test_get_user_without_sesame_backend(self):
+        self.assertIsNone(get_user(get_token(self.user)))
+
+    @override_settings(
+        AUTHENTICATION_BACKENDS=[
+            "tests.test_utils.DenyingBackend",
+            "sesame.backends.ModelBackend",
+        ]
+    )
+    def test_get_user_permission_denied(self):
+        self.assertIsNone(get_user(get_token(self.user)))
+
+    def test_get_user_sends_user_login_failed(self):
+        request = RequestFactory().get("/", {"sesame": "~!@#$%^&*~!@#$%^&*~"})
+        with mock.patch.object(user_login_failed, "send") as send:
+            self.assertIsNone(get_user(request))
+        send.assert_called_once_with(
+            sender="django.contrib.auth",
+            credentials={
+                "sesame": "~!@#$%^&*~!@#$%^&*~",
+                "scope": "",
+                "max_age": None,
+            },
+            request=request,
+        )
+
     def test_get_user_request_without_token(self):
         request = RequestFactory().get("/")
         self.assertIsNone(get_user(request))
@@ -130,3 +273,115 @@ class TestUtils(CaptureLogMixin, CreateUserMixin, TestCase):
         self.assertEqual(get_user(token, update_last_login=False), self.user)
         self.user.refresh_from_db()
         self.assertEqual(self.user.last_login, last_login)
+
+    def test_get_users(self):
+        user1 = self.user
+        user2 = self.create_user("jane")
+        tokens = get_tokens([user1, user2])
+        with self.assertNumQueries(1):
+            results = get_users(["~!@#$%^&*~!@#$%^&*~", *tokens])
+        self.assertEqual(results, [(None, "bad token"), (user1, None), (user2, None)])
+        self.assertEqual(results[1][0].backend, "sesame.backends.ModelBackend")
+
+    def test_get_users_with_scope(self):
+        tokens = get_tokens([self.user], scope="test")
+        self.assertEqual(get_users(tokens, scope="test"), [(self.user, None)])
+        self.assertEqual(get_users(tokens), [(None, "invalid token")])
+
+    def test_get_users_does_not_update_last_login(self):
+        tokens = get_tokens([self.user])
+        last_login = self.user.last_login
+        self.assertEqual(get_users(tokens), [(self.user, None)])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_login, last_login)
+
+    @override_settings(SESAME_ONE_TIME=True)
+    def test_get_users_invalidates_one_time_tokens(self):
+        user1 = self.user
+        user2 = self.create_user("jane")
+        tokens = get_tokens([user1, user2, user1])
+        last_login = user1.last_login
+        # One query to fetch users and one query to update their last login.
+        with self.assertNumQueries(2):
+            results = get_users(tokens)
+        self.assertEqual(
+            results, [(user1, None), (user2, None), (None, "invalid token")]
+        )
+        user1.refresh_from_db()
+        self.assertGreater(user1.last_login, last_login)
+        self.assertEqual(results[0][0].last_login, user1.last_login)
+        self.assertEqual(
+            get_users(tokens),
+            [(None, "invalid token"), (None, "invalid token"), (None, "invalid token")],
+        )
+
+    @override_settings(
+        AUTHENTICATION_BACKENDS=["django.contrib.auth.backends.ModelBackend"]
+    )
+    def test_get_users_without_sesame_backend(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_users([])
+
+    async def test_aget_user_sets_backend(self):
+        user = await aget_user(get_token(self.user))
+        self.assertEqual(user.backend, "sesame.backends.ModelBackend")
+
+    async def test_aget_user_sends_user_login_failed(self):
+        received = []
+
+        def receiver(**kwargs):
+            received.append(kwargs)
+
+        user_login_failed.connect(receiver)
+        try:
+            self.assertIsNone(await aget_user("~!@#$%^&*~!@#$%^&*~"))
+        finally:
+            user_login_failed.disconnect(receiver)
+        self.assertEqual(len(received), 1)
+
+    async def test_aget_user_token(self):
+        token = get_token(self.user)
+        self.assertEqual(await aget_user(token), self.user)
+
+    async def test_aget_user_bad_token(self):
+        token = "~!@#$%^&*~!@#$%^&*~"
+        self.assertIsNone(await aget_user(token))
+        self.assertLogsContain("Bad token")
+
+    async def test_aget_user_request(self):
+        request = RequestFactory().get("/", get_parameters(self.user))
+        self.assertEqual(await aget_user(request), self.user)
+
+    async def test_aget_user_request_without_token(self):
+        request = RequestFactory().get("/")
+        self.assertIsNone(await aget_user(request))
+
+    async def test_aget_user_inactive_user(self):
+        token = get_token(self.user)
+        self.user.is_active = False
+        await self.user.asave()
+        self.assertIsNone(await aget_user(token))
+        self.assertLogsContain("Unknown or inactive user")
+
+    @override_settings(SESAME_ONE_TIME=True)
+    async def test_aget_user_invalidates_one_time_tokens(self):
+        token = get_token(self.user)
+        self.assertEqual(await aget_user(token), self.user)
+        self.assertIsNone(await aget_user(token))
+        self.assertLogsContain("Invalid token")
+
+    async def test_aget_user_force_update_last_login(self):
+        token = get_token(self.user)
+        last_login = self.user.last_login
+        self.assertEqual(await aget_user(token, update_last_login=True), self.user)
+        await self.user.arefresh_from_db()
+        self.assertGreater(self.user.last_login, last_login)
+
+    @override_settings(SESAME_TOKENS=["sesame.tokens_v2"])
+    def test_warm_up(self):
+        warm_up()
+        self.assertEqual(tokens.get_tokens_module_getter.cache_info().currsize, 1)
+        self.assertEqual(tokens_v2.get_hashers.cache_info().currsize, 1)
+        with self.assertNumQueries(0):
+            get_token(self.user)
+        self.assertEqual(tokens_v2.get_hashers.cache_info().misses, 1)
@@ -23,6 +23,16 @@ class TestLoginView(CreateUserMixin, TestCase):
         self.assertEqual(response.wsgi_request.user, self.user)
         self.assertEqual(response.status_code, http.HTTPStatus.NO_CONTENT)
 
+    @override_settings(SESAME_SKIP_REDUNDANT_LOGIN=True)
+    def test_success_already_logged_in(self):
+        params = get_parameters(self.user)
+        self.client.get("/login/", params)
+        # one query to get the user matching the token
+        with self.assertNumQueries(1):
+            response = self.client.get("/login/", params)
+        self.assertEqual(response.wsgi_request.user, self.user)
+        self.assertRedirects(response, "/login/redirect/url/")
+
     def test_failure_missing_token(self):
         response = self.client.get("/login/")
         self.assertIsInstance(response.wsgi_request.user, AnonymousUser)
@@ -3,7 +3,7 @@ from django.urls import path, re_path
 from sesame.decorators import authenticate
 from sesame.views import LoginView
 
-from .views import show_user
+from .views import ashow_user, show_user
 
 urlpatterns = [
     # For test_decorators.TestAuthenticate
@@ -20,9 +20,20 @@ urlpatterns = [
         r"authenticate/scope/kwarg/(?P<kwarg>[a-z]+)/",
         authenticate(scope="kwarg:{kwarg}")(show_user),
     ),
+    path("authenticate/async/", authenticate(ashow_user)),
+    path(
+        "authenticate/async/not_required/",
+        authenticate(required=False)(ashow_user),
+    ),
+    path("authenticate/async/permanent/", authenticate(permanent=True)(ashow_user)),
+    path(
+        "authenticate/async/no_override/",
+        authenticate(override=False)(ashow_user),
+    ),
     # For test_views.TestLoginView
     path("login/", LoginView.as_view()),
     path("login/no_redirect/", LoginView.as_view(next_page=None)),
     # For test_middleware.TestMiddleware
+    re_path("async/", ashow_user),
     re_path("", show_user),  # catchall pattern
 ]
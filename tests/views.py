@@ -14,3 +14,7 @@ def show_user(request, *args, **kwargs):
         .render(request=request)
     )
     return HttpResponse(content, content_type="text/plain")
+
+
+async def ashow_user(request, *args, **kwargs):
+    return show_user(request, *args, **kwargs)